@@ -0,0 +1,172 @@
+# admission.py
+# Admission control for /hooks/agent: bounded concurrent runs, bounded queue, per-client caps, fast 429s
+# Tim Fraser
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from .metrics import ADMISSION_REJECTIONS, QUEUE_DEPTH, QUEUE_WAIT_SECONDS, REQUEST_SECONDS
+
+
+def _env_int(name: str, default: int, minimum: int = 0) -> int:
+    raw = (os.getenv(name) or "").strip()
+    if raw.isdigit():
+        return max(minimum, int(raw))
+    return default
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = (os.getenv(name) or "").strip()
+    try:
+        return max(0.0, float(raw)) if raw else default
+    except ValueError:
+        return default
+
+
+class Saturated(Exception):
+    """Raised when a run cannot be admitted; the API turns this into 429 + Retry-After."""
+
+    def __init__(self, reason: str, retry_after: int, detail: str) -> None:
+        super().__init__(detail)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+@dataclass
+class Ticket:
+    """Held for the duration of one admitted run; pass back to AdmissionController.release."""
+
+    client_id: str
+    queue_wait_s: float
+
+
+@dataclass
+class AdmissionController:
+    """
+    Limits for one worker process (single event loop, so counters need no lock).
+
+    - **max_running**: agent runs executing at once (AGENT_MAX_CONCURRENT_RUNS).
+    - **max_queued**: requests allowed to wait for a slot (AGENT_MAX_QUEUE_DEPTH); beyond that → 429 at once.
+    - **max_per_client**: running + queued runs per client id (AGENT_MAX_RUNS_PER_CLIENT; 0 = no cap).
+    - **queue_timeout_s**: longest a queued request waits before 429 (AGENT_QUEUE_TIMEOUT_SECONDS).
+    """
+
+    max_running: int = 4
+    max_queued: int = 8
+    max_per_client: int = 2
+    queue_timeout_s: float = 30.0
+    running: int = 0
+    per_client: dict[str, int] = field(default_factory=dict)
+    _waiters: deque[asyncio.Future[None]] = field(default_factory=deque, repr=False)
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_running=_env_int("AGENT_MAX_CONCURRENT_RUNS", 4, minimum=1),
+            max_queued=_env_int("AGENT_MAX_QUEUE_DEPTH", 8),
+            max_per_client=_env_int("AGENT_MAX_RUNS_PER_CLIENT", 2),
+            queue_timeout_s=_env_float("AGENT_QUEUE_TIMEOUT_SECONDS", 30.0),
+        )
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free: mean run time × queue position / slots (1…120)."""
+        mean = REQUEST_SECONDS.mean()
+        if mean <= 0:
+            return 5
+        ahead = self.queued + 1
+        return max(1, min(120, math.ceil(mean * ahead / self.max_running)))
+
+    def _reject(self, reason: str, detail: str) -> Saturated:
+        ADMISSION_REJECTIONS.inc(reason=reason)
+        return Saturated(reason, self.retry_after(), detail)
+
+    async def acquire(self, client_id: str, max_wait_s: float | None = None) -> Ticket:
+        """
+        Admit now, queue (bounded), or raise Saturated without waiting when limits are already hit.
+        `max_wait_s` (e.g. the request deadline's remaining time) can only shorten queue_timeout_s.
+        """
+        if self.max_per_client and self.per_client.get(client_id, 0) >= self.max_per_client:
+            raise self._reject(
+                "per_client",
+                f"Client already has {self.max_per_client} run(s) in progress or queued; retry later.",
+            )
+        if self.running < self.max_running:
+            # Fast path decided synchronously, so concurrent arrivals cannot overbook slots.
+            self.running += 1
+            self.per_client[client_id] = self.per_client.get(client_id, 0) + 1
+            QUEUE_WAIT_SECONDS.observe(0.0)
+            return Ticket(client_id=client_id, queue_wait_s=0.0)
+        if self.queued >= self.max_queued:
+            raise self._reject(
+                "queue_full",
+                f"Server busy: {self.running} run(s) active and {self.queued} queued (limit {self.max_queued}).",
+            )
+
+        self.per_client[client_id] = self.per_client.get(client_id, 0) + 1
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        QUEUE_DEPTH.set(self.queued)
+        t0 = time.perf_counter()
+        wait_s = self.queue_timeout_s if max_wait_s is None else min(self.queue_timeout_s, max_wait_s)
+        try:
+            # release() hands its slot straight to the oldest waiter, so `running` is unchanged here.
+            await asyncio.wait_for(waiter, timeout=wait_s)
+        except asyncio.TimeoutError:
+            self._forget(client_id)
+            if waiter.done() and not waiter.cancelled():
+                self._pass_slot()  # slot arrived as the timeout fired: hand it on instead of leaking it
+            raise self._reject(
+                "queue_timeout",
+                f"No run slot freed within {wait_s:g}s; retry later.",
+            ) from None
+        except BaseException:
+            self._forget(client_id)
+            if waiter.done() and not waiter.cancelled():
+                self._pass_slot()  # cancelled after release() handed us the slot (3.12+ wait_for): pass it on
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            QUEUE_DEPTH.set(self.queued)
+        waited = time.perf_counter() - t0
+        QUEUE_WAIT_SECONDS.observe(waited)
+        return Ticket(client_id=client_id, queue_wait_s=waited)
+
+    def _forget(self, client_id: str) -> None:
+        n = self.per_client.get(client_id, 0) - 1
+        if n > 0:
+            self.per_client[client_id] = n
+        else:
+            self.per_client.pop(client_id, None)
+
+    def release(self, ticket: Ticket) -> None:
+        self._forget(ticket.client_id)
+        self._pass_slot()
+
+    def _pass_slot(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                QUEUE_DEPTH.set(self.queued)
+                return
+        self.running -= 1
+
+    def snapshot(self) -> dict[str, int | float]:
+        return {
+            "max_concurrent_runs": self.max_running,
+            "max_queue_depth": self.max_queued,
+            "max_runs_per_client": self.max_per_client,
+            "queue_timeout_seconds": self.queue_timeout_s,
+            "running": self.running,
+            "queued": self.queued,
+        }
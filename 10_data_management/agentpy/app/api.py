@@ -2,30 +2,72 @@
 # HTTP surface (FastAPI) for the disaster situational brief agent — pairs with loop.py and guardrails.py
 # Tim Fraser
 
+import asyncio
+import json
+import logging
 import os
+import threading
+import time
 import uuid
 from contextlib import asynccontextmanager
-from dataclasses import dataclass, field
 from typing import Annotated, Any, Literal
 
+import httpx
 from dotenv import load_dotenv
 from fastapi import Body, FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel, ConfigDict, Field, field_validator
 
-from .guardrails import MAX_AUTONOMOUS_TURNS, clamp_turns, min_completion_turns
+from .admission import AdmissionController, Saturated, Ticket
+from .brief_cache import BriefCache, cache_control_flags
+from .context import skill_snapshot
+from .guardrails import (
+    MAX_AUTONOMOUS_TURNS,
+    MAX_BATCH_TASKS,
+    Deadline,
+    clamp_deadline,
+    clamp_turns,
+    max_request_seconds,
+    min_completion_turns,
+)
 from .loop import run_research_loop
-from .logging_setup import configure_agent_logging
+from .http_clients import SharedClients, reuse_stats
+from .session_store import SessionStore
+from .tools import SearchCache, preload_search_backend, set_search_client
+from .logging_setup import configure_agent_logging, shutdown_agent_logging
+from .metrics import (
+    REQUEST_SECONDS,
+    REQUESTS_IN_FLIGHT,
+    REQUESTS_TOTAL,
+    TURNS_PER_BRIEF,
+    render_prometheus,
+    span,
+)
 
 # 0. CONFIGURATION ############################################################
 
 load_dotenv()
+log = logging.getLogger("agent")
 
 
 @asynccontextmanager
 async def _lifespan(_app: FastAPI):
     configure_agent_logging()
-    yield
+    skill_snapshot(force=True)  # preload AGENT.md + skills/ before the first request
+    # Heavy search imports load in the background so the port opens (and /health answers) right away.
+    threading.Thread(target=preload_search_backend, name="search-preload", daemon=True).start()
+    # One keep-alive pool per upstream for the whole process: warm TLS connections survive across briefs.
+    clients = SharedClients.open()
+    _app.state.http_clients = clients
+    set_search_client(clients.serper)
+    try:
+        yield
+    finally:
+        set_search_client(None)
+        _app.state.http_clients = None
+        clients.close()
+        shutdown_agent_logging()  # drain queued log records
 
 
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "https://ollama.com").rstrip("/")
@@ -45,7 +87,7 @@ Teaching API for a **disaster situational brief agent**: short, structured open-
 
 ### Runtime behavior
 
-- **Tools:** Ollama-native function calling; **web_search** uses CrewAI **SerperDevTool** (Serper API).
+- **Tools:** Ollama-native function calling; **web_search** uses the Serper API (CrewAI **SerperDevTool**, imported lazily, or a built-in HTTP client).
 - **Sessions:** omit `session_id` on the first request—the server **generates** a UUID and returns it.
 Reuse that `session_id` **only** when resuming after `paused_for_human`, together with the `resume_token`
 from that same response. Successful (`ok`) runs clear server-side session state, so the next brief starts fresh
@@ -80,6 +122,8 @@ app = FastAPI(
     ],
 )
 app.state.run_enabled = True  # toggled via /hooks/control (single-worker demos)
+app.state.admission = AdmissionController.from_env()  # per-worker run / queue / per-client limits
+app.state.brief_cache = BriefCache.from_env()  # opt-in: repeated identical tasks reuse a recent ok brief
 
 
 @app.get("/", include_in_schema=False)
@@ -89,14 +133,7 @@ def root_redirect(request: Request) -> RedirectResponse:
     return RedirectResponse(url=str(docs_url), status_code=307)
 
 
-@dataclass
-class SessionState:
-    messages: list[dict[str, Any]] = field(default_factory=list)
-    paused: bool = False
-    resume_token: str | None = None
-
-
-sessions: dict[str, SessionState] = {}
+sessions = SessionStore()  # paused threads: message deltas + shared content blobs
 
 
 # 1. MODELS ##################################################################
@@ -194,6 +231,70 @@ class AgentBody(BaseModel):
         ),
         examples=[6],
     )
+    deadline_seconds: float | None = Field(
+        None,
+        gt=0,
+        description=(
+            "Optional wall-clock budget for **this** request in seconds, counted from arrival (queue wait included). "
+            "Values above the server cap (**`AGENT_MAX_REQUEST_SECONDS`**, see `GET /health`) are lowered to it; omit for the cap. "
+            "When it runs out, in-flight model/search calls are abandoned and the response is `paused_for_human` "
+            "with `deadline_exceeded: true` and whatever was gathered so far (resume as usual)."
+        ),
+        examples=[90],
+    )
+
+
+class BatchTask(BaseModel):
+    """One new brief inside a batch (no session resume; use `/hooks/agent` for that)."""
+
+    task: str = Field(
+        ...,
+        description="Same meaning as `task` on `/hooks/agent` for a **new** brief (name the incident, area, time window).",
+        min_length=1,
+    )
+    max_turns: int | None = Field(
+        None,
+        ge=1,
+        le=MAX_AUTONOMOUS_TURNS,
+        description=f"Optional per-task turn ceiling (1…{MAX_AUTONOMOUS_TURNS}); omit for the server cap.",
+    )
+    deadline_seconds: float | None = Field(
+        None,
+        gt=0,
+        description="Optional per-task wall-clock budget in seconds (counted from batch arrival); capped like `/hooks/agent`.",
+    )
+
+
+class BatchBody(BaseModel):
+    """Run several independent situational briefs in one call."""
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "examples": [
+                {
+                    "tasks": [
+                        {"task": "Morning snapshot: Cedar River flooding, eastern Iowa, last 24 hours."},
+                        {"task": "Morning snapshot: wildfire evacuations near Paradise, CA, last 12 hours.", "max_turns": 4},
+                    ],
+                    "stream": False,
+                }
+            ]
+        }
+    )
+
+    tasks: list[BatchTask] = Field(
+        ...,
+        min_length=1,
+        max_length=MAX_BATCH_TASKS,
+        description=f"1…{MAX_BATCH_TASKS} briefs. They run concurrently under the server's admission limits.",
+    )
+    stream: bool = Field(
+        False,
+        description=(
+            "**false** — one JSON body with every result in input order plus a summary. "
+            "**true** — `application/x-ndjson`: one line per task as it finishes, then a final `summary` line."
+        ),
+    )
 
 
 ControlBodyDep = Annotated[
@@ -251,16 +352,27 @@ AgentBodyDep = Annotated[
 
 @app.get("/health", tags=["health"], summary="Health check")
 async def health() -> dict[str, Any]:
-    """Returns `ok`, whether new agent runs are allowed, Ollama model name, and max autonomous turn cap."""
+    """Returns `ok`, whether new agent runs are allowed, Ollama model name, max autonomous turn cap, and admission limits/load."""
     return {
         "ok": True,
         "run_enabled": app.state.run_enabled,
         "model": OLLAMA_MODEL,
         "max_autonomous_turns": MAX_AUTONOMOUS_TURNS,
+        "max_request_seconds": max_request_seconds(),
         "min_completion_turns": min_completion_turns(),
+        "admission": app.state.admission.snapshot(),
+        "brief_cache": app.state.brief_cache.snapshot(),
+        "http_reuse": reuse_stats(),
+        "sessions": sessions.snapshot(),
     }
 
 
+@app.get("/metrics", tags=["health"], summary="Prometheus metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Prometheus text format: request/turn/tool latency histograms, turns per brief, prompt size, status counts, in-flight runs."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.post(
     "/hooks/control",
     tags=["agent"],
@@ -281,6 +393,146 @@ async def hooks_control(body: ControlBodyDep) -> JSONResponse:
     return JSONResponse({"ok": True, "run_enabled": False})
 
 
+def _client_id(request: Request) -> str:
+    """Caller identity for per-client caps: X-Client-Id header, else first X-Forwarded-For hop, else peer address."""
+    explicit = (request.headers.get("x-client-id") or "").strip()
+    if explicit:
+        return explicit[:128]
+    forwarded = (request.headers.get("x-forwarded-for") or "").split(",")[0].strip()
+    if forwarded:
+        return forwarded
+    return request.client.host if request.client else "unknown"
+
+
+def _saturated_payload(exc: Saturated, turn_cap: int, session_id: str | None) -> dict[str, Any]:
+    return {
+        "status": "error",
+        "reply": "",
+        "turns_used": 0,
+        "turn_cap": turn_cap,
+        "min_completion_turns": min(min_completion_turns(), turn_cap),
+        "session_id": session_id,
+        "retry_after": exc.retry_after,
+        "detail": exc.detail,
+    }
+
+
+async def _run_admitted(
+    ticket: Ticket,
+    task: str,
+    *,
+    max_turns: int | None,
+    existing_messages: list[dict[str, Any]] | None,
+    continue_thread: bool,
+    deadline: Deadline,
+    http_client: httpx.Client | None = None,
+    search_cache: SearchCache | None = None,
+) -> dict[str, Any]:
+    """
+    Run one admitted loop in the thread pool, record request metrics, and release the admission ticket.
+    The ticket is held until the worker thread returns: cancelling the caller (client gone, batch stream
+    closed) only stops waiting for the result, so admission never counts a still-running loop as free.
+    """
+    if http_client is None:
+        shared: SharedClients | None = getattr(app.state, "http_clients", None)
+        http_client = shared.ollama if shared is not None else None
+    REQUESTS_IN_FLIGHT.inc()
+    t0 = time.perf_counter()
+
+    def finished(fut: asyncio.Future) -> None:
+        REQUESTS_IN_FLIGHT.dec()
+        REQUEST_SECONDS.observe(time.perf_counter() - t0)
+        app.state.admission.release(ticket)
+        if not fut.cancelled() and fut.exception() is not None:
+            REQUESTS_TOTAL.inc(status="error")  # also marks the exception retrieved when nobody awaits it
+
+    # Blocking loop (httpx + tool threads) runs off the event loop so /health and /metrics stay responsive.
+    run = asyncio.ensure_future(
+        run_in_threadpool(
+            run_research_loop,
+            task,
+            ollama_host=OLLAMA_HOST,
+            ollama_api_key=OLLAMA_API_KEY,
+            model=OLLAMA_MODEL,
+            max_turns=max_turns,
+            existing_messages=existing_messages,
+            continue_thread=continue_thread,
+            http_client=http_client,
+            search_cache=search_cache,
+            deadline=deadline,
+        )
+    )
+    run.add_done_callback(finished)
+    result = await asyncio.shield(run)
+    REQUESTS_TOTAL.inc(status=result["status"])
+    TURNS_PER_BRIEF.observe(result["turns_used"], status=result["status"])
+    return result
+
+
+# Fields of an ok brief kept by the brief cache; the rest describe the original run and are reset on a hit.
+_CACHED_FIELDS = ("reply", "turns_used", "min_completion_turns", "prefetch_search_used", "forced_tool_round")
+
+
+def _cached_payload(
+    fields: dict[str, Any], age: float, sid: str, turn_cap: int, deadline: Deadline
+) -> dict[str, Any]:
+    """Response JSON for a brief served from the brief cache (no model calls in this request)."""
+    return {
+        "status": "ok",
+        "reply": fields["reply"],
+        "turns_used": 0,
+        "turn_cap": turn_cap,
+        "session_id": sid,
+        "prefetch_search_used": False,
+        "forced_tool_round": False,
+        "min_completion_turns": fields["min_completion_turns"],
+        "compaction_tokens_saved": 0,
+        "queue_wait_ms": 0.0,
+        "startup_ms": {},
+        "deadline_seconds": deadline.seconds,
+        "deadline_exceeded": False,
+        "resume_token": None,
+        "cache_hit": True,
+        "cache_age_seconds": round(age, 1),
+        "cached_turns_used": fields["turns_used"],
+    }
+
+
+def _finish_brief(
+    result: dict[str, Any], sid: str, turn_cap: int, ticket: Ticket, deadline: Deadline
+) -> dict[str, Any]:
+    """Response JSON for one finished run; stores (paused) or clears (ok / error) the session."""
+    payload: dict[str, Any] = {
+        "status": result["status"],
+        "reply": result["reply"],
+        "turns_used": result["turns_used"],
+        "turn_cap": turn_cap,
+        "session_id": sid,
+        "prefetch_search_used": result.get("prefetch_search_used", False),
+        "forced_tool_round": result.get("forced_tool_round", False),
+        "min_completion_turns": result.get("min_completion_turns", 1),
+        "compaction_tokens_saved": result.get("compaction_tokens_saved", 0),
+        "queue_wait_ms": round(ticket.queue_wait_s * 1000.0, 1),
+        "startup_ms": result.get("startup_ms", {}),
+        "deadline_seconds": deadline.seconds,
+        "deadline_exceeded": result.get("deadline_exceeded", False),
+    }
+    if result.get("detail"):
+        payload["detail"] = result["detail"]
+
+    with span("session_save", status=result["status"]):
+        if result["status"] == "paused_for_human":
+            resume = result.get("resume_token")
+            sessions.save_paused(sid, result.get("messages") or [], resume)
+            payload["resume_token"] = resume
+        elif result["status"] == "ok":
+            sessions.drop(sid)
+            payload["resume_token"] = None
+        else:
+            sessions.drop(sid)
+    return payload
+
+
 @app.post(
     "/hooks/agent",
     tags=["agent"],
@@ -291,10 +543,17 @@ async def hooks_control(body: ControlBodyDep) -> JSONResponse:
         "`turns_used` counts **Ollama /api/chat** round-trips only (tool follow-ups included); it does not count prefetch or the optional server-injected read_skill round. "
         "`turn_cap` is the effective ceiling for this request (from optional `max_turns` or the server default). "
         "`min_completion_turns` is the minimum LLM rounds before `END_BRIEF` is accepted (may trigger a verification nudge). "
+        "`startup_ms` times each pre-LLM phase (prefetch, forced read_skill, system prompt, optional warm-up) and their parallel total. "
+        "`queue_wait_ms` is how long the request waited for a run slot. "
+        "`compaction_tokens_saved` estimates prompt tokens removed by thread compaction in this request. "
+        "`deadline_seconds` is the effective wall-clock budget; `deadline_exceeded` is true when it cut the run short "
+        "(status `paused_for_human`). "
+        "`cache_hit` is true when an identical recent `ok` brief was returned from the opt-in brief cache "
+        "(then also `cache_age_seconds` and `cached_turns_used`; send `Cache-Control: no-cache` to force a fresh run). "
         "`resume_token` is present only when paused. `detail` explains errors or pause reason."
     ),
 )
-async def hooks_agent(body: AgentBodyDep) -> JSONResponse:
+async def hooks_agent(body: AgentBodyDep, request: Request) -> JSONResponse:
     """
     Runs the bounded Ollama loop for one user **`task`**.
 
@@ -302,11 +561,20 @@ async def hooks_agent(body: AgentBodyDep) -> JSONResponse:
 
     1. Send **`task`** only → server assigns **`session_id`** in the response.
     2. If **`status`** is **`ok`**, the brief is done; session state is cleared.
-    3. If **`status`** is **`paused_for_human`** (turn budget hit), send **`session_id`**, **`resume_token`**, and a new **`task`** to continue the same thread.
+    3. If **`status`** is **`paused_for_human`** (turn budget or deadline hit), send **`session_id`**, **`resume_token`**, and a new **`task`** to continue the same thread.
+
+    When the server is saturated (run slots, queue depth, or the per-client cap), the response is **429** with a
+    **`Retry-After`** header instead of waiting.
+
+    With the brief cache on (**`AGENT_BRIEF_CACHE_TTL_SECONDS`**), a new task matching a recent `ok` brief (same
+    normalized text, model and skill set) is answered from cache without a run slot; **`Cache-Control: no-cache`**
+    forces a fresh run and **`no-store`** also keeps its result out of the cache.
     """
+    deadline = Deadline.after(clamp_deadline(body.deadline_seconds))  # starts now, so queue wait counts
     turn_cap = clamp_turns(body.max_turns)
 
     if not app.state.run_enabled:
+        REQUESTS_TOTAL.inc(status="rejected")
         return JSONResponse(
             {
                 "status": "error",
@@ -320,6 +588,7 @@ async def hooks_agent(body: AgentBodyDep) -> JSONResponse:
             status_code=503,
         )
     if not OLLAMA_API_KEY:
+        REQUESTS_TOTAL.inc(status="error")
         return JSONResponse(
             {
                 "status": "error",
@@ -334,58 +603,181 @@ async def hooks_agent(body: AgentBodyDep) -> JSONResponse:
         )
 
     sid = body.session_id or str(uuid.uuid4())
-    state = sessions.get(sid)
+    with span("session_load"):
+        state = sessions.get(sid)
 
-    if state and state.paused:
+    if state is not None:
         if not body.resume_token or body.resume_token != state.resume_token:
             raise HTTPException(status_code=403, detail="Invalid or missing resume_token for paused session")
-        result = run_research_loop(
-            body.task,
-            ollama_host=OLLAMA_HOST,
-            ollama_api_key=OLLAMA_API_KEY,
-            model=OLLAMA_MODEL,
-            max_turns=body.max_turns,
-            existing_messages=state.messages,
-            continue_thread=True,
-        )
+        with span("session_rebuild"):
+            existing_messages, continue_thread = sessions.messages(sid), True
     else:
         if body.resume_token and not state:
             raise HTTPException(status_code=404, detail="Unknown session_id for resume_token")
-        result = run_research_loop(
+        existing_messages, continue_thread = None, False
+
+    cache: BriefCache = app.state.brief_cache
+    cache_key = None
+    skip_lookup, skip_store = cache_control_flags(request.headers.get("cache-control"))
+    if cache.enabled and not continue_thread:
+        cache_key = BriefCache.key(body.task, OLLAMA_MODEL, skill_snapshot().version)
+        hit = None if skip_lookup else cache.get(cache_key)
+        if hit is not None:
+            fields, age = hit
+            REQUESTS_TOTAL.inc(status="cached")
+            return JSONResponse(
+                _cached_payload(fields, age, sid, turn_cap, deadline),
+                headers={"X-Cache": "HIT", "Age": str(int(age))},
+            )
+        if skip_store:
+            cache_key = None
+
+    admission: AdmissionController = app.state.admission
+    try:
+        ticket = await admission.acquire(_client_id(request), max_wait_s=deadline.remaining())
+    except Saturated as exc:
+        REQUESTS_TOTAL.inc(status="rejected")
+        return JSONResponse(
+            _saturated_payload(exc, turn_cap, body.session_id),
+            status_code=429,
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+
+    if continue_thread and not sessions.claim(sid, body.resume_token):
+        # Another request resumed this thread while we waited for a slot; a replayed resume_token cannot fork it.
+        app.state.admission.release(ticket)
+        raise HTTPException(status_code=404, detail="Unknown session_id for resume_token")
+
+    try:
+        result = await _run_admitted(
+            ticket,
             body.task,
-            ollama_host=OLLAMA_HOST,
-            ollama_api_key=OLLAMA_API_KEY,
-            model=OLLAMA_MODEL,
             max_turns=body.max_turns,
-            existing_messages=None,
-            continue_thread=False,
+            existing_messages=existing_messages,
+            continue_thread=continue_thread,
+            deadline=deadline,
         )
+    except BaseException:
+        # The run never reached _finish_brief: leave a claimed thread resumable, as it was before the claim.
+        if continue_thread:
+            sessions.unclaim(sid, body.resume_token)
+        raise
+    payload = _finish_brief(result, sid, turn_cap, ticket, deadline)
+    payload["cache_hit"] = False
+    headers: dict[str, str] = {}
+    if cache.enabled:
+        headers["X-Cache"] = "BYPASS" if skip_lookup or continue_thread else "MISS"
+        if cache_key is not None and result["status"] == "ok":
+            cache.put(cache_key, {k: payload[k] for k in _CACHED_FIELDS})
+    code = 200 if result["status"] != "error" else 500
+    return JSONResponse(payload, status_code=code, headers=headers)
 
-    payload: dict[str, Any] = {
-        "status": result["status"],
-        "reply": result["reply"],
-        "turns_used": result["turns_used"],
-        "turn_cap": turn_cap,
-        "session_id": sid,
-        "prefetch_search_used": result.get("prefetch_search_used", False),
-        "forced_tool_round": result.get("forced_tool_round", False),
-        "min_completion_turns": result.get("min_completion_turns", 1),
-    }
-    if result.get("detail"):
-        payload["detail"] = result["detail"]
 
-    if result["status"] == "paused_for_human":
-        resume = result.get("resume_token")
-        sessions[sid] = SessionState(messages=result.get("messages") or [], paused=True, resume_token=resume)
-        payload["resume_token"] = resume
-    elif result["status"] == "ok":
-        sessions.pop(sid, None)
-        payload["resume_token"] = None
-    else:
-        sessions.pop(sid, None)
+def _batch_concurrency(admission: AdmissionController) -> int:
+    """Parallel tasks per batch: AGENT_BATCH_CONCURRENCY, else the per-client cap (or run slots when uncapped)."""
+    raw = (os.getenv("AGENT_BATCH_CONCURRENCY") or "").strip()
+    if raw.isdigit() and int(raw) >= 1:
+        return int(raw)
+    return admission.max_per_client or admission.max_running
 
-    code = 200 if result["status"] != "error" else 500
-    return JSONResponse(payload, status_code=code)
+
+@app.post(
+    "/hooks/agent/batch",
+    tags=["agent"],
+    summary="Run several new situational briefs concurrently",
+    response_description=(
+        "Aggregated: `results` (input order; each has `index`, `http_status`, `elapsed_ms` and the same fields as "
+        "`/hooks/agent`) and `summary` (status counts, wall time, shared search-cache hits). "
+        "Streamed (`stream: true`): NDJSON, one result per line as tasks finish, then `{\"summary\": …}`."
+    ),
+)
+async def hooks_agent_batch(body: BatchBody, request: Request) -> Any:
+    """
+    Runs each **`task`** as a new brief. Tasks share the server's HTTP connection pools and one web-search cache
+    (identical queries across the batch hit Serper once) and each passes through the same admission control as
+    `/hooks/agent`, so a task that cannot get a slot comes back with `http_status: 429` and `retry_after`.
+    Paused tasks keep their `session_id` / `resume_token` and are resumed through `/hooks/agent`.
+    """
+    if not app.state.run_enabled:
+        return JSONResponse({"ok": False, "detail": "Agent is stopped; POST /hooks/control with start."}, status_code=503)
+    if not OLLAMA_API_KEY:
+        return JSONResponse(
+            {"ok": False, "detail": "OLLAMA_API_KEY is not set. Add it to .env for Ollama Cloud."}, status_code=500
+        )
+
+    admission: AdmissionController = app.state.admission
+    client_id = _client_id(request)
+    limit = asyncio.Semaphore(_batch_concurrency(admission))
+    search_cache = SearchCache()
+    t_batch = time.perf_counter()
+
+    async def run_one(index: int, item: BatchTask) -> dict[str, Any]:
+        deadline = Deadline.after(clamp_deadline(item.deadline_seconds))  # tasks start together, before the limiter
+        turn_cap = clamp_turns(item.max_turns)
+        sid = str(uuid.uuid4())
+        t0 = time.perf_counter()
+        async with limit:
+            try:
+                ticket = await admission.acquire(client_id, max_wait_s=deadline.remaining())
+            except Saturated as exc:
+                REQUESTS_TOTAL.inc(status="rejected")
+                out = _saturated_payload(exc, turn_cap, None)
+                out.update(index=index, http_status=429, elapsed_ms=round((time.perf_counter() - t0) * 1000.0, 1))
+                return out
+            try:
+                result = await _run_admitted(
+                    ticket,
+                    item.task,
+                    max_turns=item.max_turns,
+                    existing_messages=None,
+                    continue_thread=False,
+                    deadline=deadline,
+                    search_cache=search_cache,
+                )
+            except Exception as exc:  # one failed task becomes an error item, not a failed batch
+                log.exception("batch task %s failed", index)
+                result = {"status": "error", "reply": "", "turns_used": 0, "detail": f"{type(exc).__name__}: {exc}"}
+        out = _finish_brief(result, sid, turn_cap, ticket, deadline)
+        out.update(
+            index=index,
+            http_status=200 if result["status"] != "error" else 500,
+            elapsed_ms=round((time.perf_counter() - t0) * 1000.0, 1),
+        )
+        return out
+
+    def summary(results: list[dict[str, Any]]) -> dict[str, Any]:
+        counts: dict[str, int] = {}
+        for r in results:
+            key = "rejected" if r.get("http_status") == 429 else r["status"]
+            counts[key] = counts.get(key, 0) + 1
+        return {
+            "tasks": len(body.tasks),
+            "status_counts": counts,
+            "elapsed_ms": round((time.perf_counter() - t_batch) * 1000.0, 1),
+            "search_cache_hits": search_cache.hits,
+            "search_cache_misses": search_cache.misses,
+        }
+
+    pending = [asyncio.ensure_future(run_one(i, item)) for i, item in enumerate(body.tasks)]
+
+    if body.stream:
+
+        async def ndjson():
+            done: list[dict[str, Any]] = []
+            try:
+                for fut in asyncio.as_completed(pending):
+                    r = await fut
+                    done.append(r)
+                    yield json.dumps(r, ensure_ascii=False) + "\n"
+                yield json.dumps({"summary": summary(done)}, ensure_ascii=False) + "\n"
+            finally:
+                for fut in pending:
+                    fut.cancel()
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    results = await asyncio.gather(*pending)
+    return JSONResponse({"results": list(results), "summary": summary(list(results))})
 
 
 # Run locally (from the agentpy/ folder):
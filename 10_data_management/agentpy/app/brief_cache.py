@@ -0,0 +1,89 @@
+# brief_cache.py
+# Opt-in cache of finished `ok` briefs so repeated identical tasks (dashboards, retries) skip the loop
+# Tim Fraser
+
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any
+
+from .metrics import BRIEF_CACHE_LOOKUPS
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name) or "").strip()
+    return int(raw) if raw.isdigit() else default
+
+
+def normalize_task(task: str) -> str:
+    """Case- and whitespace-insensitive task text, so trivially different retries share one entry."""
+    return " ".join((task or "").lower().split())
+
+
+def cache_control_flags(header: str | None) -> tuple[bool, bool]:
+    """
+    (skip_lookup, skip_store) from a request Cache-Control header:
+    **no-cache** / **max-age=0** run fresh (and refresh the entry); **no-store** also keeps the result out.
+    """
+    directives = {d.strip().lower() for d in (header or "").split(",") if d.strip()}
+    no_store = "no-store" in directives
+    return (no_store or "no-cache" in directives or "max-age=0" in directives), no_store
+
+
+@dataclass
+class BriefCache:
+    """
+    LRU map of (normalized task, model, skill snapshot version) → response fields of an `ok` brief.
+
+    - **ttl_s**: seconds an entry is served (AGENT_BRIEF_CACHE_TTL_SECONDS; **0** = cache off, the default).
+    - **max_entries**: LRU bound (AGENT_BRIEF_CACHE_MAX_ENTRIES, default 256).
+
+    Used only from the event loop (one worker), so it needs no lock.
+    """
+
+    ttl_s: int = 0
+    max_entries: int = 256
+    _entries: "OrderedDict[tuple[str, str, int], tuple[float, dict[str, Any]]]" = field(
+        default_factory=OrderedDict, repr=False
+    )
+
+    @classmethod
+    def from_env(cls) -> "BriefCache":
+        return cls(
+            ttl_s=_env_int("AGENT_BRIEF_CACHE_TTL_SECONDS", 0),
+            max_entries=max(1, _env_int("AGENT_BRIEF_CACHE_MAX_ENTRIES", 256)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_s > 0
+
+    @staticmethod
+    def key(task: str, model: str, skills_version: int) -> tuple[str, str, int]:
+        return (normalize_task(task), model, skills_version)
+
+    def get(self, key: tuple[str, str, int]) -> tuple[dict[str, Any], float] | None:
+        """(cached fields, age in seconds) while fresh; expired entries are dropped."""
+        hit = self._entries.get(key)
+        if hit is None:
+            BRIEF_CACHE_LOOKUPS.inc(result="miss")
+            return None
+        stored_at, fields = hit
+        age = time.monotonic() - stored_at
+        if age > self.ttl_s:
+            del self._entries[key]
+            BRIEF_CACHE_LOOKUPS.inc(result="expired")
+            return None
+        self._entries.move_to_end(key)
+        BRIEF_CACHE_LOOKUPS.inc(result="hit")
+        return dict(fields), age
+
+    def put(self, key: tuple[str, str, int], fields: dict[str, Any]) -> None:
+        self._entries[key] = (time.monotonic(), dict(fields))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def snapshot(self) -> dict[str, int]:
+        return {"ttl_seconds": self.ttl_s, "max_entries": self.max_entries, "entries": len(self._entries)}
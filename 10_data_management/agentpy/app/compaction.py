@@ -0,0 +1,155 @@
+# compaction.py
+# Bound prompt growth across turns: elide stale tool output and superseded brief drafts (keeps reference URLs)
+# Tim Fraser
+
+import json
+import os
+from typing import Any
+
+# Rough tokens-per-character ratio for English + markdown; good enough to decide when to compact.
+_CHARS_PER_TOKEN = 4
+# Per-message framing overhead (role, separators) added by chat templates.
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+# Section markers produced by tools._assemble_search_payload / tools.compact_serper_payload
+# and loop._wrap_task_with_prefetch.
+_SEARCH_BODY_MARKERS = ("\n\n### Search tool output (raw)\n\n", "\n\n### Search evidence (compacted)\n\n")
+_TASK_MARKER = "\n\n=== Task ===\n"
+
+ELIDED_PREFIX = "[compacted]"
+
+
+def estimate_tokens(text: str) -> int:
+    """Heuristic token count (~4 chars per token); avoids shipping a tokenizer."""
+    if not text:
+        return 0
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def message_tokens(message: dict[str, Any]) -> int:
+    """Estimated tokens for one chat message (content + any tool_calls payload)."""
+    n = _MESSAGE_OVERHEAD_TOKENS + estimate_tokens(str(message.get("content") or ""))
+    calls = message.get("tool_calls")
+    if calls:
+        try:
+            n += estimate_tokens(json.dumps(calls, ensure_ascii=False))
+        except (TypeError, ValueError):
+            n += estimate_tokens(str(calls))
+    return n
+
+
+def thread_tokens(messages: list[dict[str, Any]]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+def compaction_enabled() -> bool:
+    """AGENT_COMPACTION: default on; 0/false/no/off disables."""
+    flag = os.getenv("AGENT_COMPACTION", "1").strip().lower()
+    return flag not in ("0", "false", "no", "off")
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name) or "").strip()
+    return int(raw) if raw.isdigit() else default
+
+
+def compaction_trigger_tokens() -> int:
+    """Only compact once the estimated thread exceeds this many tokens (AGENT_COMPACT_TRIGGER_TOKENS)."""
+    return _env_int("AGENT_COMPACT_TRIGGER_TOKENS", 6000)
+
+
+def compaction_keep_turns() -> int:
+    """
+    Most recent assistant turns whose tool output stays verbatim (AGENT_COMPACT_KEEP_TURNS, at least 1):
+    the newest turn's tool results must reach the model once before they can be elided.
+    """
+    return max(1, _env_int("AGENT_COMPACT_KEEP_TURNS", 2))
+
+
+def _elide_search_content(content: str) -> str | None:
+    """
+    Drop the Serper body (raw or compacted evidence) but keep the `Retrieved URLs for References` block
+    (and the `=== Task ===` section of a prefetch-wrapped user message).
+    """
+    for marker in _SEARCH_BODY_MARKERS:
+        head, sep, rest = content.partition(marker)
+        if sep:
+            break
+    else:
+        return None
+    tail = ""
+    _raw, task_sep, task = rest.partition(_TASK_MARKER)
+    if task_sep:
+        tail = _TASK_MARKER + task
+    return f"{head}\n\n{ELIDED_PREFIX} search output elided; the reference URL block above is kept.{tail}"
+
+
+def _elide_message(message: dict[str, Any], superseded: bool) -> str | None:
+    """Replacement content for a stale message, or None to keep it verbatim."""
+    content = str(message.get("content") or "")
+    if not content or content.startswith(ELIDED_PREFIX) or f"\n\n{ELIDED_PREFIX}" in content:
+        return None
+    role = message.get("role")
+    if role in ("tool", "user"):
+        compact = _elide_search_content(content)
+        if compact is not None:
+            return compact
+    if role == "tool":
+        name = message.get("tool_name") or message.get("name") or "tool"
+        if name == "web_search":
+            return None  # no raw section (disabled / error text): already short
+        if name == "read_skill":
+            return None  # skill reads are capped per request; eliding one would push the model to re-read it
+        return (
+            f"{ELIDED_PREFIX} earlier {name} output ({len(content)} chars) elided to save context; "
+            f"call {name} again if you need it."
+        )
+    if role == "assistant" and superseded and not message.get("tool_calls"):
+        return f"{ELIDED_PREFIX} earlier brief draft elided; superseded by a later draft below."
+    return None
+
+
+def compact_messages(messages: list[dict[str, Any]]) -> dict[str, int]:
+    """
+    Compact `messages` in place when the thread is over the trigger size.
+
+    - The system message and the last `compaction_keep_turns()` assistant turns stay verbatim.
+    - Older tool output and prefetch blocks keep only their **Retrieved URLs for References** block;
+      **read_skill** output is never elided.
+    - Older assistant drafts are elided when a later assistant draft exists.
+
+    Returns `{"tokens_before", "tokens_after", "tokens_saved"}` (estimates).
+    """
+    before = thread_tokens(messages)
+    stats = {"tokens_before": before, "tokens_after": before, "tokens_saved": 0}
+    if not compaction_enabled() or before <= compaction_trigger_tokens():
+        return stats
+
+    assistant_idx = [i for i, m in enumerate(messages) if m.get("role") == "assistant"]
+    keep = compaction_keep_turns()
+    if len(assistant_idx) <= keep:
+        return stats
+    cutoff = assistant_idx[-keep]
+
+    draft_idx = [
+        i for i in assistant_idx if str(messages[i].get("content") or "").strip() and not messages[i].get("tool_calls")
+    ]
+    last_draft = draft_idx[-1] if draft_idx else -1
+
+    saved = 0
+    for i in range(cutoff):
+        m = messages[i]
+        if m.get("role") == "system":
+            continue
+        new_content = _elide_message(m, superseded=i < last_draft)
+        if new_content is None:
+            continue
+        old_tokens = message_tokens(m)
+        compacted = dict(m)
+        compacted["content"] = new_content
+        messages[i] = compacted
+        saved += max(0, old_tokens - message_tokens(compacted))
+
+    stats["tokens_saved"] = saved
+    stats["tokens_after"] = before - saved
+    return stats
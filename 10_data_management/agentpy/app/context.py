@@ -1,10 +1,13 @@
 # context.py
-# Load AGENT.md and enumerate skill files for the system prompt
+# Load AGENT.md and enumerate skill files for the system prompt (cached registry, mtime hot reload)
 # Tim Fraser
 
 import os
+import threading
+import time
+from dataclasses import dataclass, field
 
-from .guardrails import agent_root, skills_dir
+from .guardrails import agent_root, check_skill_basename, read_skill_file, skills_dir
 
 _FALLBACK_AGENT = """You assist disaster response coordinators with brief open-source situational summaries.
 
@@ -42,10 +45,9 @@ def list_skill_basenames() -> list[str]:
     return out
 
 
-def build_system_prompt() -> str:
-    """Full system message: AGENT.md plus an appendix listing loadable skill files."""
-    base = load_agent_instructions().strip()
-    skills = list_skill_basenames()
+def _compose_system_prompt(base: str, skills: list[str]) -> str:
+    """AGENT.md text plus an appendix listing loadable skill files."""
+    base = base.strip()
     if not skills:
         appendix = "\n\n## Available skills\n\n_No skill `.md` files found under `skills/`._"
     else:
@@ -55,3 +57,103 @@ def build_system_prompt() -> str:
             f"{lines}\n\nCall `read_skill` with the **filename** exactly as listed (e.g. `disaster_situational_brief.md`)."
         )
     return base + appendix
+
+
+# SKILL REGISTRY ###########################################################
+# AGENT.md + skills/*.md are read once and served from memory. A cheap stat() scan, at most every
+# AGENT_SKILL_RELOAD_SECONDS (default 2), picks up edits without a restart.
+
+
+@dataclass(frozen=True)
+class SkillSnapshot:
+    """Everything the hot path needs from disk, loaded in one pass."""
+
+    version: int
+    signature: tuple[tuple[str, int, int], ...]
+    system_prompt: str
+    skills: dict[str, str] = field(default_factory=dict)
+
+    def read(self, basename: str) -> str:
+        """Same contract as guardrails.read_skill_file, served from memory."""
+        check_skill_basename(basename)
+        if basename not in self.skills:
+            raise ValueError(f"Skill not found: {basename}")
+        return self.skills[basename]
+
+
+_lock = threading.Lock()
+_snapshot: SkillSnapshot | None = None
+_checked_at = 0.0
+
+
+def _reload_interval() -> float | None:
+    """Seconds between mtime scans; None disables reload (AGENT_SKILL_RELOAD_SECONDS=off)."""
+    raw = (os.getenv("AGENT_SKILL_RELOAD_SECONDS") or "2").strip().lower()
+    if raw in ("off", "false", "no", "never"):
+        return None
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        return 2.0
+
+
+def _scan_signature() -> tuple[tuple[str, int, int], ...]:
+    """(name, mtime_ns, size) for AGENT.md and every skills/*.md — stat only, no reads."""
+    out: list[tuple[str, int, int]] = []
+    agent_md = agent_root() / "AGENT.md"
+    try:
+        st = agent_md.stat()
+        out.append(("AGENT.md", st.st_mtime_ns, st.st_size))
+    except OSError:
+        out.append(("AGENT.md", 0, -1))
+    root = skills_dir()
+    if root.is_dir():
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.name.endswith(".md") and entry.is_file():
+                    st = entry.stat()
+                    out.append((f"skills/{entry.name}", st.st_mtime_ns, st.st_size))
+    return tuple(sorted(out))
+
+
+def _load_snapshot(version: int, signature: tuple[tuple[str, int, int], ...]) -> SkillSnapshot:
+    skills: dict[str, str] = {}
+    root = skills_dir()
+    if root.is_dir():
+        for name in sorted(os.listdir(root)):
+            try:
+                skills[name] = read_skill_file(name)
+            except ValueError:
+                continue
+    prompt = _compose_system_prompt(load_agent_instructions(), list_skill_basenames())
+    return SkillSnapshot(version=version, signature=signature, system_prompt=prompt, skills=skills)
+
+
+def skill_snapshot(force: bool = False) -> SkillSnapshot:
+    """
+    Current registry snapshot. First call (or `force=True`) loads from disk; later calls return the
+    cached snapshot and only rescan mtimes once the reload interval has passed.
+    """
+    global _snapshot, _checked_at
+    snap = _snapshot
+    interval = _reload_interval()
+    now = time.monotonic()
+    if snap is not None and not force:
+        if interval is None or now - _checked_at < interval:
+            return snap
+    with _lock:
+        snap = _snapshot
+        if snap is not None and not force and interval is not None and now - _checked_at < interval:
+            return snap
+        sig = _scan_signature()
+        if snap is None or force or sig != snap.signature:
+            version = 1 if snap is None else snap.version + 1
+            snap = _load_snapshot(version, sig)
+            _snapshot = snap
+        _checked_at = time.monotonic()
+        return snap
+
+
+def build_system_prompt() -> str:
+    """Full system message: AGENT.md plus an appendix listing loadable skill files (precomputed)."""
+    return skill_snapshot().system_prompt
@@ -4,6 +4,8 @@
 
 import os
 import re
+import time
+from dataclasses import dataclass
 from pathlib import Path
 
 # Topic: AI for Data Management — keep guardrails obvious and readable for systems engineers.
@@ -11,6 +13,12 @@ from pathlib import Path
 MAX_AUTONOMOUS_TURNS = 10
 MAX_WEB_SEARCHES_PER_REQUEST = 3
 MAX_SKILL_READS_PER_REQUEST = 8
+# Tool calls from one assistant turn run concurrently up to this many threads (AGENT_TOOL_WORKERS overrides).
+MAX_PARALLEL_TOOL_CALLS = 4
+# Tasks accepted by one POST /hooks/agent/batch call.
+MAX_BATCH_TASKS = 10
+# Wall-clock ceiling for one request; a client deadline_seconds is capped here (AGENT_MAX_REQUEST_SECONDS overrides).
+MAX_REQUEST_SECONDS = 300.0
 
 # Activity root: parent of this package (AGENT.md, skills/, logs/ live here).
 _SKILLS_DIR_NAME = "skills"
@@ -29,15 +37,20 @@ def skills_dir() -> Path:
     return agent_root() / _SKILLS_DIR_NAME
 
 
+def check_skill_basename(basename: str) -> None:
+    """Raise ValueError unless basename matches ^[a-zA-Z0-9_-]+\\.md$."""
+    if not basename or not isinstance(basename, str):
+        raise ValueError("Skill name must be a non-empty string.")
+    if not _SKILL_BASENAME_PATTERN.fullmatch(basename):
+        raise ValueError("Invalid skill filename (use basename like evidence_brief.md).")
+
+
 def read_skill_file(basename: str) -> str:
     """
     Read skills/{basename} if basename matches ^[a-zA-Z0-9_-]+\\.md$.
     Raises ValueError if invalid or file missing.
     """
-    if not basename or not isinstance(basename, str):
-        raise ValueError("Skill name must be a non-empty string.")
-    if not _SKILL_BASENAME_PATTERN.fullmatch(basename):
-        raise ValueError("Invalid skill filename (use basename like evidence_brief.md).")
+    check_skill_basename(basename)
     full = (skills_dir() / basename).resolve()
     try:
         full.relative_to(skills_dir().resolve())
@@ -79,3 +92,50 @@ def task_size_ok(task: str, max_chars: int | None = None) -> bool:
     """Optional coarse limit on prompt injection / huge payloads."""
     limit = max_chars if max_chars is not None else int(os.getenv("AGENT_MAX_TASK_CHARS", "8000"))
     return isinstance(task, str) and 0 < len(task) <= limit
+
+
+def max_request_seconds() -> float:
+    """Server cap on one request's wall time: AGENT_MAX_REQUEST_SECONDS (default MAX_REQUEST_SECONDS)."""
+    raw = (os.getenv("AGENT_MAX_REQUEST_SECONDS") or "").strip()
+    try:
+        value = float(raw) if raw else MAX_REQUEST_SECONDS
+    except ValueError:
+        return MAX_REQUEST_SECONDS
+    return value if value > 0 else MAX_REQUEST_SECONDS
+
+
+def clamp_deadline(requested: float | None) -> float:
+    """Clamp a client deadline (seconds) to [1, max_request_seconds()]; None → the server cap."""
+    cap = max_request_seconds()
+    if requested is None:
+        return cap
+    try:
+        n = float(requested)
+    except (TypeError, ValueError):
+        return cap
+    return max(1.0, min(n, cap))
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """
+    Absolute end time for one request (monotonic clock). Model and tool calls take `timeout(cap)`,
+    so the time they may use shrinks as the request goes on.
+    """
+
+    seconds: float
+    expires_at: float
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(seconds=seconds, expires_at=time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def timeout(self, cap: float) -> float:
+        """Per-call timeout: the smaller of `cap` and the time left (floored at 1 ms once time is up)."""
+        return max(0.001, min(cap, self.remaining()))
@@ -0,0 +1,104 @@
+# http_clients.py
+# Long-lived httpx clients shared by every request (Ollama, Serper) with pool limits, optional HTTP/2, reuse stats
+# Tim Fraser
+
+import importlib.util
+import os
+from dataclasses import dataclass
+from typing import Any
+
+import httpx
+
+from .metrics import HTTP_CONNECTIONS_OPENED, HTTP_UPSTREAM_REQUESTS
+
+UPSTREAMS = ("ollama", "serper")
+
+
+def _env_int(name: str, default: int, minimum: int = 1) -> int:
+    raw = (os.getenv(name) or "").strip()
+    return max(minimum, int(raw)) if raw.isdigit() else default
+
+
+def http2_enabled() -> bool:
+    """
+    AGENT_HTTP2: **auto** (default) uses HTTP/2 when the `h2` package is installed (`httpx[http2]`); **0** disables.
+    httpx negotiates HTTP/2 over TLS (ALPN) and falls back to HTTP/1.1, so plain-http local Ollama is unaffected.
+    """
+    flag = (os.getenv("AGENT_HTTP2") or "auto").strip().lower()
+    if flag in ("0", "false", "no", "off"):
+        return False
+    return importlib.util.find_spec("h2") is not None
+
+
+def pool_limits() -> httpx.Limits:
+    """
+    AGENT_HTTP_MAX_CONNECTIONS (default 20), AGENT_HTTP_MAX_KEEPALIVE (default 10) and
+    AGENT_HTTP_KEEPALIVE_SECONDS (default 60) per upstream client.
+    """
+    return httpx.Limits(
+        max_connections=_env_int("AGENT_HTTP_MAX_CONNECTIONS", 20),
+        max_keepalive_connections=_env_int("AGENT_HTTP_MAX_KEEPALIVE", 10, minimum=0),
+        keepalive_expiry=float(_env_int("AGENT_HTTP_KEEPALIVE_SECONDS", 60, minimum=0)),
+    )
+
+
+def _instrument(upstream: str) -> dict[str, list[Any]]:
+    """Event hooks that count requests and newly opened TCP connections (httpcore trace) per upstream."""
+
+    def trace(event: str, _info: dict[str, Any]) -> None:
+        if event == "connection.connect_tcp.complete":
+            HTTP_CONNECTIONS_OPENED.inc(upstream=upstream)
+
+    def on_request(request: httpx.Request) -> None:
+        request.extensions["trace"] = trace
+
+    def on_response(response: httpx.Response) -> None:
+        HTTP_UPSTREAM_REQUESTS.inc(upstream=upstream, http_version=response.http_version)
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def make_client(upstream: str) -> httpx.Client:
+    """One pooled, instrumented client; callers still pass per-call timeouts."""
+    return httpx.Client(
+        http2=http2_enabled(),
+        limits=pool_limits(),
+        timeout=httpx.Timeout(120.0, connect=10.0),
+        event_hooks=_instrument(upstream),
+    )
+
+
+def reuse_stats() -> dict[str, dict[str, Any]]:
+    """Per upstream: requests, new TCP connections, reuse rate (1 − connections / requests), requests by HTTP version."""
+    out: dict[str, dict[str, Any]] = {}
+    for upstream in UPSTREAMS:
+        versions = {
+            v: int(HTTP_UPSTREAM_REQUESTS.value(upstream=upstream, http_version=v))
+            for v in ("HTTP/1.1", "HTTP/2")
+            if HTTP_UPSTREAM_REQUESTS.value(upstream=upstream, http_version=v)
+        }
+        requests = sum(versions.values())
+        opened = int(HTTP_CONNECTIONS_OPENED.value(upstream=upstream))
+        out[upstream] = {
+            "requests": requests,
+            "connections_opened": opened,
+            "reuse_rate": round(1.0 - opened / requests, 4) if requests else None,
+            "by_http_version": versions,
+        }
+    return out
+
+
+@dataclass
+class SharedClients:
+    """Application-lifespan clients: opened in api._lifespan, closed on shutdown."""
+
+    ollama: httpx.Client
+    serper: httpx.Client
+
+    @classmethod
+    def open(cls) -> "SharedClients":
+        return cls(ollama=make_client("ollama"), serper=make_client("serper"))
+
+    def close(self) -> None:
+        self.ollama.close()
+        self.serper.close()
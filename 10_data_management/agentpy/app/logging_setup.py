@@ -1,65 +1,240 @@
 # logging_setup.py
-# Optional file logging for agent turn trace (see AGENT_LOG_FILE).
+# Optional file logging for agent turn trace (see AGENT_LOG_FILE) — queued, so disk I/O stays off the request path.
 # Tim Fraser
 
 from __future__ import annotations
 
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
+import re
 import sys
+import threading
+from datetime import datetime, timezone
 from pathlib import Path
 
 from .guardrails import agent_root
+from .metrics import LOG_RECORDS_DROPPED
 
 _LOGGER_NAME = "agent"
 _CONFIGURED = False
+_LISTENER: logging.handlers.QueueListener | None = None
+_QUEUE_HANDLER: logging.Handler | None = None
+_LOCK = threading.Lock()
+
+# Strip common secret shapes from strings before writing to the agent log file (defense in depth).
+# Server env API keys are never passed into log calls; this covers user/model text and error messages.
+# Runs in the listener thread (formatter), not on the request thread.
+_BEARER_RE = re.compile(r"(?i)Bearer\s+[A-Za-z0-9._\-~+/=]{12,}")
+_SK_RE = re.compile(r"\b(sk-[A-Za-z0-9]{20,})\b")
+_KV_SECRET_RE = re.compile(
+    r"(?i)\b(apikey|api_key|authorization|secret|password|token)\s*[=:]\s*\S{8,}"
+)
+
+# Argument types left for the listener to interpolate; anything else is rendered on the caller's thread.
+_PLAIN_ARG_TYPES = (str, int, float, bool, type(None))
+
+# LogRecord attributes that are not user `extra=` fields.
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+def redact_secrets(text: object) -> str:
+    """Remove likely secrets from text before it is written (user task, tool I/O previews, exceptions)."""
+    s = str(text) if text is not None else ""
+    if not s:
+        return s
+    s = _BEARER_RE.sub("Bearer [REDACTED]", s)
+    s = _SK_RE.sub("[REDACTED]", s)
+    s = _KV_SECRET_RE.sub(lambda m: f"{m.group(1)}=[REDACTED]", s)
+    return s
+
+
+class RedactingTextFormatter(logging.Formatter):
+    """Classic one-line text format, redacted."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact_secrets(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, thread, message, plus any `extra=` fields. Redacted."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out: dict[str, object] = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": redact_secrets(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and key != "sample":
+                out[key] = value if isinstance(value, (int, float, bool)) or value is None else redact_secrets(value)
+        if record.exc_info:
+            out["exc"] = redact_secrets(self.formatException(record.exc_info))
+        elif record.exc_text:
+            out["exc"] = redact_secrets(record.exc_text)
+        return json.dumps(out, ensure_ascii=False)
+
+
+class _SampleFilter(logging.Filter):
+    """Keep only a fraction of records logged with extra={'sample': True} (high-volume tool previews)."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0 or not getattr(record, "sample", False):
+            return True
+        return random.random() < self.rate
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Never blocks the caller: when the queue is full (e.g. the disk stalled) the record is dropped and
+    counted in `agent_log_records_dropped_total`.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Hand the record to the listener unformatted (the stock prepare() runs the formatter here).
+        Plain-typed args stay for the listener to interpolate; other args are rendered now, since the
+        objects may change or not pickle. A traceback is flattened to exc_text for the same reason.
+        """
+        record = copy.copy(record)
+        if record.args and not (
+            isinstance(record.args, tuple) and all(isinstance(a, _PLAIN_ARG_TYPES) for a in record.args)
+        ):
+            record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name) or "").strip()
+    return int(raw) if raw.isdigit() else default
+
+
+def _sample_rate() -> float:
+    raw = (os.getenv("AGENT_LOG_SAMPLE_TOOL_PREVIEWS") or "1").strip()
+    try:
+        return min(1.0, max(0.0, float(raw)))
+    except ValueError:
+        return 1.0
+
+
+def _file_handler(path: Path) -> logging.Handler:
+    """
+    AGENT_LOG_ROTATE: **size** (default; AGENT_LOG_MAX_BYTES, AGENT_LOG_BACKUPS), **time**
+    (AGENT_LOG_ROTATE_WHEN, default midnight; AGENT_LOG_BACKUPS), or **none**.
+    """
+    mode = (os.getenv("AGENT_LOG_ROTATE") or "size").strip().lower()
+    backups = _env_int("AGENT_LOG_BACKUPS", 5)
+    if mode == "none":
+        return logging.FileHandler(path, encoding="utf-8")
+    if mode == "time":
+        when = (os.getenv("AGENT_LOG_ROTATE_WHEN") or "midnight").strip()
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backups, encoding="utf-8", utc=True
+        )
+    max_bytes = _env_int("AGENT_LOG_MAX_BYTES", 10 * 1024 * 1024)
+    return logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
 
 
 def configure_agent_logging() -> None:
     """
-    Attach a FileHandler to logger 'agent' if enabled.
+    Attach a non-blocking QueueHandler to logger 'agent' if enabled; a QueueListener thread does
+    formatting, redaction and file writes.
 
     - **AGENT_LOG_FILE** unset: write to **logs/agent.log** under activity root.
     - **AGENT_LOG_FILE** set to empty, 0, off, false, no: disable file logging.
     - Otherwise: path; relative paths are resolved under activity root.
     - **AGENT_LOG_LEVEL**: default INFO.
+    - **AGENT_LOG_FORMAT**: **json** (default, one object per line) or **text**.
+    - **AGENT_LOG_ROTATE** / **AGENT_LOG_MAX_BYTES** / **AGENT_LOG_BACKUPS**: see `_file_handler`.
+    - **AGENT_LOG_SAMPLE_TOOL_PREVIEWS**: fraction (0–1) of tool preview lines kept (default 1).
+    - **AGENT_LOG_QUEUE_SIZE**: records buffered before new ones are dropped (default 10000).
 
     Idempotent; on OSError (e.g. read-only deploy) logs a warning to stderr and skips the file.
     """
-    global _CONFIGURED
+    global _CONFIGURED, _LISTENER, _QUEUE_HANDLER
     if _CONFIGURED:
         return
+    with _LOCK:
+        if _CONFIGURED:
+            return
+
+        raw = os.getenv("AGENT_LOG_FILE")
+        if raw is not None:
+            stripped = raw.strip()
+            if stripped.lower() in ("", "0", "off", "false", "no"):
+                _CONFIGURED = True
+                return
+            path = Path(stripped)
+        else:
+            path = agent_root() / "logs" / "agent.log"
+
+        if not path.is_absolute():
+            path = agent_root() / path
+
+        level_name = (os.getenv("AGENT_LOG_LEVEL") or "INFO").strip().upper()
+        level = getattr(logging, level_name, logging.INFO)
+
+        logger = logging.getLogger(_LOGGER_NAME)
+        logger.setLevel(level)
 
-    raw = os.getenv("AGENT_LOG_FILE")
-    if raw is not None:
-        stripped = raw.strip()
-        if stripped.lower() in ("", "0", "off", "false", "no"):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fh = _file_handler(path)
+        except OSError as exc:
+            print(f"agent logging: could not open {path}: {exc}", file=sys.stderr)
             _CONFIGURED = True
             return
-        path = Path(stripped)
-    else:
-        path = agent_root() / "logs" / "agent.log"
 
-    if not path.is_absolute():
-        path = agent_root() / path
+        fh.setLevel(level)
+        if (os.getenv("AGENT_LOG_FORMAT") or "json").strip().lower() == "text":
+            fh.setFormatter(RedactingTextFormatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+        else:
+            fh.setFormatter(JsonFormatter())
 
-    level_name = (os.getenv("AGENT_LOG_LEVEL") or "INFO").strip().upper()
-    level = getattr(logging, level_name, logging.INFO)
+        q: queue.Queue[logging.LogRecord] = queue.Queue(maxsize=_env_int("AGENT_LOG_QUEUE_SIZE", 10000))
+        qh = _DroppingQueueHandler(q)
+        qh.setLevel(level)
+        qh.addFilter(_SampleFilter(_sample_rate()))
+        logger.addHandler(qh)
+        _QUEUE_HANDLER = qh
 
-    logger = logging.getLogger(_LOGGER_NAME)
-    logger.setLevel(level)
-
-    try:
-        path.parent.mkdir(parents=True, exist_ok=True)
-        fh = logging.FileHandler(path, encoding="utf-8")
-    except OSError as exc:
-        print(f"agent logging: could not open {path}: {exc}", file=sys.stderr)
+        _LISTENER = logging.handlers.QueueListener(q, fh, respect_handler_level=True)
+        _LISTENER.start()
+        atexit.register(shutdown_agent_logging)
         _CONFIGURED = True
-        return
 
-    fh.setLevel(level)
-    fh.setFormatter(
-        logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"),
-    )
-    logger.addHandler(fh)
-    _CONFIGURED = True
+
+def shutdown_agent_logging() -> None:
+    """Flush queued records and stop the listener thread (FastAPI shutdown / interpreter exit)."""
+    global _CONFIGURED, _LISTENER, _QUEUE_HANDLER
+    with _LOCK:
+        listener, qh = _LISTENER, _QUEUE_HANDLER
+        _LISTENER, _QUEUE_HANDLER = None, None
+        _CONFIGURED = False
+    if qh is not None:
+        logging.getLogger(_LOGGER_NAME).removeHandler(qh)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
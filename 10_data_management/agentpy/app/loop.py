@@ -2,26 +2,35 @@
 # Multi-turn disaster situational brief loop against Ollama — tools, guardrails, AGENT.md
 # Tim Fraser
 
+import contextlib
 import json
 import logging
 import os
 import re
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Any
 
 import httpx
 
+from .compaction import compact_messages
 from .context import build_system_prompt
 from .guardrails import (
     MAX_AUTONOMOUS_TURNS,
+    MAX_PARALLEL_TOOL_CALLS,
     MAX_SKILL_READS_PER_REQUEST,
     MAX_WEB_SEARCHES_PER_REQUEST,
+    Deadline,
+    clamp_deadline,
     clamp_turns,
     min_completion_turns,
     task_size_ok,
 )
 from .logging_setup import configure_agent_logging
+from .metrics import PROMPT_TOKENS, TOOL_SECONDS, TURN_SECONDS, span
 from .tools import (
+    SearchCache,
     ollama_tool_definitions,
     parse_function_arguments,
     run_read_skill,
@@ -29,17 +38,15 @@ from .tools import (
 )
 
 log = logging.getLogger("agent")
-
-# Strip common secret shapes from strings before writing to the agent log file (defense in depth).
-# Server env API keys are never passed into log calls; this covers user/model text and error messages.
-_BEARER_RE = re.compile(r"(?i)Bearer\s+[A-Za-z0-9._\-~+/=]{12,}")
-_SK_RE = re.compile(r"\b(sk-[A-Za-z0-9]{20,})\b")
-_KV_SECRET_RE = re.compile(
-    r"(?i)\b(apikey|api_key|authorization|secret|password|token)\s*[=:]\s*\S{8,}"
-)
+# Log lines carry raw previews; secret redaction runs in logging_setup's formatter on the listener thread.
 
 END_MARKER = "END_BRIEF"
 
+# Per-call ceilings; a request deadline can only shorten them (see guardrails.Deadline).
+CHAT_TIMEOUT_SECONDS = 120.0
+SEARCH_TIMEOUT_SECONDS = 10.0
+WARMUP_TIMEOUT_SECONDS = 30.0
+
 # Injected when the model emits END_BRIEF before min LLM rounds (see min_completion_turns()).
 _VERIFICATION_NUDGE = (
     "Do **not** finish yet: the server requires more **model rounds** before it accepts END_BRIEF. "
@@ -49,17 +56,6 @@ _VERIFICATION_NUDGE = (
 )
 
 
-def _redact_for_log(text: object) -> str:
-    """Remove likely secrets from text before logging (user task, tool I/O previews, exceptions)."""
-    s = str(text) if text is not None else ""
-    if not s:
-        return s
-    s = _BEARER_RE.sub("Bearer [REDACTED]", s)
-    s = _SK_RE.sub("[REDACTED]", s)
-    s = _KV_SECRET_RE.sub(lambda m: f"{m.group(1)}=[REDACTED]", s)
-    return s
-
-
 def _preview(text: str, limit: int = 200) -> str:
     s = (text or "").replace("\n", " ").strip()
     if len(s) <= limit:
@@ -74,7 +70,12 @@ def _args_preview(args: dict[str, Any]) -> str:
         return _preview(str(args), 300)
 
 
-def _maybe_prefetch_web(task: str, search_left: list[int]) -> str | None:
+def _maybe_prefetch_web(
+    task: str,
+    search_left: list[int],
+    cache: SearchCache | None = None,
+    deadline: Deadline | None = None,
+) -> str | None:
     """
     One automatic Serper query before the first model call (counts against search cap).
     Disabled when AGENT_PREFETCH_WEB_SEARCH is 0/false/no/off.
@@ -82,13 +83,31 @@ def _maybe_prefetch_web(task: str, search_left: list[int]) -> str | None:
     flag = os.getenv("AGENT_PREFETCH_WEB_SEARCH", "1").strip().lower()
     if flag in ("0", "false", "no", "off"):
         return None
-    if search_left[0] <= 0:
+    if search_left[0] <= 0 or (deadline is not None and deadline.expired()):
         return None
     search_left[0] -= 1
     q = (task or "").strip()
     if len(q) > 800:
         q = q[:800]
-    return run_web_search(q if q else "disaster emergency situational update")
+    timeout = deadline.timeout(SEARCH_TIMEOUT_SECONDS) if deadline is not None else None
+    return run_web_search(q if q else "disaster emergency situational update", cache, timeout)
+
+
+_VERBATIM_URL_RE = re.compile(r"URL \(verbatim\): `([^`]+)`")
+
+
+def _gathered_sources(messages: list[dict[str, Any]], limit: int = 10) -> str:
+    """Reply text for a run cut off before any draft: the reference URLs retrieved so far."""
+    urls: list[str] = []
+    for m in messages:
+        for url in _VERBATIM_URL_RE.findall(str(m.get("content") or "")):
+            if url not in urls:
+                urls.append(url)
+    if not urls:
+        return ""
+    lines = ["Request deadline reached before a draft brief. Sources retrieved so far:"]
+    lines.extend(f"{i}. {u}" for i, u in enumerate(urls[:limit], 1))
+    return "\n".join(lines)
 
 
 def _wrap_task_with_prefetch(task: str, prefetch: str | None) -> str:
@@ -106,13 +125,17 @@ def _wrap_task_with_prefetch(task: str, prefetch: str | None) -> str:
     )
 
 
-def _dispatch_tool(
+def _claim_tool_slot(
     name: str,
-    args: dict[str, Any],
     search_left: list[int],
     skill_left: list[int],
-) -> str:
-    """Run one tool; enforce per-request caps via mutable single-element lists."""
+) -> str | None:
+    """
+    Decrement the per-request cap for one tool call (mutable single-element lists).
+
+    Returns the cap / unknown-tool message when the call must not run, else None.
+    Always called on the loop thread, in tool_calls order, so budgets stay exact under concurrency.
+    """
     if name == "web_search":
         if search_left[0] <= 0:
             return (
@@ -120,7 +143,7 @@ def _dispatch_tool(
                 "Finish the brief without new URLs or state that search was capped."
             )
         search_left[0] -= 1
-        return run_web_search(str(args.get("query", "")))
+        return None
     if name == "read_skill":
         if skill_left[0] <= 0:
             return (
@@ -128,48 +151,134 @@ def _dispatch_tool(
                 "Complete the brief from context already in the thread."
             )
         skill_left[0] -= 1
-        return run_read_skill(str(args.get("filename", "")))
+        return None
     return f"Unknown tool {name!r}; use read_skill or web_search only."
 
 
-def _inject_forced_read_skill_round(
-    messages: list[dict[str, Any]],
+def _execute_tool(
+    name: str,
+    args: dict[str, Any],
+    cache: SearchCache | None = None,
+    deadline: Deadline | None = None,
+) -> str:
+    """Run one tool whose slot was already claimed (safe to call from a worker thread)."""
+    with span("tool", histogram=TOOL_SECONDS, labels={"tool": name}, tool=name):
+        if name == "web_search":
+            timeout = deadline.timeout(SEARCH_TIMEOUT_SECONDS) if deadline is not None else None
+            return run_web_search(str(args.get("query", "")), cache, timeout)
+        return run_read_skill(str(args.get("filename", "")))
+
+
+def _deadline_tool_result(name: str) -> str:
+    return (
+        f"{name}: request deadline reached before this call finished; "
+        "do not retry it in this request. Finish the brief from what is already in the thread."
+    )
+
+
+def _dispatch_tool(
+    name: str,
+    args: dict[str, Any],
     search_left: list[int],
     skill_left: list[int],
-) -> bool:
+) -> str:
+    """Run one tool; enforce per-request caps via mutable single-element lists."""
+    refused = _claim_tool_slot(name, search_left, skill_left)
+    if refused is not None:
+        return refused
+    return _execute_tool(name, args)
+
+
+def _tool_workers() -> int:
+    """
+    Thread count for tool calls from one assistant turn (AGENT_TOOL_WORKERS, default
+    MAX_PARALLEL_TOOL_CALLS). Set 1 to dispatch sequentially.
+    """
+    raw = (os.getenv("AGENT_TOOL_WORKERS") or "").strip()
+    if raw.isdigit() and int(raw) >= 1:
+        return int(raw)
+    return MAX_PARALLEL_TOOL_CALLS
+
+
+def _dispatch_tool_calls(
+    calls: list[tuple[str, dict[str, Any]]],
+    search_left: list[int],
+    skill_left: list[int],
+    cache: SearchCache | None = None,
+    deadline: Deadline | None = None,
+) -> list[str]:
     """
-    Append a synthetic assistant tool_calls + tool turn so the first LLM call always
+    Run every (name, args) call from one assistant turn; results come back in the same order.
+
+    Slots are claimed up front in order (first calls win when a cap is hit), then the
+    claimed calls run concurrently—each web_search is a network round-trip. Calls still
+    running when `deadline` passes are abandoned and answered with a deadline message.
+    """
+    results: list[str | None] = [None] * len(calls)
+    pending: list[int] = []
+    for i, (name, _args) in enumerate(calls):
+        refused = _claim_tool_slot(name, search_left, skill_left)
+        if refused is None:
+            pending.append(i)
+        else:
+            results[i] = refused
+
+    workers = min(_tool_workers(), len(pending))
+    if workers <= 1:
+        for i in pending:
+            if deadline is not None and deadline.expired():
+                results[i] = _deadline_tool_result(calls[i][0])
+            else:
+                results[i] = _execute_tool(*calls[i], cache, deadline)
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-tool")
+        try:
+            futs = {i: pool.submit(_execute_tool, *calls[i], cache, deadline) for i in pending}
+            done, _ = wait(futs.values(), timeout=deadline.remaining() if deadline is not None else None)
+            for i, fut in futs.items():
+                results[i] = fut.result() if fut in done else _deadline_tool_result(calls[i][0])
+        finally:
+            # Do not block on calls that outlived the deadline; they finish (bounded by their own timeout) unobserved.
+            pool.shutdown(wait=False, cancel_futures=True)
+    return [r if r is not None else "" for r in results]
+
+
+def _forced_read_skill_round(
+    search_left: list[int],
+    skill_left: list[int],
+) -> list[dict[str, Any]] | None:
+    """
+    Build a synthetic assistant tool_calls + tool turn so the first LLM call always
     follows a real read_skill execution (counts against MAX_SKILL_READS_PER_REQUEST).
 
     Ollama may ignore tool_choice; this path is reliable. Disable with AGENT_FORCE_FIRST_TOOL=0.
+    Returns None when disabled or when no skill slot is left.
     """
     flag = os.getenv("AGENT_FORCE_FIRST_TOOL", "1").strip().lower()
     if flag in ("0", "false", "no", "off"):
-        return False
+        return None
     fn = (os.getenv("AGENT_FORCE_FIRST_SKILL") or "disaster_situational_brief.md").strip()
     if not fn:
         fn = "disaster_situational_brief.md"
     if skill_left[0] <= 0:
-        return False
+        return None
 
     result = _dispatch_tool("read_skill", {"filename": fn}, search_left, skill_left)
     tid = f"forced_read_skill_{uuid.uuid4().hex[:12]}"
-    messages.append(
-        {
-            "role": "assistant",
-            "content": "",
-            "tool_calls": [
-                {
-                    "id": tid,
-                    "type": "function",
-                    "function": {
-                        "name": "read_skill",
-                        "arguments": {"filename": fn},
-                    },
-                }
-            ],
-        }
-    )
+    assistant_msg: dict[str, Any] = {
+        "role": "assistant",
+        "content": "",
+        "tool_calls": [
+            {
+                "id": tid,
+                "type": "function",
+                "function": {
+                    "name": "read_skill",
+                    "arguments": {"filename": fn},
+                },
+            }
+        ],
+    }
     tool_msg: dict[str, Any] = {
         "role": "tool",
         "content": result,
@@ -177,8 +286,96 @@ def _inject_forced_read_skill_round(
         "tool_name": "read_skill",
         "tool_call_id": tid,
     }
-    messages.append(tool_msg)
-    return True
+    return [assistant_msg, tool_msg]
+
+
+def _warmup_enabled() -> bool:
+    """AGENT_WARMUP_MODEL: default off (Ollama Cloud keeps models hot); set 1 for a local Ollama host."""
+    flag = os.getenv("AGENT_WARMUP_MODEL", "0").strip().lower()
+    return flag in ("1", "true", "yes", "on")
+
+
+def _warm_model(
+    client: httpx.Client,
+    base_url: str,
+    api_key: str,
+    model: str,
+    timeout: float = WARMUP_TIMEOUT_SECONDS,
+) -> bool:
+    """Ask Ollama to load `model` (empty-messages /api/chat) while the rest of startup runs; never raises."""
+    headers = {"Content-Type": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    url = base_url.rstrip("/") + "/api/chat"
+    try:
+        resp = client.post(url, headers=headers, json={"model": model, "messages": []}, timeout=timeout)
+        return resp.is_success
+    except httpx.HTTPError as exc:
+        log.info("warmup failed (ignored): %s", exc)
+        return False
+
+
+def _timed_phase(phase: str, timings: dict[str, float], fn: Any, *args: Any) -> Any:
+    """Run one startup phase under a metrics span and record its wall time (ms) in timings."""
+    t0 = time.perf_counter()
+    try:
+        with span(phase):
+            return fn(*args)
+    finally:
+        timings[phase] = round((time.perf_counter() - t0) * 1000.0, 1)
+
+
+def _run_startup(
+    task: str,
+    *,
+    fresh_start: bool,
+    continue_thread: bool,
+    search_left: list[int],
+    skill_left: list[int],
+    client: httpx.Client,
+    ollama_host: str,
+    ollama_api_key: str,
+    model: str,
+    search_cache: SearchCache | None = None,
+    deadline: Deadline | None = None,
+) -> dict[str, Any]:
+    """
+    Everything before the first /api/chat, run as a small parallel pipeline: web prefetch,
+    forced read_skill, system-prompt build and (optional) model warm-up are independent, so the
+    first model call waits only for the slowest of them. Prefetch touches only search_left and the
+    forced round only skill_left, so the budgets need no lock.
+    """
+    timings: dict[str, float] = {}
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix="agent-startup") as pool:
+        prompt_f = pool.submit(_timed_phase, "system_prompt", timings, build_system_prompt) if fresh_start else None
+        prefetch_f = (
+            pool.submit(_timed_phase, "prefetch", timings, _maybe_prefetch_web, task, search_left, search_cache, deadline)
+            if fresh_start or continue_thread
+            else None
+        )
+        forced_f = (
+            pool.submit(_timed_phase, "forced_read_skill", timings, _forced_read_skill_round, search_left, skill_left)
+            if fresh_start
+            else None
+        )
+        warm_timeout = deadline.timeout(WARMUP_TIMEOUT_SECONDS) if deadline is not None else WARMUP_TIMEOUT_SECONDS
+        warm_f = (
+            pool.submit(
+                _timed_phase, "warmup", timings, _warm_model, client, ollama_host, ollama_api_key, model, warm_timeout
+            )
+            if _warmup_enabled()
+            else None
+        )
+        out = {
+            "system_text": prompt_f.result() if prompt_f else None,
+            "prefetch": prefetch_f.result() if prefetch_f else None,
+            "forced_round": forced_f.result() if forced_f else None,
+            "warmed": warm_f.result() if warm_f else False,
+        }
+    timings["total"] = round((time.perf_counter() - t0) * 1000.0, 1)
+    out["timings"] = timings
+    return out
 
 
 def _chat_once(
@@ -189,8 +386,9 @@ def _chat_once(
     messages: list[dict[str, Any]],
     max_tokens: int | None,
     tools: list[dict[str, Any]],
+    timeout: float = CHAT_TIMEOUT_SECONDS,
 ) -> dict[str, Any]:
-    """Single non-streaming /api/chat call (optionally with tools)."""
+    """Single non-streaming /api/chat call (optionally with tools); `timeout` covers connecting and waiting for the reply."""
     headers = {"Content-Type": "application/json"}
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
@@ -203,7 +401,7 @@ def _chat_once(
     if max_tokens is not None:
         body["options"] = {"num_predict": max_tokens}
     url = base_url.rstrip("/") + "/api/chat"
-    resp = client.post(url, headers=headers, json=body, timeout=120.0)
+    resp = client.post(url, headers=headers, json=body, timeout=timeout)
     resp.raise_for_status()
     data = resp.json()
     msg = data.get("message") or {}
@@ -225,16 +423,26 @@ def run_research_loop(
     max_output_tokens: int | None = None,
     existing_messages: list[dict[str, Any]] | None = None,
     continue_thread: bool = False,
+    http_client: httpx.Client | None = None,
+    search_cache: SearchCache | None = None,
+    deadline: Deadline | None = None,
 ) -> dict[str, Any]:
     """
-    Run the disaster situational brief loop until END_BRIEF, turn budget exhausted, or error.
+    Run the disaster situational brief loop until END_BRIEF, turn budget or deadline exhausted, or error.
 
     Each POST /api/chat counts toward the same turn budget (including tool follow-ups).
     `turns_used` is only those LLM calls—not the optional server-side Serper preflight
     (see `prefetch_search_used`) nor the optional forced read_skill injection (see `forced_tool_round`).
     `min_completion_turns` (see guardrails) is the minimum LLM rounds before `END_BRIEF` is accepted; the loop
     may inject a verification user message if the model tries to finish early.
-    Web search uses CrewAI SerperDevTool; Ollama handles function calling for read_skill and web_search.
+    Web search uses Serper (see tools.search_backend); Ollama handles function calling for read_skill and web_search.
+
+    Pass `http_client` to reuse a caller-owned connection pool (left open) and `search_cache` to share
+    web_search payloads across runs (e.g. one batch request).
+
+    `deadline` (default: the server cap, AGENT_MAX_REQUEST_SECONDS) bounds the whole run: every model and
+    tool call gets only the time left, calls still in flight when it passes are abandoned, and the run
+    returns `paused_for_human` with the thread gathered so far (`deadline_exceeded: true`).
     """
     configure_agent_logging()
     if not task_size_ok(task):
@@ -249,72 +457,117 @@ def run_research_loop(
             "detail": "Task missing, invalid, or too long (see AGENT_MAX_TASK_CHARS).",
         }
 
+    if deadline is None:
+        deadline = Deadline.after(clamp_deadline(None))
     turns_budget = clamp_turns(max_turns)
     min_done = min(min_completion_turns(), turns_budget)
     fresh_start = existing_messages is None
-    system_text = build_system_prompt()
 
     tools = ollama_tool_definitions()
     search_left = [MAX_WEB_SEARCHES_PER_REQUEST]
     skill_left = [MAX_SKILL_READS_PER_REQUEST]
 
-    prefetch_search_used = False
-
-    if existing_messages is None:
-        prefetch_block = _maybe_prefetch_web(task, search_left)
-        prefetch_search_used = prefetch_block is not None
-        user_content = _wrap_task_with_prefetch(task, prefetch_block)
-        messages: list[dict[str, Any]] = [
-            {"role": "system", "content": system_text},
-            {"role": "user", "content": user_content},
-        ]
-    else:
-        messages = [dict(m) for m in existing_messages]
-        if continue_thread:
-            cont_prefetch = _maybe_prefetch_web(task, search_left)
-            prefetch_search_used = cont_prefetch is not None
-            user_content = _wrap_task_with_prefetch(task, cont_prefetch)
-            messages.append({"role": "user", "content": user_content})
-
-    forced_tool_round = False
-    if fresh_start:
-        forced_tool_round = _inject_forced_read_skill_round(messages, search_left, skill_left)
-
     if max_output_tokens is None:
         env_tok = os.getenv("AGENT_MAX_OUTPUT_TOKENS")
         max_output_tokens = int(env_tok) if env_tok and env_tok.isdigit() else 1024
 
-    log.info(
-        "loop start task_preview=%s turns_budget=%s min_done=%s prefetch=%s forced_read_skill=%s "
-        "search_slots_left=%s skill_slots_left=%s",
-        _redact_for_log(_preview(task)),
-        turns_budget,
-        min_done,
-        prefetch_search_used,
-        forced_tool_round,
-        search_left[0],
-        skill_left[0],
-    )
-
     turns_used = 0
     last_content = ""
+    tokens_saved = 0
+    deadline_hit = False
+
+    with contextlib.ExitStack() as stack:
+        client = http_client if http_client is not None else stack.enter_context(httpx.Client())
+        with span("startup"):
+            startup = _run_startup(
+                task,
+                fresh_start=fresh_start,
+                continue_thread=continue_thread,
+                search_left=search_left,
+                skill_left=skill_left,
+                client=client,
+                ollama_host=ollama_host,
+                ollama_api_key=ollama_api_key,
+                model=model,
+                search_cache=search_cache,
+                deadline=deadline,
+            )
+        startup_ms = startup["timings"]
+        prefetch_block = startup["prefetch"]
+        prefetch_search_used = prefetch_block is not None
+
+        if existing_messages is None:
+            user_content = _wrap_task_with_prefetch(task, prefetch_block)
+            messages: list[dict[str, Any]] = [
+                {"role": "system", "content": startup["system_text"]},
+                {"role": "user", "content": user_content},
+            ]
+        else:
+            messages = [dict(m) for m in existing_messages]
+            if continue_thread:
+                user_content = _wrap_task_with_prefetch(task, prefetch_block)
+                messages.append({"role": "user", "content": user_content})
+
+        forced_tool_round = startup["forced_round"] is not None
+        if forced_tool_round:
+            messages.extend(startup["forced_round"])
+
+        log.info(
+            "loop start task_preview=%s turns_budget=%s min_done=%s prefetch=%s forced_read_skill=%s "
+            "search_slots_left=%s skill_slots_left=%s startup_ms=%s deadline_left_s=%.1f",
+            _preview(task),
+            turns_budget,
+            min_done,
+            prefetch_search_used,
+            forced_tool_round,
+            search_left[0],
+            skill_left[0],
+            startup_ms,
+            deadline.remaining(),
+        )
 
-    with httpx.Client() as client:
         while turns_used < turns_budget:
+            if deadline.expired():
+                deadline_hit = True
+                break
             turns_used += 1
-            log.info("turn %s/%s calling Ollama model=%s", turns_used, turns_budget, model)
-            try:
-                out = _chat_once(
-                    client,
-                    ollama_host,
-                    ollama_api_key,
-                    model,
-                    messages,
-                    max_output_tokens,
-                    tools,
+            compaction = compact_messages(messages)
+            tokens_saved += compaction["tokens_saved"]
+            if compaction["tokens_saved"]:
+                log.info(
+                    "turn %s compacted thread est_tokens %s -> %s (saved %s)",
+                    turns_used,
+                    compaction["tokens_before"],
+                    compaction["tokens_after"],
+                    compaction["tokens_saved"],
                 )
+            log.info(
+                "turn %s/%s calling Ollama model=%s messages=%s est_prompt_tokens=%s",
+                turns_used,
+                turns_budget,
+                model,
+                len(messages),
+                compaction["tokens_after"],
+            )
+            PROMPT_TOKENS.observe(compaction["tokens_after"])
+            try:
+                with span("chat", histogram=TURN_SECONDS, turn=turns_used):
+                    out = _chat_once(
+                        client,
+                        ollama_host,
+                        ollama_api_key,
+                        model,
+                        messages,
+                        max_output_tokens,
+                        tools,
+                        timeout=deadline.timeout(CHAT_TIMEOUT_SECONDS),
+                    )
             except Exception as exc:  # noqa: BLE001 — surface model/HTTP errors to API layer
-                log.warning("turn %s Ollama error: %s", turns_used, _redact_for_log(exc))
+                if deadline.expired():
+                    log.info("turn %s Ollama call cut off by request deadline: %s", turns_used, exc)
+                    deadline_hit = True
+                    break
+                log.warning("turn %s Ollama error: %s", turns_used, exc)
                 return {
                     "status": "error",
                     "reply": last_content,
@@ -322,9 +575,16 @@ def run_research_loop(
                     "prefetch_search_used": prefetch_search_used,
                     "forced_tool_round": forced_tool_round,
                     "min_completion_turns": min_done,
+                    "compaction_tokens_saved": tokens_saved,
+                    "startup_ms": startup_ms,
+                    "deadline_exceeded": False,
                     "detail": str(exc),
                 }
 
+            prompt_eval = (out.get("raw") or {}).get("prompt_eval_count")
+            if prompt_eval is not None:
+                log.info("turn %s prompt_eval_count=%s", turns_used, prompt_eval)
+
             msg = out.get("message") or {}
             # Shallow copy so later edits to messages do not mutate response object quirks
             assistant_msg = dict(msg)
@@ -333,6 +593,8 @@ def run_research_loop(
             tool_calls = assistant_msg.get("tool_calls") or []
             if tool_calls:
                 log.info("turn %s assistant tool_calls count=%s", turns_used, len(tool_calls))
+                calls: list[tuple[str, dict[str, Any]]] = []
+                call_ids: list[Any] = []
                 for tc in tool_calls:
                     if not isinstance(tc, dict):
                         continue
@@ -345,20 +607,26 @@ def run_research_loop(
                         "turn %s tool %s args=%s",
                         turns_used,
                         name,
-                        _redact_for_log(_args_preview(args)),
+                        _args_preview(args),
+                        extra={"sample": True},
                     )
-                    result = _dispatch_tool(name, args, search_left, skill_left)
+                    calls.append((name, args))
+                    call_ids.append(tc.get("id"))
+
+                results = _dispatch_tool_calls(calls, search_left, skill_left, search_cache, deadline)
+
+                for (name, _args), tid, result in zip(calls, call_ids, results):
                     log.info(
                         "turn %s tool %s result_len=%s preview=%s",
                         turns_used,
                         name,
                         len(result),
-                        _redact_for_log(_preview(result, 120)),
+                        _preview(result, 120),
+                        extra={"sample": True},
                     )
                     tool_message: dict[str, Any] = {"role": "tool", "content": result}
                     if name:
                         tool_message["name"] = name
-                    tid = tc.get("id")
                     if tid:
                         tool_message["tool_call_id"] = tid
                     if name:
@@ -372,7 +640,7 @@ def run_research_loop(
                 turns_used,
                 len(last_content),
                 END_MARKER in last_content,
-                _redact_for_log(_preview(last_content, 160)),
+                _preview(last_content, 160),
             )
             if END_MARKER in last_content:
                 if turns_used < min_done:
@@ -384,7 +652,7 @@ def run_research_loop(
                     messages.append({"role": "user", "content": _VERIFICATION_NUDGE})
                     continue
                 cleaned = last_content.replace(END_MARKER, "").strip()
-                log.info("loop finished ok turns_used=%s", turns_used)
+                log.info("loop finished ok turns_used=%s compaction_tokens_saved=%s", turns_used, tokens_saved)
                 return {
                     "status": "ok",
                     "reply": cleaned,
@@ -392,6 +660,9 @@ def run_research_loop(
                     "prefetch_search_used": prefetch_search_used,
                     "forced_tool_round": forced_tool_round,
                     "min_completion_turns": min_done,
+                    "compaction_tokens_saved": tokens_saved,
+                    "startup_ms": startup_ms,
+                    "deadline_exceeded": False,
                     "messages": messages,
                 }
 
@@ -406,7 +677,23 @@ def run_research_loop(
             )
 
     resume_token = str(uuid.uuid4())
-    log.info("loop paused_for_human turns_used=%s budget=%s", turns_used, turns_budget)
+    log.info(
+        "loop paused_for_human turns_used=%s budget=%s deadline_exceeded=%s",
+        turns_used,
+        turns_budget,
+        deadline_hit,
+    )
+    if deadline_hit:
+        last_content = last_content or _gathered_sources(messages)
+        detail = (
+            f"Request deadline ({deadline.seconds:g}s) reached after {turns_used} turn(s); the reply and thread hold "
+            "what was gathered so far. Send the same session_id with resume_token to continue."
+        )
+    else:
+        detail = (
+            f"Model did not finish within {turns_budget} turns in this request; "
+            "send the same session_id with resume_token and a short continuation task."
+        )
     return {
         "status": "paused_for_human",
         "reply": last_content,
@@ -414,10 +701,10 @@ def run_research_loop(
         "prefetch_search_used": prefetch_search_used,
         "forced_tool_round": forced_tool_round,
         "min_completion_turns": min_done,
+        "compaction_tokens_saved": tokens_saved,
+        "startup_ms": startup_ms,
+        "deadline_exceeded": deadline_hit,
         "resume_token": resume_token,
         "messages": messages,
-        "detail": (
-            f"Model did not finish within {turns_budget} turns in this request; "
-            "send the same session_id with resume_token and a short continuation task."
-        ),
+        "detail": detail,
     }
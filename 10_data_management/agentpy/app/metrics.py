@@ -0,0 +1,207 @@
+# metrics.py
+# In-process Prometheus-style metrics (text exposition) + lightweight phase spans — no extra dependency
+# Tim Fraser
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, TypeVar
+
+log = logging.getLogger("agent")
+
+# Seconds: prefetch/tool calls are sub-second to a few seconds; model rounds can take a minute or more.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+TURN_BUCKETS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+TOKEN_BUCKETS = (500, 1000, 2000, 4000, 6000, 8000, 12000, 16000, 24000, 32000, 64000)
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _label_key(labels: dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: LabelKey, extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str) -> None:
+        self.name = name
+        self.doc = doc
+        self._lock = threading.Lock()
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str) -> None:
+        super().__init__(name, doc)
+        self._values: dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, doc)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[LabelKey, list[float]] = {}  # bucket counts..., sum, count
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            row = self._series.get(key)
+            if row is None:
+                row = [0.0] * (len(self.buckets) + 2)
+                self._series[key] = row
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def count(self, **labels: str) -> float:
+        row = self._series.get(_label_key(labels))
+        return row[-1] if row else 0.0
+
+    def mean(self, **labels: str) -> float:
+        row = self._series.get(_label_key(labels))
+        return row[-2] / row[-1] if row and row[-1] else 0.0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = self._header()
+        for key, row in items:
+            for i, upper in enumerate(self.buckets):
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, (('le', _fmt_value(upper)),))} {_fmt_value(row[i])}")
+            lines.append(f"{self.name}_bucket{_fmt_labels(key, (('le', '+Inf'),))} {_fmt_value(row[-1])}")
+            lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(row[-2])}")
+            lines.append(f"{self.name}_count{_fmt_labels(key)} {_fmt_value(row[-1])}")
+        return lines
+
+
+_REGISTRY: list[_Metric] = []
+_M = TypeVar("_M", bound=_Metric)
+
+
+def _register(metric: _M) -> _M:
+    _REGISTRY.append(metric)
+    return metric
+
+
+# METRICS ####################################################################
+
+REQUESTS_IN_FLIGHT = _register(Gauge("agent_requests_in_flight", "Agent runs currently executing."))
+REQUESTS_TOTAL = _register(Counter("agent_requests_total", "Finished /hooks/agent requests by status."))
+REQUEST_SECONDS = _register(Histogram("agent_request_seconds", "Wall time of one /hooks/agent request."))
+TURN_SECONDS = _register(Histogram("agent_turn_seconds", "Latency of one Ollama /api/chat round."))
+TURNS_PER_BRIEF = _register(
+    Histogram("agent_turns_per_brief", "LLM rounds used per request, by final status.", TURN_BUCKETS)
+)
+TOOL_SECONDS = _register(Histogram("agent_tool_seconds", "Latency of one tool execution, by tool."))
+PROMPT_TOKENS = _register(
+    Histogram("agent_prompt_tokens", "Estimated prompt tokens sent per /api/chat round.", TOKEN_BUCKETS)
+)
+QUEUE_DEPTH = _register(Gauge("agent_queue_depth", "Requests waiting for an agent run slot."))
+QUEUE_WAIT_SECONDS = _register(Histogram("agent_queue_wait_seconds", "Time an admitted request waited for a run slot."))
+ADMISSION_REJECTIONS = _register(
+    Counter("agent_admission_rejections_total", "Requests refused with 429, by reason (queue_full, queue_timeout, per_client).")
+)
+PHASE_SECONDS = _register(Histogram("agent_phase_seconds", "Duration of traced phases (see metrics.span)."))
+HTTP_UPSTREAM_REQUESTS = _register(
+    Counter("agent_http_upstream_requests_total", "Requests sent on the shared HTTP clients, by upstream and HTTP version.")
+)
+HTTP_CONNECTIONS_OPENED = _register(
+    Counter("agent_http_connections_opened_total", "New TCP connections opened by the shared HTTP clients, by upstream.")
+)
+BRIEF_CACHE_LOOKUPS = _register(
+    Counter("agent_brief_cache_lookups_total", "Brief cache lookups for new tasks, by result (hit, miss, expired).")
+)
+SEARCH_PAYLOAD_TOKENS = _register(
+    Counter("agent_search_payload_tokens_total", "Estimated web_search tokens before (raw) and after (compacted) compaction.")
+)
+LOG_RECORDS_DROPPED = _register(
+    Counter("agent_log_records_dropped_total", "Agent log records dropped because the log queue was full.")
+)
+
+
+def render_prometheus() -> str:
+    """Prometheus text exposition format (version 0.0.4) for every registered metric."""
+    lines: list[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def span(
+    phase: str,
+    histogram: Histogram | None = None,
+    labels: dict[str, str] | None = None,
+    **attrs: object,
+) -> Iterator[None]:
+    """
+    Time one phase into agent_phase_seconds{phase=...} (and `histogram` with `labels`, if given)
+    and emit a DEBUG trace line. Extra keyword attributes are logged only, so label cardinality stays fixed.
+    """
+    t0 = time.perf_counter()
+    ok = True
+    try:
+        yield
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        dt = time.perf_counter() - t0
+        PHASE_SECONDS.observe(dt, phase=phase)
+        if histogram is not None:
+            histogram.observe(dt, **(labels or {}))
+        if log.isEnabledFor(logging.DEBUG):
+            extra = " ".join(f"{k}={v}" for k, v in attrs.items())
+            log.debug("span %s ok=%s ms=%.1f %s", phase, ok, dt * 1000.0, extra)
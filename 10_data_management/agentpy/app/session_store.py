@@ -0,0 +1,183 @@
+# session_store.py
+# Paused threads as append-only message deltas over a content-addressed blob store (system prompt, skills, search output)
+# Tim Fraser
+
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Any
+
+log = logging.getLogger("agent")
+
+# Contents at least this long go to the shared blob store; shorter ones stay inline on the record.
+BLOB_MIN_CHARS = 256
+
+
+@dataclass(frozen=True, slots=True)
+class _Record:
+    """One stored message: role, content (inline or blob digest) and any other keys (tool_calls, name, ...)."""
+
+    role: str
+    inline: str | None
+    blob: str | None
+    extra: tuple[tuple[str, Any], ...]
+
+
+@dataclass
+class _Thread:
+    """Append-only log of (index, record): index == current length appends, a smaller index rewrites (compaction)."""
+
+    log: list[tuple[int, _Record]] = field(default_factory=list)
+    length: int = 0
+    paused: bool = False
+    resume_token: str | None = None
+
+    def view(self) -> list[_Record]:
+        out: list[_Record] = []
+        for i, rec in self.log:
+            if i == len(out):
+                out.append(rec)
+            else:
+                out[i] = rec
+        return out[: self.length]
+
+
+@dataclass
+class SessionStore:
+    """
+    Paused sessions for one worker (used only from the event loop, so no lock).
+
+    Long message contents are stored once by SHA-256 and reference-counted, so the system prompt, skill
+    text and shared search payloads cost memory once across every paused session. Each session keeps a
+    log of message deltas: saving after a resume appends only the new turns (plus rewrites of messages
+    that thread compaction elided), and resuming replays the log into fresh message dicts.
+    """
+
+    _blobs: dict[str, str] = field(default_factory=dict, repr=False)
+    _refs: dict[str, int] = field(default_factory=dict, repr=False)
+    _threads: dict[str, _Thread] = field(default_factory=dict, repr=False)
+
+    # BLOBS ###################################################################
+
+    def _intern(self, content: str) -> str:
+        key = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        if key not in self._blobs:
+            self._blobs[key] = content
+        self._refs[key] = self._refs.get(key, 0) + 1
+        return key
+
+    def _release(self, rec: _Record) -> None:
+        if rec.blob is None:
+            return
+        n = self._refs.get(rec.blob, 0) - 1
+        if n > 0:
+            self._refs[rec.blob] = n
+        else:
+            self._refs.pop(rec.blob, None)
+            self._blobs.pop(rec.blob, None)
+
+    def _encode(self, message: dict[str, Any], previous: _Record | None) -> _Record:
+        content = str(message.get("content") or "")
+        extra = tuple((k, v) for k, v in message.items() if k not in ("role", "content"))
+        role = str(message.get("role") or "")
+        if len(content) < BLOB_MIN_CHARS:
+            return _Record(role, content, None, extra)
+        if previous is not None and previous.blob is not None and self._blobs.get(previous.blob) is content:
+            # Same string object as last save (untouched message): reuse without rehashing.
+            self._refs[previous.blob] += 1
+            return _Record(role, None, previous.blob, extra)
+        return _Record(role, None, self._intern(content), extra)
+
+    def _decode(self, rec: _Record) -> dict[str, Any]:
+        message: dict[str, Any] = {"role": rec.role, "content": rec.inline if rec.blob is None else self._blobs[rec.blob]}
+        message.update(rec.extra)
+        return message
+
+    # SESSIONS ################################################################
+
+    def get(self, sid: str) -> _Thread | None:
+        """The paused thread for `sid`, or None (unknown, finished, or currently resumed by another request)."""
+        thread = self._threads.get(sid)
+        return thread if thread is not None and thread.paused else None
+
+    def messages(self, sid: str) -> list[dict[str, Any]]:
+        """Rebuild the thread as new message dicts (contents are shared strings, not copies)."""
+        thread = self._threads.get(sid)
+        return [self._decode(rec) for rec in thread.view()] if thread is not None else []
+
+    def claim(self, sid: str, resume_token: str | None) -> bool:
+        """Mark a paused thread as running so a replayed resume_token cannot fork it; False if already claimed."""
+        thread = self.get(sid)
+        if thread is None or thread.resume_token != resume_token:
+            return False
+        thread.paused = False
+        thread.resume_token = None
+        return True
+
+    def unclaim(self, sid: str, resume_token: str | None) -> None:
+        """Undo `claim` after a resumed run raised, so the thread can be resumed again with the same token."""
+        thread = self._threads.get(sid)
+        if thread is not None and not thread.paused:
+            thread.paused = True
+            thread.resume_token = resume_token
+
+    def save_paused(self, sid: str, messages: list[dict[str, Any]], resume_token: str | None) -> dict[str, int]:
+        """Store `messages` as deltas against what `sid` already holds; returns size accounting for the log line."""
+        thread = self._threads.setdefault(sid, _Thread())
+        old = thread.view()
+        appended = rewritten = 0
+        for i, message in enumerate(messages):
+            prev = old[i] if i < len(old) else None
+            rec = self._encode(message, prev)
+            if rec == prev:
+                self._release(rec)  # identical to the stored record: drop the extra ref taken by _encode
+                continue
+            if prev is not None:
+                self._release(prev)
+                rewritten += 1
+            else:
+                appended += 1
+            thread.log.append((i, rec))
+        for prev in old[len(messages):]:
+            self._release(prev)
+        thread.length = len(messages)
+        thread.paused = True
+        thread.resume_token = resume_token
+        if rewritten or len(thread.log) > 2 * max(1, thread.length):
+            thread.log = list(enumerate(thread.view()))  # fold superseded entries so the log stays bounded
+        stats = {"messages": len(messages), "appended": appended, "rewritten": rewritten}
+        log.info("session %s saved messages=%s appended=%s rewritten=%s", sid[:8], len(messages), appended, rewritten)
+        return stats
+
+    def drop(self, sid: str) -> None:
+        thread = self._threads.pop(sid, None)
+        if thread is None:
+            return
+        for rec in thread.view():
+            self._release(rec)
+
+    def __len__(self) -> int:
+        return len(self._threads)
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Memory accounting: `logical_chars` is what full per-session message lists would hold,
+        `stored_chars` is inline text plus each distinct blob once; `dedup_ratio` = 1 − stored / logical.
+        """
+        logical = inline = 0
+        for thread in self._threads.values():
+            for rec in thread.view():
+                if rec.blob is None:
+                    inline += len(rec.inline or "")
+                    logical += len(rec.inline or "")
+                else:
+                    logical += len(self._blobs[rec.blob])
+        stored = inline + sum(len(b) for b in self._blobs.values())
+        return {
+            "sessions": len(self._threads),
+            "paused": sum(1 for t in self._threads.values() if t.paused),
+            "blobs": len(self._blobs),
+            "logical_chars": logical,
+            "stored_chars": stored,
+            "dedup_ratio": round(1.0 - stored / logical, 4) if logical else 0.0,
+        }
@@ -1,15 +1,21 @@
 # tools.py
-# CrewAI SerperDevTool for web search + read_skill helpers for Ollama tool calling
+# Serper web search (CrewAI SerperDevTool, loaded lazily, or a built-in HTTP client) + read_skill helpers for Ollama tool calling
 # Tim Fraser
 
 import json
+import logging
 import os
 import re
-from typing import Any
+import threading
+from typing import Any, Callable
 
-from crewai_tools import SerperDevTool
+import httpx
 
-from .guardrails import read_skill_file
+from .compaction import estimate_tokens
+from .context import skill_snapshot
+from .metrics import SEARCH_PAYLOAD_TOKENS
+
+log = logging.getLogger("agent")
 
 # Keep tool payloads small so the chat context stays bounded.
 MAX_TOOL_OUTPUT_CHARS = 4000
@@ -163,19 +169,81 @@ def _truncate(s: str, limit: int = MAX_TOOL_OUTPUT_CHARS) -> str:
     return s[: limit - 20] + "\n...[truncated]"
 
 
+# Truncated read_skill payloads for the current registry version (see context.skill_snapshot).
+_skill_payloads: dict[str, str] = {}
+_skill_payloads_version = 0
+
+
 def run_read_skill(filename: str) -> str:
-    """Return skill markdown or a short error string (never raises)."""
+    """Return skill markdown or a short error string (never raises). Served from the in-memory registry."""
+    global _skill_payloads, _skill_payloads_version
+    name = filename.strip()
+    snap = skill_snapshot()
+    if snap.version != _skill_payloads_version:
+        _skill_payloads = {}
+        _skill_payloads_version = snap.version
+    payloads = _skill_payloads
+    hit = payloads.get(name)
+    if hit is not None:
+        return hit
     try:
-        text = read_skill_file(filename.strip())
+        text = snap.read(name)
     except ValueError as exc:
         return f"read_skill error: {exc}"
-    return _truncate(text)
+    payload = _truncate(text)
+    payloads[name] = payload
+    return payload
 
 
-def run_web_search(query: str) -> str:
+class SearchCache:
     """
-    Web search via CrewAI **SerperDevTool** (Serper API). Requires **SERPER_API_KEY**.
+    Thread-safe query → web_search payload map shared by several runs (e.g. one batch request).
+    Concurrent lookups of the same query wait for the first caller instead of searching twice.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._data: dict[str, str] = {}
+        self._inflight: dict[str, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def get_or_compute(self, query: str, compute: Callable[[], str]) -> str:
+        k = self.key(query)
+        while True:
+            with self._lock:
+                if k in self._data:
+                    self.hits += 1
+                    return self._data[k]
+                pending = self._inflight.get(k)
+                if pending is None:
+                    pending = threading.Event()
+                    self._inflight[k] = pending
+                    self.misses += 1
+                    break
+            pending.wait()  # another run is searching this query; re-check (errors are not cached)
+        try:
+            payload = compute()
+            if not payload.startswith("web_search error"):
+                with self._lock:
+                    self._data[k] = payload
+            return payload
+        finally:
+            with self._lock:
+                self._inflight.pop(k, None)
+            pending.set()
+
+
+def run_web_search(query: str, cache: SearchCache | None = None, timeout: float | None = None) -> str:
+    """
+    Web search via the Serper API (see `search_backend`). Requires **SERPER_API_KEY**.
     Prepends a **Retrieved URLs for References** block so the model can copy real links.
+    With `cache`, identical (case/whitespace-normalized) queries reuse the earlier payload.
+    `timeout` (seconds) bounds the Serper HTTP call for the built-in client; the CrewAI tool uses its own 10 s.
     """
     key = (os.getenv("SERPER_API_KEY") or "").strip()
     if not key:
@@ -191,13 +259,263 @@ def run_web_search(query: str) -> str:
     if not q:
         return "web_search error: empty query."
 
+    if cache is not None:
+        return cache.get_or_compute(q, lambda: _serper_search(q, timeout))
+    return _serper_search(q, timeout)
+
+
+# SERPER BACKENDS ############################################################
+
+SERPER_DEFAULT_URL = "https://google.serper.dev"
+SERPER_N_RESULTS = 5
+
+_serper_tool_cls: Any = None
+_serper_import_lock = threading.Lock()
+# Shared pooled client for the built-in backend (set by the API lifespan); None → one-off httpx.post.
+_search_client: httpx.Client | None = None
+
+
+def set_search_client(client: httpx.Client | None) -> None:
+    """Inject the application-wide Serper client (keep-alive pool) used by the built-in backend."""
+    global _search_client
+    _search_client = client
+
+
+def search_backend() -> str:
+    """
+    AGENT_SEARCH_BACKEND: **crewai** (default; CrewAI SerperDevTool, imported on first use) or
+    **http** (built-in client below; crewai_tools is never imported).
+    """
+    raw = (os.getenv("AGENT_SEARCH_BACKEND") or "crewai").strip().lower()
+    return "http" if raw in ("http", "builtin", "httpx") else "crewai"
+
+
+def _serper_base_url() -> str:
+    return (os.getenv("SERPER_BASE_URL") or "").strip().rstrip("/") or SERPER_DEFAULT_URL
+
+
+def _serper_tool_class() -> Any:
+    """Import crewai_tools on first use — it pulls a very large dependency tree, so never at module import."""
+    global _serper_tool_cls
+    if _serper_tool_cls is None:
+        with _serper_import_lock:
+            if _serper_tool_cls is None:
+                from crewai_tools import SerperDevTool
+
+                _serper_tool_cls = SerperDevTool
+    return _serper_tool_cls
+
+
+def preload_search_backend() -> None:
+    """Import the CrewAI backend off the request path (API lifespan runs this in a background thread); never raises."""
+    if not (os.getenv("SERPER_API_KEY") or "").strip() or search_backend() != "crewai":
+        return
     try:
-        tool = SerperDevTool(n_results=5)
-        raw = tool.run(search_query=q)
+        _serper_tool_class()
+    except Exception as exc:  # noqa: BLE001 — the first search reports the same error to the model
+        log.warning("search backend preload failed: %s", exc)
+
+
+def _serper_crewai(q: str) -> Any:
+    base_url = _serper_base_url()
+    cls = _serper_tool_class()
+    tool = cls(n_results=SERPER_N_RESULTS, base_url=base_url) if base_url != SERPER_DEFAULT_URL else cls(n_results=SERPER_N_RESULTS)
+    return tool.run(search_query=q)
+
+
+def _serper_http(q: str, timeout: float | None = None) -> dict[str, Any]:
+    """Same request SerperDevTool makes (POST {base}/search, q + num); returns the parsed Serper JSON."""
+    client = _search_client
+    post = client.post if client is not None else httpx.post
+    resp = post(
+        f"{_serper_base_url()}/search",
+        headers={"X-API-KEY": (os.getenv("SERPER_API_KEY") or "").strip(), "Content-Type": "application/json"},
+        json={"q": q, "num": SERPER_N_RESULTS},
+        timeout=min(10.0, timeout) if timeout is not None else 10.0,
+    )
+    resp.raise_for_status()
+    data = resp.json()
+    if not data:
+        raise ValueError("Empty response from Serper API")
+    return data
+
+
+def _serper_search(q: str, timeout: float | None = None) -> str:
+    """One Serper call (backend per AGENT_SEARCH_BACKEND) → reference block + compacted evidence."""
+    try:
+        raw = _serper_http(q, timeout) if search_backend() == "http" else _serper_crewai(q)
     except Exception as exc:  # noqa: BLE001 — tool output is user-facing text
         return f"web_search error: {exc}"
 
+    data = _as_serper_dict(raw)
+    if data is not None and search_compaction_enabled():
+        payload, stats = compact_serper_payload(q, data)
+        SEARCH_PAYLOAD_TOKENS.inc(stats["raw_tokens"], stage="raw")
+        SEARCH_PAYLOAD_TOKENS.inc(stats["payload_tokens"], stage="compacted")
+        log.info(
+            "web_search compacted raw_tokens=%s payload_tokens=%s results=%s kept=%s duplicates=%s",
+            stats["raw_tokens"],
+            stats["payload_tokens"],
+            stats["results"],
+            stats["kept"],
+            stats["duplicates"],
+        )
+        return payload
+
     body = (str(raw).strip() if raw is not None else "") or "(No results.)"
     pairs = _title_url_pairs_from_raw(body)
     ref_block = _reference_block_for_model(pairs)
     return _assemble_search_payload(ref_block, body)
+
+
+# SEARCH RESULT COMPACTION ###################################################
+
+# Header of the evidence section; compaction.py elides everything after it on stale turns.
+EVIDENCE_MARKER = "\n\n### Search evidence (compacted)\n\n"
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_DUPLICATE_JACCARD = 0.8
+_STOPWORDS = frozenset("a an and are as at by for from in is it of on or the to with".split())
+
+
+def search_compaction_enabled() -> bool:
+    """AGENT_SEARCH_COMPACTION: default on; 0/false/no/off sends the raw Serper body (old behavior)."""
+    flag = os.getenv("AGENT_SEARCH_COMPACTION", "1").strip().lower()
+    return flag not in ("0", "false", "no", "off")
+
+
+def search_token_budget() -> int:
+    """Estimated tokens for one web_search payload (AGENT_SEARCH_TOKEN_BUDGET; default MAX_TOOL_OUTPUT_CHARS / 4)."""
+    raw = (os.getenv("AGENT_SEARCH_TOKEN_BUDGET") or "").strip()
+    return int(raw) if raw.isdigit() and int(raw) > 0 else MAX_TOOL_OUTPUT_CHARS // 4
+
+
+def _as_serper_dict(raw: Any) -> dict[str, Any] | None:
+    """Serper results as a dict, parsing at most once (SerperDevTool returns a dict; some versions a JSON string)."""
+    if isinstance(raw, dict):
+        return raw
+    if isinstance(raw, str):
+        try:
+            data = json.loads(raw)
+        except (json.JSONDecodeError, ValueError):
+            return None
+        return data if isinstance(data, dict) else None
+    return None
+
+
+def _words(text: str) -> set[str]:
+    return {w for w in _WORD_RE.findall(text.lower()) if w not in _STOPWORDS}
+
+
+def _dedupe_sentences(text: str) -> str:
+    """Drop repeated sentences inside one snippet (Serper snippets often echo the title or repeat)."""
+    out: list[str] = []
+    seen: set[str] = set()
+    for part in re.split(r"(?<=[.!?])\s+", " ".join(text.split())):
+        key = " ".join(_WORD_RE.findall(part.lower()))
+        if key and key not in seen:
+            seen.add(key)
+            out.append(part)
+    return " ".join(out)
+
+
+def _serper_items(data: dict[str, Any]) -> list[dict[str, str]]:
+    """
+    Flatten the fields the model uses (title, link, snippet, date) from answerBox, knowledgeGraph,
+    organic, news/topStories and peopleAlsoAsk; drops positions, sitelinks, attributes, images, credits.
+    """
+    items: list[dict[str, str]] = []
+
+    def add(title: Any, link: Any, snippet: Any, date: Any = "") -> None:
+        snippet = _dedupe_sentences(str(snippet or ""))
+        title = " ".join(str(title or "").split())
+        if snippet or link:
+            items.append({"title": title, "link": str(link or "").strip(), "snippet": snippet, "date": str(date or "").strip()})
+
+    box = data.get("answerBox")
+    if isinstance(box, dict):
+        add(box.get("title"), box.get("link"), box.get("answer") or box.get("snippet"), box.get("date"))
+    kg = data.get("knowledgeGraph")
+    if isinstance(kg, dict):
+        add(kg.get("title"), kg.get("descriptionLink") or kg.get("website"), kg.get("description"))
+    for key in ("organic", "news", "topStories"):
+        rows = data.get(key)
+        if isinstance(rows, list):
+            for row in rows:
+                if isinstance(row, dict):
+                    add(row.get("title"), row.get("link"), row.get("snippet"), row.get("date"))
+    paa = data.get("peopleAlsoAsk")
+    if isinstance(paa, list):
+        for row in paa:
+            if isinstance(row, dict):
+                add(row.get("question") or row.get("title"), row.get("link"), row.get("snippet"))
+    return items
+
+
+def _dedupe_items(items: list[dict[str, str]]) -> tuple[list[dict[str, str]], int]:
+    """Drop repeats of an earlier URL or snippets whose word sets overlap ≥ 80% (Jaccard)."""
+    kept: list[dict[str, str]] = []
+    kept_words: list[set[str]] = []
+    urls: set[str] = set()
+    dropped = 0
+    for item in items:
+        url = item["link"].rstrip("/")
+        words = _words(item["snippet"])
+        near = any(
+            words and other and len(words & other) / len(words | other) >= _DUPLICATE_JACCARD for other in kept_words
+        )
+        if (url and url in urls) or near:
+            dropped += 1
+            continue
+        if url:
+            urls.add(url)
+        kept.append(item)
+        kept_words.append(words)
+    return kept, dropped
+
+
+def _evidence_line(n: int, item: dict[str, str]) -> str:
+    """`[n]` matches the reference list; unlinked results (e.g. answer box) get a plain bullet."""
+    date = f" ({item['date']})" if item["date"] else ""
+    title = item["title"] or item["link"] or "Result"
+    return f"{f'[{n}]' if n else '-'} {title}{date}: {item['snippet']}"
+
+
+def compact_serper_payload(query: str, data: dict[str, Any]) -> tuple[str, dict[str, int]]:
+    """
+    Reference block (every linked result, numbered) + one evidence line per result, most relevant
+    to `query` first, added until the token budget is spent. Evidence numbers match the reference list.
+    """
+    raw_tokens = estimate_tokens(json.dumps(data, ensure_ascii=False, default=str))
+    items, duplicates = _dedupe_items(_serper_items(data))
+    linked = [it for it in items if it["link"]][:10]
+    ref_block = _reference_block_for_model([(it["title"] or it["link"], it["link"]) for it in linked])
+    number = {id(it): i for i, it in enumerate(linked, 1)}
+
+    q_words = _words(query)
+
+    def relevance(item: dict[str, str]) -> int:
+        return len(q_words & _words(item["title"] + " " + item["snippet"]))
+
+    ranked = sorted(items, key=relevance, reverse=True)  # stable: ties keep Serper's order
+    budget = search_token_budget() - estimate_tokens(ref_block + EVIDENCE_MARKER)
+    lines: list[str] = []
+    for item in ranked:
+        if not item["snippet"]:
+            continue
+        line = _evidence_line(number.get(id(item), 0), item)
+        cost = estimate_tokens(line) + 1
+        if cost > budget:
+            continue
+        lines.append(line)
+        budget -= cost
+
+    payload = ref_block + EVIDENCE_MARKER + ("\n".join(lines) if lines else "(No snippets returned.)")
+    payload = _truncate(payload)
+    return payload, {
+        "raw_tokens": raw_tokens,
+        "payload_tokens": estimate_tokens(payload),
+        "results": len(items) + duplicates,
+        "kept": len(lines),
+        "duplicates": duplicates,
+    }
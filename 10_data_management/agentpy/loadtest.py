@@ -0,0 +1,480 @@
+# loadtest.py
+# Load-test the agent API locally against fake Ollama /api/chat and fake Serper backends
+# Tim Fraser
+#
+# Starts three servers on 127.0.0.1 (random free ports):
+#   - fake Ollama: POST /api/chat with configurable latency and a per-turn tool-call script
+#   - fake Serper: POST /search returning canned organic results after a configurable delay
+#   - the real app (python -m uvicorn app.api:app) in a subprocess, pointed at both fakes
+# then drives mixed new / resume traffic at each concurrency level and prints throughput,
+# latency percentiles, outcome counts, error rate, server RSS growth and upstream connection reuse
+# (cumulative, from GET /health) per level.
+#
+# Examples:
+#   python loadtest.py
+#   python loadtest.py --levels 1,8,16 --requests 80 --resume-ratio 0.5
+#   python loadtest.py --script search2,skill,final --chat-latency-ms 800 --json logs/loadtest.json
+#   python loadtest.py --app-env AGENT_MAX_CONCURRENT_RUNS=8 --max-p95-ms 5000 --max-error-rate 0.01
+#
+# Script steps (one per model round; the last step repeats): search, search2 (two parallel
+# web_search calls), skill (read_skill), draft (text without END_BRIEF), final (brief + END_BRIEF).
+#
+# pip install -r requirements.txt
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_STEPS = ("search", "search2", "skill", "draft", "final")
+
+BRIEF_TEXT = """## Situation
+Fake brief generated by loadtest.py; river stage steady, two shelters open.
+
+## Lifelines
+Power restored to most of the county; one state road still closed.
+
+## References
+- [County emergency management](https://example.org/ema)
+"""
+
+
+# FAKE BACKENDS ##############################################################
+
+
+@dataclass
+class FakeStats:
+    """Call counters shared with the fake servers (read between levels)."""
+
+    chat_calls: int = 0
+    chat_failures: int = 0
+    search_calls: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def bump(self, name: str) -> None:
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict[str, int]:
+        with self.lock:
+            return {"chat_calls": self.chat_calls, "chat_failures": self.chat_failures, "search_calls": self.search_calls}
+
+
+async def _sleep_ms(latency_ms: float, jitter_ms: float) -> None:
+    delay = latency_ms + random.uniform(-jitter_ms, jitter_ms)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000.0)
+
+
+def _model_round(messages: list[dict[str, Any]]) -> int:
+    """Model rounds already in the thread (server-forced read_skill rounds do not count)."""
+    n = 0
+    for m in messages:
+        if m.get("role") != "assistant":
+            continue
+        calls = m.get("tool_calls") or []
+        if calls and all(str(c.get("id", "")).startswith("forced_") for c in calls):
+            continue
+        n += 1
+    return n
+
+
+def _tool_call(name: str, arguments: dict[str, Any]) -> dict[str, Any]:
+    return {"function": {"name": name, "arguments": arguments}}
+
+
+def _script_reply(step: str, task: str, n: int) -> dict[str, Any]:
+    topic = " ".join(task.split()[:6]) or "incident"
+    if step == "search":
+        return {"role": "assistant", "content": "", "tool_calls": [_tool_call("web_search", {"query": f"{topic} update {n}"})]}
+    if step == "search2":
+        return {
+            "role": "assistant",
+            "content": "",
+            "tool_calls": [
+                _tool_call("web_search", {"query": f"{topic} shelters {n}"}),
+                _tool_call("web_search", {"query": f"{topic} road closures {n}"}),
+            ],
+        }
+    if step == "skill":
+        return {"role": "assistant", "content": "", "tool_calls": [_tool_call("read_skill", {"filename": "references_section.md"})]}
+    if step == "draft":
+        return {"role": "assistant", "content": BRIEF_TEXT}
+    return {"role": "assistant", "content": BRIEF_TEXT + "\nEND_BRIEF"}
+
+
+def fake_ollama_app(script: list[str], latency_ms: float, jitter_ms: float, fail_rate: float, stats: FakeStats) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/api/chat")
+    async def chat(request: Request) -> JSONResponse:
+        body = await request.json()
+        messages = body.get("messages") or []
+        if not messages:  # warm-up ping
+            return JSONResponse({"model": body.get("model"), "message": {"role": "assistant", "content": ""}, "done": True})
+        stats.bump("chat_calls")
+        await _sleep_ms(latency_ms, jitter_ms)
+        if fail_rate and random.random() < fail_rate:
+            stats.bump("chat_failures")
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        n = _model_round(messages)
+        step = script[min(n, len(script) - 1)]
+        task = next((str(m.get("content") or "") for m in messages if m.get("role") == "user"), "")
+        prompt_chars = len(json.dumps(messages, ensure_ascii=False))
+        return JSONResponse(
+            {
+                "model": body.get("model"),
+                "message": _script_reply(step, task, n),
+                "done": True,
+                "prompt_eval_count": prompt_chars // 4,
+                "eval_count": len(BRIEF_TEXT) // 4,
+            }
+        )
+
+    return app
+
+
+def fake_serper_app(latency_ms: float, jitter_ms: float, stats: FakeStats) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/search")
+    async def search(request: Request) -> JSONResponse:
+        body = await request.json()
+        stats.bump("search_calls")
+        await _sleep_ms(latency_ms, jitter_ms)
+        q = str(body.get("q") or "")
+        num = int(body.get("num") or 5)
+        organic = [
+            {
+                "title": f"{q} — result {i + 1}",
+                "link": f"https://example.org/{abs(hash(q)) % 10_000}/{i + 1}",
+                "snippet": f"Snippet {i + 1} for {q}: officials report conditions are stable. " * 3,
+                "position": i + 1,
+            }
+            for i in range(num)
+        ]
+        return JSONResponse({"searchParameters": {"q": q, "num": num}, "organic": organic, "credits": 1})
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_in_thread(app: FastAPI, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.time() + 10
+    while not server.started and time.time() < deadline:
+        time.sleep(0.05)
+    return server
+
+
+# APP UNDER TEST #############################################################
+
+
+def start_app(port: int, env_overrides: dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update(env_overrides)
+    cmd = [sys.executable, "-m", "uvicorn", "app.api:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=HERE, env=env)
+
+
+def wait_healthy(base: str, proc: subprocess.Popen, timeout_s: float) -> None:
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"app exited during startup (code {proc.returncode})")
+        try:
+            if httpx.get(f"{base}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"app not healthy after {timeout_s:g}s")
+
+
+def rss_kb(pid: int) -> dict[str, int | None]:
+    """Resident set size (VmRSS) and peak (VmHWM) in kB from /proc; None where unavailable."""
+    out: dict[str, int | None] = {"rss_kb": None, "peak_kb": None}
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    out["rss_kb"] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    out["peak_kb"] = int(line.split()[1])
+    except OSError:
+        try:
+            import psutil  # optional fallback (macOS / Windows)
+
+            out["rss_kb"] = psutil.Process(pid).memory_info().rss // 1024
+        except Exception:  # noqa: BLE001 — memory numbers are best-effort
+            pass
+    return out
+
+
+# TRAFFIC ####################################################################
+
+
+@dataclass
+class Sample:
+    kind: str  # new | resume_first | resume
+    http_status: int
+    status: str  # ok | paused_for_human | error | http_429 | http_<code> | exception
+    latency_s: float
+
+
+async def _post(client: httpx.AsyncClient, base: str, kind: str, body: dict[str, Any], client_id: str) -> tuple[Sample, dict[str, Any]]:
+    t0 = time.perf_counter()
+    try:
+        r = await client.post(f"{base}/hooks/agent", json=body, headers={"X-Client-Id": client_id})
+    except httpx.HTTPError:
+        return Sample(kind, 0, "exception", time.perf_counter() - t0), {}
+    dt = time.perf_counter() - t0
+    try:
+        data = r.json()
+    except ValueError:
+        data = {}
+    if r.status_code == 200:
+        status = str(data.get("status") or "unknown")
+    elif r.status_code == 429:
+        status = "http_429"
+    else:
+        status = f"http_{r.status_code}"
+    return Sample(kind, r.status_code, status, dt), data
+
+
+async def run_flow(client: httpx.AsyncClient, base: str, i: int, resume: bool, client_id: str) -> list[Sample]:
+    """One new brief, or a paused-then-resumed brief (two requests on the same session)."""
+    task = f"Load test incident {i}: flooding along the Cedar River, eastern Iowa, last 24 hours."
+    if not resume:
+        sample, _ = await _post(client, base, "new", {"task": task}, client_id)
+        return [sample]
+    first, data = await _post(client, base, "resume_first", {"task": task, "max_turns": 1}, client_id)
+    if first.status != "paused_for_human":
+        return [first]
+    body = {"task": "continue", "session_id": data.get("session_id"), "resume_token": data.get("resume_token")}
+    second, _ = await _post(client, base, "resume", body, client_id)
+    return [first, second]
+
+
+async def run_level(base: str, concurrency: int, flows: int, resume_ratio: float, timeout_s: float) -> tuple[list[Sample], float]:
+    plan = [random.random() < resume_ratio for _ in range(flows)]
+    samples: list[Sample] = []
+    next_i = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout_s, limits=limits) as client:
+
+        async def worker(w: int) -> None:
+            nonlocal next_i
+            while next_i < len(plan):
+                i = next_i
+                next_i += 1
+                samples.extend(await run_flow(client, base, i, plan[i], f"loadtest-{w}"))
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    return samples, elapsed
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list (0 when empty)."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def summarize(samples: list[Sample], elapsed: float) -> dict[str, Any]:
+    lat = sorted(s.latency_s * 1000.0 for s in samples)
+    outcomes: dict[str, int] = {}
+    for s in samples:
+        outcomes[s.status] = outcomes.get(s.status, 0) + 1
+    by_kind: dict[str, dict[str, float]] = {}
+    for kind in sorted({s.kind for s in samples}):
+        kl = sorted(s.latency_s * 1000.0 for s in samples if s.kind == kind)
+        by_kind[kind] = {"n": len(kl), "p50_ms": round(percentile(kl, 50), 1), "p95_ms": round(percentile(kl, 95), 1)}
+    n = len(samples)
+    errors = sum(v for k, v in outcomes.items() if k not in ("ok", "paused_for_human", "http_429"))
+    return {
+        "requests": n,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(n / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(lat, 50), 1),
+        "p90_ms": round(percentile(lat, 90), 1),
+        "p95_ms": round(percentile(lat, 95), 1),
+        "p99_ms": round(percentile(lat, 99), 1),
+        "max_ms": round(lat[-1], 1) if lat else 0.0,
+        "outcomes": outcomes,
+        "error_rate": round(errors / n, 4) if n else 0.0,
+        "rejected_rate": round(outcomes.get("http_429", 0) / n, 4) if n else 0.0,
+        "by_kind": by_kind,
+    }
+
+
+def print_level(concurrency: int, row: dict[str, Any]) -> None:
+    mem = row["memory"]
+    growth = mem.get("rss_growth_kb")
+    print(
+        f"c={concurrency:<3} n={row['requests']:<4} {row['throughput_rps']:>7.2f} req/s  "
+        f"p50={row['p50_ms']:>8.1f}  p95={row['p95_ms']:>8.1f}  p99={row['p99_ms']:>8.1f} ms  "
+        f"err={row['error_rate']:.2%}  429={row['rejected_rate']:.2%}  "
+        f"rss={mem.get('rss_after_kb') or '?'} kB ({'+' if (growth or 0) >= 0 else ''}{growth if growth is not None else '?'})"
+    )
+    print(f"       outcomes={row['outcomes']}  fakes={row['fakes']}")
+    for upstream, stats in (row.get("http_reuse") or {}).items():
+        print(f"       {upstream}: {stats['requests']} requests, {stats['connections_opened']} connections, reuse={stats['reuse_rate']}")
+    sessions = row.get("sessions")
+    if sessions:
+        print(
+            f"       paused sessions={sessions['paused']}  stored={sessions['stored_chars']} of "
+            f"{sessions['logical_chars']} chars  dedup={sessions['dedup_ratio']:.1%}"
+        )
+
+
+# MAIN #######################################################################
+
+
+def _parse_levels(raw: str) -> list[int]:
+    levels = [int(x) for x in raw.split(",") if x.strip()]
+    if not levels or any(c < 1 for c in levels):
+        raise argparse.ArgumentTypeError("levels must be positive integers, e.g. 1,4,8")
+    return levels
+
+
+def _parse_script(raw: str) -> list[str]:
+    steps = [x.strip() for x in raw.split(",") if x.strip()]
+    bad = [s for s in steps if s not in SCRIPT_STEPS]
+    if not steps or bad:
+        raise argparse.ArgumentTypeError(f"script steps must be from {', '.join(SCRIPT_STEPS)}")
+    return steps
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Load-test app.api:app against fake Ollama and Serper backends.")
+    ap.add_argument("--levels", type=_parse_levels, default=[1, 4, 8], help="Concurrency levels (default 1,4,8)")
+    ap.add_argument("--requests", type=int, default=40, help="Flows per level (a resume flow sends two requests)")
+    ap.add_argument("--resume-ratio", type=float, default=0.25, help="Fraction of flows that pause then resume")
+    ap.add_argument("--script", type=_parse_script, default=["search2", "final"], help="Fake model steps per round")
+    ap.add_argument("--chat-latency-ms", type=float, default=400.0)
+    ap.add_argument("--chat-jitter-ms", type=float, default=100.0)
+    ap.add_argument("--chat-fail-rate", type=float, default=0.0, help="Fraction of /api/chat calls answered with 500")
+    ap.add_argument("--serper-latency-ms", type=float, default=150.0)
+    ap.add_argument("--serper-jitter-ms", type=float, default=50.0)
+    ap.add_argument("--no-search", action="store_true", help="Run with SERPER_API_KEY unset (web_search disabled)")
+    ap.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="Extra env for the app (repeatable)")
+    ap.add_argument("--timeout", type=float, default=300.0, help="Per-request client timeout (s)")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--json", dest="json_path", default=None, help="Also write the report as JSON to this path")
+    ap.add_argument("--max-p95-ms", type=float, default=None, help="Exit 1 if any level's p95 exceeds this")
+    ap.add_argument("--max-error-rate", type=float, default=None, help="Exit 1 if any level's error rate exceeds this")
+    args = ap.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    stats = FakeStats()
+    ollama_port, serper_port, app_port = _free_port(), _free_port(), _free_port()
+    servers = [
+        serve_in_thread(
+            fake_ollama_app(args.script, args.chat_latency_ms, args.chat_jitter_ms, args.chat_fail_rate, stats), ollama_port
+        ),
+        serve_in_thread(fake_serper_app(args.serper_latency_ms, args.serper_jitter_ms, stats), serper_port),
+    ]
+
+    env = {
+        "OLLAMA_HOST": f"http://127.0.0.1:{ollama_port}",
+        "OLLAMA_API_KEY": "loadtest",
+        "OLLAMA_MODEL": "loadtest-fake",
+        "SERPER_API_KEY": "" if args.no_search else "loadtest",
+        "SERPER_BASE_URL": f"http://127.0.0.1:{serper_port}",
+        "AGENT_LOG_FILE": "0",
+        "AGENT_WARMUP_MODEL": "0",
+    }
+    for pair in args.app_env:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise SystemExit(f"--app-env expects KEY=VALUE, got {pair!r}")
+        env[key.strip()] = value
+
+    base = f"http://127.0.0.1:{app_port}"
+    proc = start_app(app_port, env)
+    report: dict[str, Any] = {"config": {k: v for k, v in vars(args).items() if k != "app_env"}, "app_env": env, "levels": []}
+    failed: list[str] = []
+    try:
+        wait_healthy(base, proc, timeout_s=60.0)
+        mem0 = rss_kb(proc.pid)
+        report["rss_start_kb"] = mem0["rss_kb"]
+        print(f"app pid={proc.pid} rss={mem0['rss_kb']} kB  script={','.join(args.script)}  resume_ratio={args.resume_ratio}")
+        for c in args.levels:
+            before_mem, before_fakes = rss_kb(proc.pid), stats.snapshot()
+            samples, elapsed = asyncio.run(run_level(base, c, args.requests, args.resume_ratio, args.timeout))
+            after_mem, after_fakes = rss_kb(proc.pid), stats.snapshot()
+            row = summarize(samples, elapsed)
+            row["concurrency"] = c
+            row["fakes"] = {k: after_fakes[k] - before_fakes[k] for k in after_fakes}
+            growth = None
+            if before_mem["rss_kb"] is not None and after_mem["rss_kb"] is not None:
+                growth = after_mem["rss_kb"] - before_mem["rss_kb"]
+            row["memory"] = {
+                "rss_before_kb": before_mem["rss_kb"],
+                "rss_after_kb": after_mem["rss_kb"],
+                "rss_growth_kb": growth,
+                "peak_kb": after_mem["peak_kb"],
+            }
+            try:
+                health = httpx.get(f"{base}/health", timeout=5.0).json()
+            except (httpx.HTTPError, ValueError):
+                health = {}
+            row["http_reuse"] = health.get("http_reuse")
+            row["sessions"] = health.get("sessions")
+            report["levels"].append(row)
+            print_level(c, row)
+            if args.max_p95_ms is not None and row["p95_ms"] > args.max_p95_ms:
+                failed.append(f"c={c}: p95 {row['p95_ms']} ms > {args.max_p95_ms}")
+            if args.max_error_rate is not None and row["error_rate"] > args.max_error_rate:
+                failed.append(f"c={c}: error rate {row['error_rate']} > {args.max_error_rate}")
+        mem1 = rss_kb(proc.pid)
+        report["rss_end_kb"] = mem1["rss_kb"]
+        if mem0["rss_kb"] is not None and mem1["rss_kb"] is not None:
+            report["rss_growth_kb"] = mem1["rss_kb"] - mem0["rss_kb"]
+            print(f"total rss growth: {report['rss_growth_kb']:+d} kB (peak {mem1['peak_kb']} kB)")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        for server in servers:
+            server.should_exit = True
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.json_path}")
+    if failed:
+        print("FAILED: " + "; ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
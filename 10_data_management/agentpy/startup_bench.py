@@ -0,0 +1,122 @@
+# startup_bench.py
+# Cold-start benchmark: `python -X importtime -c "import app.api"` in fresh interpreters
+# Tim Fraser
+#
+# Compares how long a worker takes to import the app (what Connect pays on every cold start and
+# restart) under different search setups:
+#   - lazy:  import app.api as deployed (crewai_tools is not imported at startup)
+#   - eager: import app.api, then force the CrewAI SerperDevTool import (the old module-level import)
+#   - http:  AGENT_SEARCH_BACKEND=http (built-in Serper client; crewai_tools never needed)
+# Each variant runs --runs times; prints median wall time, median import time from -X importtime,
+# and the heaviest packages (self time summed per root package) of the last run.
+#
+# Examples:
+#   python startup_bench.py
+#   python startup_bench.py --runs 10 --variants lazy,eager --top 20
+#
+# pip install -r requirements.txt
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+VARIANTS = {
+    "lazy": ("import app.api", {}),
+    "eager": ("import app.api; from app.tools import _serper_tool_class; _serper_tool_class()", {}),
+    "http": ("import app.api", {"AGENT_SEARCH_BACKEND": "http"}),
+}
+
+
+def parse_importtime(stderr: str) -> list[tuple[int, int, int, str]]:
+    """(depth, self_us, cumulative_us, module) for every line of -X importtime output."""
+    rows: list[tuple[int, int, int, str]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        try:
+            rows.append((depth, int(parts[0]), int(parts[1]), name.strip()))
+        except ValueError:
+            continue
+    return rows
+
+
+def total_import_s(rows: list[tuple[int, int, int, str]]) -> float:
+    """Sum of top-level cumulative times (nested imports are already inside their parent)."""
+    return sum(cum for depth, _, cum, _ in rows if depth == 0) / 1e6
+
+
+def by_package(rows: list[tuple[int, int, int, str]]) -> list[tuple[float, str]]:
+    """Self time summed per root package (fastapi, pydantic, crewai_tools, ...), heaviest first, in ms."""
+    totals: dict[str, int] = {}
+    for _, self_us, _, module in rows:
+        root = module.split(".")[0]
+        totals[root] = totals.get(root, 0) + self_us
+    return sorted(((us / 1000.0, name) for name, us in totals.items()), reverse=True)
+
+
+def run_once(code: str, env_extra: dict[str, str]) -> tuple[float, list[tuple[int, int, int, str]]]:
+    env = dict(os.environ)
+    env.update(env_extra)
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=HERE,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        tail = proc.stderr.strip().splitlines()[-1:] or ["(no stderr)"]
+        raise RuntimeError(tail[0])
+    return wall, parse_importtime(proc.stderr)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Measure app import (cold start) time with python -X importtime.")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--variants", default="lazy,eager,http", help=f"Comma list from {', '.join(VARIANTS)}")
+    ap.add_argument("--top", type=int, default=10, help="Heaviest packages to list per variant")
+    args = ap.parse_args()
+
+    baseline: float | None = None
+    for name in [v.strip() for v in args.variants.split(",") if v.strip()]:
+        if name not in VARIANTS:
+            raise SystemExit(f"unknown variant {name!r}")
+        code, env_extra = VARIANTS[name]
+        walls: list[float] = []
+        imports: list[float] = []
+        rows: list[tuple[int, int, int, str]] = []
+        try:
+            for _ in range(max(1, args.runs)):
+                wall, rows = run_once(code, env_extra)
+                walls.append(wall)
+                imports.append(total_import_s(rows))
+        except RuntimeError as exc:
+            print(f"{name:<6} failed: {exc}")
+            continue
+
+        wall_med = statistics.median(walls)
+        if baseline is None:
+            baseline = wall_med
+        crewai = "yes" if any(m.split(".")[0] == "crewai_tools" for _, _, _, m in rows) else "no"
+        print(
+            f"{name:<6} wall={wall_med * 1000:8.1f} ms  imports={statistics.median(imports) * 1000:8.1f} ms  "
+            f"vs first={wall_med / baseline:5.2f}x  crewai_tools imported={crewai}  (median of {len(walls)})"
+        )
+        for ms, package in by_package(rows)[: args.top]:
+            print(f"         {ms:8.1f} ms  {package}")
+
+
+if __name__ == "__main__":
+    main()
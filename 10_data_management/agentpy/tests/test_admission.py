@@ -0,0 +1,77 @@
+# Offline tests for admission control slot accounting (no Ollama / no network)
+# Run: python 10_data_management/agentpy/tests/test_admission.py
+
+from __future__ import annotations
+
+import asyncio
+import sys
+from pathlib import Path
+
+agentpy_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(agentpy_root))
+
+from app.admission import AdmissionController, Saturated
+
+
+async def cancel_after_handoff() -> None:
+    adm = AdmissionController(max_running=1, max_queued=4, max_per_client=0, queue_timeout_s=5.0)
+    first = await adm.acquire("a")
+    queued = asyncio.create_task(adm.acquire("b"))
+    await asyncio.sleep(0)
+    assert adm.running == 1 and adm.queued == 1
+    adm.release(first)  # hands the slot to the queued waiter ...
+    queued.cancel()  # ... which is cancelled before it resumes
+    try:
+        await queued
+    except asyncio.CancelledError:
+        pass
+    else:
+        adm.release(queued.result())  # the waiter won the race: it holds the slot, so give it back
+    assert adm.running == 0 and adm.queued == 0 and not adm.per_client, adm.snapshot()
+    again = await asyncio.wait_for(adm.acquire("c"), timeout=1.0)
+    assert again.queue_wait_s == 0.0
+
+
+async def cancel_while_queued() -> None:
+    adm = AdmissionController(max_running=1, max_queued=4, max_per_client=0, queue_timeout_s=5.0)
+    first = await adm.acquire("a")
+    queued = asyncio.create_task(adm.acquire("b"))
+    await asyncio.sleep(0)
+    queued.cancel()
+    await asyncio.gather(queued, return_exceptions=True)
+    assert adm.running == 1 and adm.queued == 0
+    adm.release(first)
+    assert adm.running == 0
+
+
+async def queue_timeout() -> None:
+    adm = AdmissionController(max_running=1, max_queued=4, max_per_client=0, queue_timeout_s=0.05)
+    first = await adm.acquire("a")
+    try:
+        await adm.acquire("b")
+    except Saturated as exc:
+        assert exc.reason == "queue_timeout"
+    else:
+        raise AssertionError("expected queue_timeout")
+    adm.release(first)
+    assert adm.running == 0 and not adm.per_client
+
+
+def main() -> None:
+    print("test_admission: cancel after slot handoff ...")
+    asyncio.run(cancel_after_handoff())
+    print("   OK")
+
+    print("test_admission: cancel while queued ...")
+    asyncio.run(cancel_while_queued())
+    print("   OK")
+
+    print("test_admission: queue timeout ...")
+    asyncio.run(queue_timeout())
+    print("   OK")
+
+    print("test_admission: all passed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# bench_set_cell.py
+# Offline benchmark: per-call set_cell (full row_id scan) vs row_id index + batched vectorized edits
+# Tim Fraser
+#
+# Builds synthetic inventory tables shaped like data/messy_inventory_raw.csv (10k / 100k / 1M rows by
+# default), generates --edits set_cell calls (about one in five with a stale expected_old_value), and times:
+#   - scan:  the old run_set_cell path — pd.to_numeric over row_id + boolean mask per call, O(K·N)
+#   - batch: build_row_index once + apply_set_cell_batch per --chunk calls (functions.py), O(N + K)
+# The scan path is timed on at most --scan-max-edits calls and extrapolated to --edits when larger.
+# Both paths must leave identical tables (checked when the scan ran every edit). No API calls.
+#
+# Examples:
+#   python bench_set_cell.py
+#   python bench_set_cell.py --sizes 10000,100000 --edits 5000 --chunk 10
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from functions import apply_set_cell_batch, build_row_index
+
+COLUMNS = ("qty_on_hand", "last_restock", "category")
+
+
+def make_table(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "row_id": np.arange(1, n_rows + 1).astype(str),
+            "sku": np.char.add("S-", rng.integers(100, 999, n_rows).astype(str)),
+            "qty_on_hand": rng.choice(["12", "n/a", "0", "1 1", "3 units"], n_rows),
+            "last_restock": rng.choice(["2024-01-15", "not-a-date", "2024-13-01"], n_rows),
+            "category": rng.choice(["Electronics", "elec", "food_service", "Food "], n_rows),
+        },
+        dtype=str,
+    )
+
+
+def make_edits(df: pd.DataFrame, n_edits: int, seed: int = 1) -> list[dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(df), n_edits)
+    cols = rng.choice(COLUMNS, n_edits)
+    stale = rng.random(n_edits) < 0.2
+    edits = []
+    for r, c, s in zip(rows.tolist(), cols.tolist(), stale.tolist()):
+        edits.append(
+            {
+                "row_id": int(df.iat[r, 0]),
+                "column_name": c,
+                "new_value": "Food" if c == "category" else "",
+                "expected_old_value": "stale" if s else str(df.at[r, c]),
+            }
+        )
+    return edits
+
+
+def scan_set_cell(df: pd.DataFrame, args: dict[str, Any]) -> str:
+    """The pre-index run_set_cell lookup and write (validation trimmed to what the synthetic calls need)."""
+    rid = int(args["row_id"])
+    col = str(args["column_name"])
+    rids = pd.to_numeric(df["row_id"], errors="coerce")
+    idx = df.index[rids == rid]
+    if len(idx) == 0:
+        return f"Error: no row with row_id={rid}"
+    i = idx[0]
+    old = df.at[i, col]
+    old = "" if pd.isna(old) else str(old)
+    ev = args.get("expected_old_value")
+    if ev is not None and old != str(ev):
+        return "Skipped"
+    df.at[i, col] = str(args["new_value"])
+    return "OK"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark set_cell: per-call row_id scan vs index + batched edits.")
+    ap.add_argument("--sizes", default="10000,100000,1000000", help="Comma list of table row counts")
+    ap.add_argument("--edits", type=int, default=2000, help="set_cell calls applied per table")
+    ap.add_argument("--chunk", type=int, default=10, help="Calls per batch (≈ set_cell calls one chunk returns)")
+    ap.add_argument("--scan-max-edits", type=int, default=50, help="Cap on timed scan calls; extrapolated beyond")
+    args = ap.parse_args()
+
+    print(f"{'rows':>9} {'edits':>6} {'scan s':>10} {'index s':>8} {'batch s':>8} {'speedup':>9}  note")
+    for n_rows in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        base = make_table(n_rows)
+        edits = make_edits(base, args.edits)
+
+        scan_df = base.copy()
+        n_scan = min(len(edits), max(1, args.scan_max_edits))
+        t0 = time.perf_counter()
+        for e in edits[:n_scan]:
+            scan_set_cell(scan_df, e)
+        scan_s = (time.perf_counter() - t0) * len(edits) / n_scan
+
+        batch_df = base.copy()
+        t0 = time.perf_counter()
+        index = build_row_index(batch_df)
+        index_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        n_ok = 0
+        for s in range(0, len(edits), max(1, args.chunk)):
+            results, _ = apply_set_cell_batch(batch_df, edits[s : s + args.chunk], index)
+            n_ok += sum(r.startswith("OK:") for r in results)
+        batch_s = time.perf_counter() - t0
+
+        if n_scan == len(edits):
+            assert scan_df.equals(batch_df), "scan and batch results differ"
+            note = "identical output"
+        else:
+            note = f"scan extrapolated from {n_scan} calls"
+        speedup = scan_s / (index_s + batch_s) if index_s + batch_s > 0 else float("inf")
+        print(
+            f"{n_rows:>9} {len(edits):>6} {scan_s:>10.2f} {index_s:>8.3f} {batch_s:>8.3f} {speedup:>8.0f}x  "
+            f"{note}; {n_ok} applied"
+        )
+
+
+if __name__ == "__main__":
+    main()
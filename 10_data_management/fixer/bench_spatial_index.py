@@ -0,0 +1,169 @@
+# bench_spatial_index.py
+# Offline benchmark: nearest_poi / count_pois_within by linear scan vs per-category STRtree (PoiIndex)
+# vs the bulk table (compute_context_metrics) that FIXER_CONTEXT_BULK=1 precomputes
+# Tim Fraser
+#
+# Builds a synthetic metric-CRS city (--sizes parcels and the same number of POIs by default): square
+# parcels on a grid and uniformly scattered POIs over the POI_CATEGORIES of fixer_spatial_context.py
+# (unevenly weighted, so some categories are sparse).
+# Then it times --calls random tool calls (half nearest_poi, half count_pois_within at 400 / 800 m):
+#   - scan:  the old tool bodies — category filter + GeoSeries.distance / .intersects over every POI
+#   - index: PoiIndex built once (spatial_functions.py) + one STRtree query per call
+#   - bulk:  compute_context_metrics for every parcel × category × metric, then one cell read per call
+# "idx-all s" extrapolates the index path to that same full table (parcels × 3 metrics × categories calls),
+# which is the fair comparison for the bulk column.
+# The scan path is timed on at most --scan-max-calls calls and extrapolated to --calls when larger.
+# Every scanned call must match the index, and every call must match the bulk table. No API calls.
+#
+# Examples:
+#   python bench_spatial_index.py
+#   python bench_spatial_index.py --sizes 100000 --pois 250000 --calls 5000
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import geopandas as gpd
+import numpy as np
+from shapely import box
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from spatial_functions import PoiIndex, compute_context_metrics
+
+CATEGORIES = (
+    "healthcare",
+    "food_retail",
+    "retail",
+    "financial",
+    "transport",
+    "recreation",
+    "parking",
+    "childcare",
+    "agriculture",
+    "vacant",
+    "public_government",
+    "other",
+)
+CATEGORY_WEIGHTS = (0.06, 0.08, 0.2, 0.05, 0.15, 0.08, 0.1, 0.04, 0.02, 0.02, 0.05, 0.15)
+PARCEL_SIDE_M = 40.0
+PARCEL_PITCH_M = 50.0
+
+
+def make_city(n_parcels: int, n_pois: int, seed: int = 0) -> tuple[gpd.GeoSeries, gpd.GeoDataFrame]:
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_parcels)))
+    ix, iy = np.divmod(np.arange(n_parcels), side)
+    x0, y0 = ix * PARCEL_PITCH_M, iy * PARCEL_PITCH_M
+    parcels = gpd.GeoSeries(box(x0, y0, x0 + PARCEL_SIDE_M, y0 + PARCEL_SIDE_M), crs=32617)
+    extent = side * PARCEL_PITCH_M
+    pois = gpd.GeoDataFrame(
+        {
+            "poi_id": np.arange(1, n_pois + 1),
+            "normalized_category": rng.choice(CATEGORIES, n_pois, p=CATEGORY_WEIGHTS),
+        },
+        geometry=gpd.points_from_xy(rng.uniform(0, extent, n_pois), rng.uniform(0, extent, n_pois)),
+        crs=32617,
+    )
+    return parcels, pois
+
+
+def make_calls(n_parcels: int, n_calls: int, seed: int = 1) -> list[dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "tool": "nearest_poi" if i % 2 == 0 else "count_pois_within",
+            "parcel": int(p),
+            "poi_category": str(c),
+            "buffer_m": int(b),
+        }
+        for i, (p, c, b) in enumerate(
+            zip(rng.integers(0, n_parcels, n_calls), rng.choice(CATEGORIES, n_calls), rng.choice([400, 800], n_calls))
+        )
+    ]
+
+
+def scan_call(parcels: gpd.GeoSeries, pois: gpd.GeoDataFrame, call: dict[str, Any]) -> Any:
+    """The pre-index tool bodies: filter the POI frame by category, then measure against every POI."""
+    geom = parcels.iloc[call["parcel"]]
+    pt = pois[pois["normalized_category"].astype(str) == call["poi_category"]]
+    if call["tool"] == "nearest_poi":
+        if len(pt) < 1:
+            return None
+        dists = pt.geometry.distance(geom.centroid)
+        return int(pt.loc[dists.idxmin(), "poi_id"]), float(dists.min())
+    if len(pt) < 1:
+        return 0
+    return int(pt.geometry.intersects(geom.buffer(float(call["buffer_m"]))).sum())
+
+
+def index_call(parcels: gpd.GeoSeries, index: PoiIndex, call: dict[str, Any]) -> Any:
+    geom = parcels.iloc[call["parcel"]]
+    if call["tool"] == "nearest_poi":
+        hit = index.nearest(call["poi_category"], geom.centroid)
+        return None if hit is None else (int(hit[0]), hit[1])
+    return index.count_within(call["poi_category"], geom.buffer(float(call["buffer_m"])))
+
+
+def bulk_call(metrics: Any, call: dict[str, Any]) -> Any:
+    cat, row = call["poi_category"], call["parcel"]
+    if call["tool"] == "nearest_poi":
+        d = metrics[f"ctx_nearest_{cat}_m"].iat[row]
+        return None if np.isnan(d) else (int(metrics[f"ctx_nearest_{cat}_poi_id"].iat[row]), float(d))
+    return int(metrics[f"ctx_n_{cat}_{call['buffer_m']}"].iat[row])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark spatial tools: linear POI scan vs per-category STRtree.")
+    ap.add_argument("--sizes", default="10000,100000,250000", help="Comma list of parcel counts")
+    ap.add_argument("--pois", type=int, default=0, help="POI count (default: same as parcels)")
+    ap.add_argument("--calls", type=int, default=2000, help="Tool calls per size (half nearest, half count)")
+    ap.add_argument("--scan-max-calls", type=int, default=40, help="Cap on timed scan calls; extrapolated beyond")
+    args = ap.parse_args()
+
+    print(
+        f"{'parcels':>8} {'pois':>8} {'calls':>6} {'scan s':>9} {'build s':>8} {'index s':>8} {'speedup':>9} "
+        f"{'idx-all s':>9} {'bulk s':>8}  note"
+    )
+    for n_parcels in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        n_pois = args.pois or n_parcels
+        parcels, pois = make_city(n_parcels, n_pois)
+        calls = make_calls(n_parcels, args.calls)
+
+        n_scan = min(len(calls), max(1, args.scan_max_calls))
+        t0 = time.perf_counter()
+        scanned = [scan_call(parcels, pois, c) for c in calls[:n_scan]]
+        scan_s = (time.perf_counter() - t0) * len(calls) / n_scan
+
+        t0 = time.perf_counter()
+        index = PoiIndex(pois.geometry, pois["normalized_category"], pois["poi_id"])
+        build_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        indexed = [index_call(parcels, index, c) for c in calls]
+        index_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        metrics = compute_context_metrics(gpd.GeoDataFrame(geometry=parcels), pois, list(CATEGORIES))
+        bulked = [bulk_call(metrics, c) for c in calls]
+        bulk_s = time.perf_counter() - t0
+
+        for a, b in list(zip(scanned, indexed)) + list(zip(indexed, bulked)):
+            if isinstance(a, tuple):
+                assert b is not None and a[0] == b[0] and np.isclose(a[1], b[1]), f"nearest differs: {a} vs {b}"
+            else:
+                assert a == b, f"count differs: {a} vs {b}"
+        index_all_s = index_s * n_parcels * 3 * len(CATEGORIES) / len(calls)
+        note = f"{n_scan} scanned calls match, bulk matches index" + ("" if n_scan == len(calls) else ", scan extrapolated")
+        speedup = scan_s / (build_s + index_s) if build_s + index_s > 0 else float("inf")
+        print(
+            f"{n_parcels:>8} {n_pois:>8} {len(calls):>6} {scan_s:>9.2f} {build_s:>8.3f} {index_s:>8.3f} "
+            f"{speedup:>8.0f}x {index_all_s:>9.1f} {bulk_s:>8.2f}  {note}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,13 @@
 # fixer_csv.py
-# Batched CSV repair — one Ollama round per N rows + ThreadPoolExecutor chunk parallelism
+# Batched CSV repair — one Ollama round per N rows + async chunk dispatcher (one pooled HTTP client)
 # Tim Fraser
 
 from __future__ import annotations
 
-import json
 import os
 import shutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timezone
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from pathlib import Path
 from typing import Any
 
@@ -16,16 +15,28 @@ import pandas as pd
 from dotenv import load_dotenv
 
 from functions import (
-    ollama_chat_once,
+    CHARS_PER_TOKEN,
+    AuditWriter,
+    ChunkDispatcher,
+    RunManifest,
+    apply_set_cell_batch,
+    build_row_index,
+    chunk_key,
+    chunk_plan_summary,
+    estimate_prompt_tokens,
     parse_function_arguments,
-    split_df_into_row_chunks,
+    preclean_inventory,
+    resume_requested,
+    split_df_into_token_chunks,
+    token_note,
+    utc_stamp,
 )
 
 # 0. SETUP ###################################
 
 print()
 print("=================================================================")
-print("📋 fixer_csv.py — batched tool calls + ThreadPoolExecutor (Ollama Cloud)")
+print("📋 fixer_csv.py — batched tool calls + async chunk dispatcher (Ollama Cloud)")
 print("=================================================================\n")
 
 print("📦 Loading Python packages (pandas, httpx, dotenv) ...")
@@ -36,12 +47,15 @@ os.chdir(FIXER_ROOT)
 print("📁 Resolving fixer folder and paths ...")
 print(f"   📍 FIXER_ROOT: {FIXER_ROOT}")
 
-RAW_PATH = FIXER_ROOT / "data" / "messy_inventory_raw.csv"
+RAW_PATH = Path(os.environ.get("FIXER_RAW_CSV", str(FIXER_ROOT / "data" / "messy_inventory_raw.csv")))
 WORK_PATH = FIXER_ROOT / "output" / "messy_inventory_working.csv"
 LOG_PATH = FIXER_ROOT / "output" / "fix_audit.jsonl"
+MANIFEST_PATH = FIXER_ROOT / "output" / "fix_manifest.jsonl"
+RESUME = resume_requested()
 print(f"   📄 Raw data:     {RAW_PATH}")
 print(f"   💾 Working copy: {WORK_PATH}")
-print(f"   📝 Audit log:    {LOG_PATH}\n")
+print(f"   📝 Audit log:    {LOG_PATH}")
+print(f"   🧾 Manifest:     {MANIFEST_PATH}{' (--resume)' if RESUME else ''}\n")
 
 env_path = FIXER_ROOT / ".env"
 print("🔐 Loading .env ...")
@@ -74,10 +88,32 @@ def read_env_digits(name: str, default: int) -> int:
     return default
 
 
+def read_env_float(name: str, default: float) -> float:
+    try:
+        v = float(os.environ.get(name, "").strip())
+    except ValueError:
+        return default
+    return v if v > 0 else default
+
+
 ROWS_PER_BATCH = read_env_digits("ROWS_PER_BATCH", 10)
 FIXER_CHUNK_WORKERS = read_env_digits("FIXER_CHUNK_WORKERS", 1)
+FIXER_CHUNK_TOKENS = read_env_digits("FIXER_CHUNK_TOKENS", 4096)
+FIXER_CHARS_PER_TOKEN = read_env_float("FIXER_CHARS_PER_TOKEN", CHARS_PER_TOKEN)
+# Deterministic rules fix the mechanical cells first; only rows they cannot settle go to the LLM (0 = send every row).
+FIXER_PRECLEAN = os.environ.get("FIXER_PRECLEAN", "1").strip() != "0"
 print(f"📊 ROWS_PER_BATCH = {ROWS_PER_BATCH} (env ROWS_PER_BATCH)")
-print(f"📊 FIXER_CHUNK_WORKERS = {FIXER_CHUNK_WORKERS} (env FIXER_CHUNK_WORKERS)\n")
+print(f"📊 FIXER_CHUNK_WORKERS = {FIXER_CHUNK_WORKERS} (env FIXER_CHUNK_WORKERS)")
+print(f"📊 FIXER_CHUNK_TOKENS = {FIXER_CHUNK_TOKENS} prompt tokens per chunk (env FIXER_CHUNK_TOKENS)")
+print(f"📊 FIXER_CHARS_PER_TOKEN = {FIXER_CHARS_PER_TOKEN} (env FIXER_CHARS_PER_TOKEN)")
+# Streaming mode: read the raw CSV in blocks, keep at most 2 × workers chunks in flight, append cleaned blocks in order.
+# Blocks are raw rows; pre-cleaning sends only a few percent onward, so the floor keeps LLM chunks full.
+FIXER_STREAM = os.environ.get("FIXER_STREAM", "0").strip() == "1"
+STREAM_BLOCK_ROWS = read_env_digits("FIXER_STREAM_BLOCK_ROWS", max(5000, 4 * ROWS_PER_BATCH * FIXER_CHUNK_WORKERS))
+print(f"📊 FIXER_PRECLEAN = {int(FIXER_PRECLEAN)} (env FIXER_PRECLEAN)")
+if FIXER_STREAM:
+    print(f"📊 FIXER_STREAM = 1, block = {STREAM_BLOCK_ROWS} rows (env FIXER_STREAM_BLOCK_ROWS)")
+print()
 
 print("🔌 Importing fixer/functions.py ...")
 print("   ✅ Helpers loaded.\n")
@@ -128,66 +164,73 @@ DATA_QUALITY_BLURB = (
 # Mutable tool state (main thread only)
 tool_state: dict[str, Any] = {
     "df": None,
+    "row_index": {},  # row_id -> row position, built once after loading (row_id is never edited)
     "audit_path": str(LOG_PATH),
+    "audit": None,  # AuditWriter, opened after the log reset
     "api_round": 0,
+    "streaming": False,  # df holds only the current block; the output file is appended block by block
+    "shortened": set(),  # (row_id, column) cells cut to fit FIXER_CHUNK_TOKENS; set_cell refuses to edit them
 }
 
 
 def append_audit(obj: dict[str, Any]) -> None:
-    line = json.dumps(obj, ensure_ascii=False) + "\n"
-    with open(tool_state["audit_path"], "a", encoding="utf-8") as f:
-        f.write(line)
+    tool_state["audit"].write(obj)
 
 
-def run_set_cell(args: dict[str, Any], api_round: int) -> str:
-    args = args or {}
-    rid = args.get("row_id")
-    col = str(args.get("column_name") or "")
-    nv = str(args.get("new_value") or "")
-    ev = args.get("expected_old_value")
-    if rid is None:
-        return "Error: row_id required."
+def shortened_cell(args: dict[str, Any]) -> tuple[int, str] | None:
     try:
-        rid = int(rid)
+        return int(args.get("row_id")), str(args.get("column_name") or "")
     except (TypeError, ValueError):
-        return "Error: row_id must be integer-like."
-    if not col:
-        return "Error: column_name required."
-    if col == "row_id":
-        return "Error: row_id column cannot be edited."
-    df: pd.DataFrame = tool_state["df"]
-    if col not in df.columns:
-        return f"Error: unknown column {col}"
-    rids = pd.to_numeric(df["row_id"], errors="coerce")
-    idx = df.index[rids == rid]
-    if len(idx) == 0:
-        return f"Error: no row with row_id={rid}"
-    i = idx[0]
-    old = df.at[i, col]
-    old = "" if pd.isna(old) else str(old)
-    if ev is not None:
-        evs = "" if pd.isna(ev) else str(ev)
-        if old != evs:
-            return (
-                f'Skipped: expected_old_value mismatch for row_id={rid} col={col} '
-                f'(current="{old}" expected="{evs}")'
-            )
-    df.at[i, col] = nv
-    append_audit(
-        {
-            "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
-            "api_round": int(api_round),
-            "tool": "set_cell",
-            "row_id": rid,
-            "column": col,
-            "old_value": old,
-            "new_value": nv,
-        }
+        return None
+
+
+def note_shortened(chunk: pd.DataFrame) -> None:
+    """Remember the cells split_df_into_token_chunks cut in this chunk's prompt and warn once per row."""
+    cols = chunk.attrs.get("shortened")
+    if not cols:
+        return
+    rid = pd.to_numeric(chunk["row_id"], errors="coerce").iloc[0]
+    if pd.notna(rid):
+        tool_state["shortened"].update((int(rid), c) for c in cols)
+    print(
+        f"   ⚠️  row_id {chunk['row_id'].iloc[0]} ({', '.join(cols)}) shortened to fit FIXER_CHUNK_TOKENS; "
+        "set_cell will not edit those cells."
     )
-    return f"OK: row_id={rid} {col} updated."
+
+
+def run_set_cell_batch(calls: list[tuple[dict[str, Any], int]]) -> list[str]:
+    """
+    Apply one chunk's set_cell calls as a batch: (args, api_round) pairs in call order.
+    Row lookup goes through tool_state["row_index"]; checks and writes are vectorized per column.
+    """
+    if not calls:
+        return []
+    results = [""] * len(calls)
+    send = []
+    for k, (args, _) in enumerate(calls):
+        if tool_state["shortened"] and shortened_cell(args) in tool_state["shortened"]:
+            results[k] = (
+                f"Skipped: row_id={args.get('row_id')} col={args.get('column_name')} was shortened in the prompt "
+                "(…[+N chars]); it cannot be edited in this run."
+            )
+        else:
+            send.append(k)
+    batch, applied = apply_set_cell_batch(tool_state["df"], [calls[k][0] for k in send], tool_state["row_index"])
+    for j, k in enumerate(send):
+        results[k] = batch[j]
+    ts = utc_stamp()
+    for j, edit in applied:
+        append_audit({"ts": ts, "api_round": int(calls[send[j]][1]), "tool": "set_cell", **edit})
+    return results
+
+
+def run_set_cell(args: dict[str, Any], api_round: int) -> str:
+    return run_set_cell_batch([(args, api_round)])[0]
 
 
 def run_write_checkpoint() -> str:
+    if tool_state["streaming"]:
+        return f"Checkpoint skipped: streaming mode appends each cleaned block to {WORK_PATH.name} in order.\n"
     df: pd.DataFrame = tool_state["df"]
     df.to_csv(WORK_PATH, index=False, na_rep="")
     return f"Checkpoint written: {len(df)} rows to {WORK_PATH}\n"
@@ -253,22 +296,17 @@ def dispatch_fixer_tool(name: str, args: dict[str, Any], api_round: int) -> str:
     return f"Unknown tool: {name}"
 
 
-def call_chunk_ollama(
+def chunk_messages(
     chunk_index: int,
-    n_chunks: int,
+    n_chunks: int | None,
     chunk_csv_text: str,
-    ollama_host: str,
-    ollama_key: str,
-    ollama_model: str,
     system_prompt: str,
     data_blurb: str,
-    tools: list[dict[str, Any]],
-    max_output_tokens: int | None,
-) -> dict[str, Any]:
+) -> list[dict[str, Any]]:
     user_msg = (
         "Data dictionary + cleaning rules:\n\n"
         f"{data_blurb}\n\n---\nChunk "
-        f"{chunk_index} of {n_chunks} (inventory CSV; columns must keep their semantics):\n\n"
+        f"{chunk_index}{f' of {n_chunks}' if n_chunks else ''} (inventory CSV; columns must keep their semantics):\n\n"
         f"{chunk_csv_text}\n\n---\n"
         "Emit **set_cell** only where the rules require a change (skip if new_value would equal current). "
         "Use **expected_old_value** when possible (match the cell text exactly as shown in the CSV). "
@@ -280,34 +318,172 @@ def call_chunk_ollama(
         "You may call **write_checkpoint** once after edits. "
         "Reply with tool calls only (minimal prose)."
     )
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_msg},
     ]
-    try:
-        out = ollama_chat_once(
-            ollama_host,
-            ollama_key,
-            ollama_model,
-            messages,
-            tools=tools,
-            format=None,
-            max_output_tokens=max_output_tokens,
-        )
-    except Exception as e:
-        return {
-            "chunk_index": chunk_index,
-            "tool_calls": [],
-            "error": str(e),
-            "content": "",
-        }
-    msg = out.get("message") or {}
-    return {
-        "chunk_index": chunk_index,
-        "tool_calls": msg.get("tool_calls") or [],
-        "error": None,
-        "content": out.get("content") or "",
-    }
+
+
+SYSTEM_BATCH = (
+    "You are a **batch** CSV cleaning assistant for a **retail inventory** table (SKU stock counts, restock dates, Electronics vs Food). "
+    "Each user message is one row chunk plus a data dictionary. Fix cells using **set_cell** only (plus optional **write_checkpoint**). "
+    "Prefer **expected_old_value** on each set_cell. "
+    "**qty_on_hand** = positive digits or **empty**; **`0` → empty** (placeholder). Spaced digits: **concatenate in order only** (`2 0`→`20`), **never** invent unrelated numbers (`2 0`≠`150`). "
+    "**last_restock** = keep **valid YYYY-MM-DD** unchanged; blank **only** invalid/junk dates. **category** = Electronics or Food only. "
+    "Never put dates in qty_on_hand or invent numbers when qty is wrong—use **empty string** for missing. "
+    "Never write the text **NaN**, **NA**, or **null** as a cell value—use **empty string** for missing. "
+    "**Cafeteria / grocery / food_service** → category **Food**, not Electronics. "
+    "\"1 2 3\" in qty → **\"123\"** (concatenation), never a date. "
+    "Skip set_cell when new_value would equal the current value. Do not invent row_ids."
+)
+
+tools = fixer_tool_definitions()
+# Fixed part of every prompt (system prompt, blurb, tool schemas); rows fill the rest of FIXER_CHUNK_TOKENS.
+fixed_tokens = estimate_prompt_tokens(
+    chunk_messages(1, 1, "", SYSTEM_BATCH, DATA_QUALITY_BLURB), tools, FIXER_CHARS_PER_TOKEN
+)
+if fixed_tokens >= FIXER_CHUNK_TOKENS:
+    raise SystemExit(
+        f"FIXER_CHUNK_TOKENS={FIXER_CHUNK_TOKENS} leaves no room for rows: the fixed prompt alone is about "
+        f"{fixed_tokens} tokens. Raise FIXER_CHUNK_TOKENS (e.g. {2 * fixed_tokens})."
+    )
+
+
+def apply_chunk_tool_calls(cr: dict[str, Any], api_round: int) -> tuple[int, int]:
+    """Execute one chunk's tool calls in order on the main thread; returns (last api_round, tools executed)."""
+    ci = cr["chunk_index"]
+    tcalls = cr.get("tool_calls") or []
+    if not tcalls:
+        tail = ""
+        c = cr.get("content") or ""
+        if c:
+            tail = f" (assistant text: {c[:80]}...)"
+        print(f"   ⚠️  Chunk {ci}: no tool calls{tail}")
+        return api_round, 0
+    print(f"   📦 Chunk {ci}: {len(tcalls)} tool call(s){token_note(cr)}")
+    # set_cell calls queue up and apply as one vectorized batch, flushed before any other tool
+    # (write_checkpoint must see the edits) and at the end of the chunk.
+    n_tools = 0
+    pending: list[tuple[dict[str, Any], int]] = []
+    for tc in tcalls:
+        if not isinstance(tc, dict):
+            continue
+        api_round += 1
+        tool_state["api_round"] = api_round
+        fn = tc.get("function") or {}
+        name = str(fn.get("name") or "")
+        args = parse_function_arguments(fn.get("arguments"))
+        if name == "set_cell":
+            print(f"      ✏️  set_cell row_id={args.get('row_id', '?')} col={args.get('column_name', '?')}")
+            pending.append((args, api_round))
+        else:
+            run_set_cell_batch(pending)
+            pending = []
+            dispatch_fixer_tool(name, args, api_round)
+        n_tools += 1
+    run_set_cell_batch(pending)
+    tool_state["audit"].end_chunk()
+    return api_round, n_tools
+
+
+def preclean_block(block: pd.DataFrame) -> tuple[int, pd.DataFrame]:
+    """Run the rule engine on block in place and audit its edits; returns (cells fixed, rows that need the LLM)."""
+    if not FIXER_PRECLEAN:
+        return 0, block
+    edits, needs_llm = preclean_inventory(block)
+    ts = utc_stamp()
+    for edit in edits:
+        append_audit({"ts": ts, "api_round": 0, "tool": "preclean", **edit})
+    return len(edits), block[needs_llm]
+
+
+def run_chunk(chunk_index: int, n_chunks: int | None, chunk_csv_text: str) -> Future:
+    """Queue one chunk on the dispatcher; resolves from the run manifest when --resume holds the same chunk."""
+    key = chunk_key(OLLAMA_MODEL, SYSTEM_BATCH, DATA_QUALITY_BLURB, tools, chunk_csv_text)
+    messages = chunk_messages(chunk_index, n_chunks, chunk_csv_text, SYSTEM_BATCH, DATA_QUALITY_BLURB)
+    return dispatcher.submit(chunk_index, messages, key=key)
+
+
+def run_streaming() -> dict[str, int]:
+    """
+    Out-of-core pipeline: read RAW_PATH in blocks of STREAM_BLOCK_ROWS, pre-clean each block, send its
+    ambiguous rows to the LLM as FIXER_CHUNK_TOKENS-sized chunks (at most 2 × FIXER_CHUNK_WORKERS in flight), then
+    apply the tool calls and append the block to WORK_PATH in file order. Memory holds a few blocks plus
+    the in-flight chunk prompts, whatever the file size.
+    """
+    tool_state["streaming"] = True
+    window = 2 * FIXER_CHUNK_WORKERS
+    max_blocks = 2 + FIXER_CHUNK_WORKERS
+    stats = {"rows": 0, "llm_rows": 0, "preclean": 0, "chunks": 0, "tools": 0, "api_round": 0, "blocks": 0}
+    # (block, [(chunk_index, future)]) in file order; the head is applied and written first
+    pending: deque[tuple[pd.DataFrame, list[tuple[int, Future]]]] = deque()
+
+    def in_flight() -> list[Future]:
+        return [f for _, futs in pending for _, f in futs if not f.done()]
+
+    def finish_head() -> None:
+        block, futs = pending.popleft()
+        tool_state["df"] = block
+        tool_state["row_index"] = build_row_index(block)
+        for _, fut in futs:
+            cr = fut.result()
+            if cr.get("error"):
+                print(f"   ❌ Chunk {cr['chunk_index']} API error: {cr['error']}")
+            stats["api_round"], n = apply_chunk_tool_calls(cr, stats["api_round"])
+            stats["tools"] += n
+        block.to_csv(out, header=stats["blocks"] == 0, index=False, na_rep="")
+        stats["blocks"] += 1
+        tool_state["df"] = None
+
+    reader = pd.read_csv(RAW_PATH, dtype=str, keep_default_na=False, chunksize=STREAM_BLOCK_ROWS)
+    with open(WORK_PATH, "w", encoding="utf-8", newline="") as out:
+        for block in reader:
+            block = block.reset_index(drop=True)
+            n_fixed, llm_rows = preclean_block(block)
+            stats["rows"] += len(block)
+            stats["llm_rows"] += len(llm_rows)
+            stats["preclean"] += n_fixed
+            futs: list[tuple[int, Future]] = []
+            pending.append((block, futs))
+            for chunk in split_df_into_token_chunks(
+                llm_rows, FIXER_CHUNK_TOKENS, fixed_tokens, ROWS_PER_BATCH, FIXER_CHARS_PER_TOKEN, keep_cols=("row_id",)
+            ):
+                note_shortened(chunk)
+                while len(in_flight()) >= window:
+                    wait(in_flight(), return_when=FIRST_COMPLETED)
+                stats["chunks"] += 1
+                futs.append((stats["chunks"], run_chunk(stats["chunks"], None, chunk.to_csv(index=False))))
+            while len(pending) > 1 and (len(pending) > max_blocks or all(f.done() for _, f in pending[0][1])):
+                finish_head()
+        while pending:
+            finish_head()
+    tool_state["streaming"] = False
+    return stats
+
+
+def print_summary(n_rows: int, n_llm_rows: int, n_preclean: int, n_chunks: int, n_tools_executed: int) -> None:
+    dispatcher.close()
+    tool_state["audit"].close()
+    manifest.close()
+    n_audit = 0
+    if LOG_PATH.is_file():
+        with open(LOG_PATH, encoding="utf-8") as f:
+            n_audit = sum(1 for line in f if line.strip())
+    llm_fraction = n_llm_rows / n_rows if n_rows else 0.0
+
+    print("=================================================================")
+    print("📊 Summary")
+    print("=================================================================")
+    print(f"🧹 Cells fixed by rules:  {n_preclean}")
+    print(f"🤖 Rows sent to LLM:      {n_llm_rows} / {n_rows} ({llm_fraction:.1%})")
+    print(f"📦 Chunks:                {n_chunks} ({n_chunks - manifest.n_resumed} API calls, {manifest.n_resumed} resumed)")
+    print(f"🔧 Tool calls executed:   {n_tools_executed}")
+    print(f"✏️  Audit lines:           {n_audit} ({n_audit - n_preclean} set_cell + {n_preclean} preclean)")
+    print(f"👷 Chunk workers used:    {FIXER_CHUNK_WORKERS}")
+    print(f"🌐 HTTP:                  {dispatcher.summary()}")
+    print(f"💾 Working file:          {WORK_PATH}")
+    print(f"📝 Audit log:             {LOG_PATH}")
+    print("=================================================================")
 
 
 print("🧰 Initializing tool_state + tool definitions ...")
@@ -323,6 +499,32 @@ print("📁 Ensuring output/ exists ...")
 (FIXER_ROOT / "output").mkdir(parents=True, exist_ok=True)
 print("   ✅ output/ OK.\n")
 
+manifest = RunManifest(MANIFEST_PATH, resume=RESUME)
+if RESUME:
+    print(f"♻️  Resuming: {len(manifest.entries)} finished chunk(s) in {MANIFEST_PATH.name} will be replayed, not re-sent.\n")
+dispatcher = ChunkDispatcher(
+    OLLAMA_HOST,
+    OLLAMA_API_KEY,
+    OLLAMA_MODEL,
+    tools=tools,
+    max_output_tokens=MAX_OUT,
+    concurrency=FIXER_CHUNK_WORKERS,
+    manifest=manifest,
+    chars_per_token=FIXER_CHARS_PER_TOKEN,
+)
+
+if FIXER_STREAM:
+    print("🗑️  Resetting audit log ...")
+    if LOG_PATH.is_file():
+        LOG_PATH.unlink()
+    tool_state["audit"] = AuditWriter.from_env(LOG_PATH)
+    print(f"   ✅ Audit log fresh (flush {tool_state['audit'].policy}; env FIXER_AUDIT_FLUSH).\n")
+    print(f"🌊 Streaming {RAW_PATH.name} ➡️ {WORK_PATH.name} in blocks of {STREAM_BLOCK_ROWS} rows ...\n")
+    st = run_streaming()
+    print(f"\n   ✅ Appended {st['rows']} rows in {st['blocks']} block(s) ➡️ {WORK_PATH}\n")
+    print_summary(st["rows"], st["llm_rows"], st["preclean"], st["chunks"], st["tools"])
+    raise SystemExit(0)
+
 print("📥 Copying raw CSV ➡️ working copy ...")
 shutil.copy2(RAW_PATH, WORK_PATH)
 print("   ✅ Copied.\n")
@@ -330,101 +532,58 @@ print("   ✅ Copied.\n")
 print("📊 Reading working CSV (all columns as character) ...")
 tool_state["df"] = pd.read_csv(WORK_PATH, dtype=str, keep_default_na=False)
 df = tool_state["df"]
-print(f"   ✅ Loaded {len(df)} rows × {len(df.columns)} cols.")
+tool_state["row_index"] = build_row_index(df)
+print(f"   ✅ Loaded {len(df)} rows × {len(df.columns)} cols ({len(tool_state['row_index'])} indexed row_ids).")
 print("🔍 Preview:")
 print(df.head(3))
 
 print("🗑️  Resetting audit log ...")
 if LOG_PATH.is_file():
     LOG_PATH.unlink()
-print("   ✅ Audit log fresh.\n")
+tool_state["audit"] = AuditWriter.from_env(LOG_PATH)
+print(f"   ✅ Audit log fresh (flush {tool_state['audit'].policy}; env FIXER_AUDIT_FLUSH).\n")
 
-chunks = split_df_into_row_chunks(tool_state["df"], ROWS_PER_BATCH)
-n_chunks = len(chunks)
-chunk_csv_texts = [c.to_csv(index=False) for c in chunks]
-print(f"✂️  Split into {n_chunks} chunk(s) of up to {ROWS_PER_BATCH} rows.\n")
+# 2. RULE-BASED PRE-CLEANING ###################################
 
-SYSTEM_BATCH = (
-    "You are a **batch** CSV cleaning assistant for a **retail inventory** table (SKU stock counts, restock dates, Electronics vs Food). "
-    "Each user message is one row chunk plus a data dictionary. Fix cells using **set_cell** only (plus optional **write_checkpoint**). "
-    "Prefer **expected_old_value** on each set_cell. "
-    "**qty_on_hand** = positive digits or **empty**; **`0` → empty** (placeholder). Spaced digits: **concatenate in order only** (`2 0`→`20`), **never** invent unrelated numbers (`2 0`≠`150`). "
-    "**last_restock** = keep **valid YYYY-MM-DD** unchanged; blank **only** invalid/junk dates. **category** = Electronics or Food only. "
-    "Never put dates in qty_on_hand or invent numbers when qty is wrong—use **empty string** for missing. "
-    "Never write the text **NaN**, **NA**, or **null** as a cell value—use **empty string** for missing. "
-    "**Cafeteria / grocery / food_service** → category **Food**, not Electronics. "
-    "\"1 2 3\" in qty → **\"123\"** (concatenation), never a date. "
-    "Skip set_cell when new_value would equal the current value. Do not invent row_ids."
-)
+if FIXER_PRECLEAN:
+    print("🧹 Pre-cleaning with deterministic rules (units, spaced digits, sentinels, ISO dates, category aliases) ...")
+n_preclean, llm_rows = preclean_block(tool_state["df"])
+if FIXER_PRECLEAN:
+    print(f"   ✅ {n_preclean} cell(s) fixed by rules; {len(llm_rows)} of {len(df)} row(s) still need the LLM.\n")
 
-tools = fixer_tool_definitions()
+chunks = split_df_into_token_chunks(
+    llm_rows, FIXER_CHUNK_TOKENS, fixed_tokens, ROWS_PER_BATCH, FIXER_CHARS_PER_TOKEN, keep_cols=("row_id",)
+)
+n_chunks = len(chunks)
+chunk_csv_texts = [c.to_csv(index=False) for c in chunks]
+print(f"✂️  Split into {n_chunks} chunk(s) within {FIXER_CHUNK_TOKENS} tokens, ≤ {ROWS_PER_BATCH} rows each:")
+for chunk in chunks:
+    note_shortened(chunk)
+print(f"   {chunk_plan_summary(chunks, chunk_csv_texts, fixed_tokens, FIXER_CHARS_PER_TOKEN)}\n")
 
 # 3. PARALLEL CHUNK API CALLS ###################################
 
 print("-----------------------------------------------------------------")
-print(f"🔄 Step 2 — Ollama /api/chat per chunk (workers = {FIXER_CHUNK_WORKERS})")
+print(f"🔄 Step 2 — Ollama /api/chat per chunk (async, up to {FIXER_CHUNK_WORKERS} in flight)")
 print("-----------------------------------------------------------------\n\n")
 
-chunk_results: list[dict[str, Any]] = []
-
-
-def _run_one(i: int) -> dict[str, Any]:
-    return call_chunk_ollama(
-        chunk_index=i,
-        n_chunks=n_chunks,
-        chunk_csv_text=chunk_csv_texts[i - 1],
-        ollama_host=OLLAMA_HOST,
-        ollama_key=OLLAMA_API_KEY,
-        ollama_model=OLLAMA_MODEL,
-        system_prompt=SYSTEM_BATCH,
-        data_blurb=DATA_QUALITY_BLURB,
-        tools=tools,
-        max_output_tokens=MAX_OUT,
-    )
-
-
-with ThreadPoolExecutor(max_workers=FIXER_CHUNK_WORKERS) as ex:
-    futs = {ex.submit(_run_one, i): i for i in range(1, n_chunks + 1)}
-    tmp: dict[int, dict[str, Any]] = {}
-    for fut in as_completed(futs):
-        cr = fut.result()
-        tmp[cr["chunk_index"]] = cr
-    chunk_results = [tmp[i] for i in range(1, n_chunks + 1)]
-
-for cr in chunk_results:
-    if cr.get("error"):
-        print(f"   ❌ Chunk {cr['chunk_index']} API error: {cr['error']}")
+chunk_futures = [run_chunk(i, n_chunks, chunk_csv_texts[i - 1]) for i in range(1, n_chunks + 1)]
 
 # 4. APPLY TOOL CALLS ON MAIN PROCESS (ORDERED) ###################################
 
-print("\n-----------------------------------------------------------------")
-print("🔧 Step 3 — Execute tool calls on main process (chunk order)")
+print("-----------------------------------------------------------------")
+print("🔧 Step 3 — Execute tool calls on main process (chunk order, as each chunk lands)")
 print("-----------------------------------------------------------------\n\n")
 
 api_round_counter = 0
 n_tools_executed = 0
 
-for cr in chunk_results:
-    ci = cr["chunk_index"]
-    tcalls = cr.get("tool_calls") or []
-    if not tcalls:
-        tail = ""
-        c = cr.get("content") or ""
-        if c:
-            tail = f" (assistant text: {c[:80]}...)"
-        print(f"   ⚠️  Chunk {ci}: no tool calls{tail}")
-        continue
-    print(f"   📦 Chunk {ci}: {len(tcalls)} tool call(s)")
-    for tc in tcalls:
-        if not isinstance(tc, dict):
-            continue
-        api_round_counter += 1
-        tool_state["api_round"] = api_round_counter
-        fn = tc.get("function") or {}
-        name = str(fn.get("name") or "")
-        args = parse_function_arguments(fn.get("arguments"))
-        dispatch_fixer_tool(name, args, api_round_counter)
-        n_tools_executed += 1
+for fut in chunk_futures:
+    cr = fut.result()
+    if cr.get("error"):
+        print(f"   ❌ Chunk {cr['chunk_index']} API error: {cr['error']}")
+    api_round_counter, n = apply_chunk_tool_calls(cr, api_round_counter)
+    n_tools_executed += n
 
 # 5. WRITE FINAL TABLE ###################################
 
@@ -436,18 +595,4 @@ print(f"   ✅ Saved {len(tool_state['df'])} rows ➡️ {WORK_PATH}\n")
 
 # 6. SUMMARY ###################################
 
-n_audit = 0
-if LOG_PATH.is_file():
-    with open(LOG_PATH, encoding="utf-8") as f:
-        n_audit = sum(1 for line in f if line.strip())
-
-print("=================================================================")
-print("📊 Summary")
-print("=================================================================")
-print(f"📦 Chunks (API calls):     {n_chunks}")
-print(f"🔧 Tool calls executed:   {n_tools_executed}")
-print(f"✏️  Audit lines (set_cell): {n_audit}")
-print(f"👷 Chunk workers used:    {FIXER_CHUNK_WORKERS}")
-print(f"💾 Working file:          {WORK_PATH}")
-print(f"📝 Audit log:             {LOG_PATH}")
-print("=================================================================")
+print_summary(len(df), len(llm_rows), n_preclean, n_chunks, n_tools_executed)
@@ -1,13 +1,10 @@
 # fixer_pois.py
-# Batched POI name normalization — one Ollama round per N rows + ThreadPoolExecutor (Ollama tools)
+# Batched POI name normalization — one Ollama round per N rows + async chunk dispatcher (Ollama tools)
 # Tim Fraser
 
 from __future__ import annotations
 
-import json
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
@@ -16,7 +13,21 @@ import matplotlib.pyplot as plt
 import pandas as pd
 from dotenv import load_dotenv
 
-from functions import ollama_chat_once, parse_function_arguments, split_df_into_row_chunks
+from functions import (
+    CHARS_PER_TOKEN,
+    AuditWriter,
+    ChunkDispatcher,
+    RunManifest,
+    chunk_key,
+    chunk_plan_summary,
+    estimate_prompt_tokens,
+    parse_function_arguments,
+    resume_requested,
+    shortened_rows,
+    split_df_into_token_chunks,
+    token_note,
+    utc_stamp,
+)
 
 print()
 print("=================================================================")
@@ -34,6 +45,8 @@ print(f"   📍 FIXER_ROOT: {FIXER_ROOT}")
 POIS_PATH = FIXER_ROOT / "data" / "pois_messy_raw.csv"
 OUT_CSV = FIXER_ROOT / "output" / "pois_enriched.csv"
 AUDIT_PATH = FIXER_ROOT / "output" / "pois_enrich_audit.jsonl"
+MANIFEST_PATH = FIXER_ROOT / "output" / "pois_enrich_manifest.jsonl"
+RESUME = resume_requested()
 OUT_DIR = FIXER_ROOT / "output"
 print(f"   📄 POIs:   {POIS_PATH}")
 print(f"   💾 Output: {OUT_CSV}\n")
@@ -61,10 +74,22 @@ def read_env_digits(name: str, default: int) -> int:
     return default
 
 
+def read_env_float(name: str, default: float) -> float:
+    try:
+        v = float(os.environ.get(name, "").strip())
+    except ValueError:
+        return default
+    return v if v > 0 else default
+
+
 ROWS_PER_BATCH = read_env_digits("ROWS_PER_BATCH", 10)
 FIXER_CHUNK_WORKERS = read_env_digits("FIXER_CHUNK_WORKERS", 1)
+FIXER_CHUNK_TOKENS = read_env_digits("FIXER_CHUNK_TOKENS", 4096)
+FIXER_CHARS_PER_TOKEN = read_env_float("FIXER_CHARS_PER_TOKEN", CHARS_PER_TOKEN)
 print(f"📊 ROWS_PER_BATCH = {ROWS_PER_BATCH}")
-print(f"📊 FIXER_CHUNK_WORKERS = {FIXER_CHUNK_WORKERS}\n")
+print(f"📊 FIXER_CHUNK_WORKERS = {FIXER_CHUNK_WORKERS}")
+print(f"📊 FIXER_CHUNK_TOKENS = {FIXER_CHUNK_TOKENS} prompt tokens per chunk (env FIXER_CHUNK_TOKENS)")
+print(f"📊 FIXER_CHARS_PER_TOKEN = {FIXER_CHARS_PER_TOKEN} (env FIXER_CHARS_PER_TOKEN)\n")
 
 et = os.environ.get("FIXER_MAX_OUTPUT_TOKENS", "").strip()
 MAX_OUT: int | None = int(et) if et.isdigit() else None
@@ -93,12 +118,11 @@ SYSTEM_POIS = (
     "confidence is 1=low 2=medium 3=high. Do not invent poi_id values."
 )
 
-tool_state: dict[str, Any] = {"df": None, "audit_path": str(AUDIT_PATH), "api_round": 0}
+tool_state: dict[str, Any] = {"df": None, "audit_path": str(AUDIT_PATH), "audit": None, "api_round": 0}
 
 
 def append_audit_poi(obj: dict[str, Any]) -> None:
-    with open(tool_state["audit_path"], "a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    tool_state["audit"].write(obj)
 
 
 def run_record_poi_category(args: dict[str, Any], api_round: int) -> str:
@@ -124,7 +148,7 @@ def run_record_poi_category(args: dict[str, Any], api_round: int) -> str:
     df.at[i, "display_name_clean"] = str(args.get("display_name_clean") or "")
     append_audit_poi(
         {
-            "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "ts": utc_stamp(),
             "api_round": int(api_round),
             "tool": "record_poi_category",
             "poi_id": pid,
@@ -169,46 +193,22 @@ def dispatch_poi_tool(name: str, args: dict[str, Any], api_round: int) -> str:
     return f"Unknown tool: {name}"
 
 
-def call_poi_chunk_ollama(
+def poi_chunk_messages(
     chunk_index: int,
     n_chunks: int,
     chunk_csv_text: str,
-    ollama_host: str,
-    ollama_key: str,
-    ollama_model: str,
     system_prompt: str,
     data_blurb: str,
-    tools: list[dict[str, Any]],
-    max_output_tokens: int | None,
-) -> dict[str, Any]:
+) -> list[dict[str, Any]]:
     user_msg = (
         "Task: for each POI in the chunk, call **record_poi_category** once (use **poi_id** from the CSV).\n\n"
         f"{data_blurb}\n\n---\nChunk {chunk_index} of {n_chunks} (EPSG:4326 coordinates).\n\n"
         f"{chunk_csv_text}\n\n---\nEmit one **record_poi_category** per row. Reply with tool calls only (minimal prose)."
     )
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_msg},
     ]
-    try:
-        out = ollama_chat_once(
-            ollama_host,
-            ollama_key,
-            ollama_model,
-            messages,
-            tools=tools,
-            format=None,
-            max_output_tokens=max_output_tokens,
-        )
-    except Exception as e:
-        return {"chunk_index": chunk_index, "tool_calls": [], "error": str(e), "content": ""}
-    msg = out.get("message") or {}
-    return {
-        "chunk_index": chunk_index,
-        "tool_calls": msg.get("tool_calls") or [],
-        "error": None,
-        "content": out.get("content") or "",
-    }
 
 
 # 2. LOAD DATA ###################################
@@ -220,6 +220,11 @@ print("-----------------------------------------------------------------\n")
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 if AUDIT_PATH.is_file():
     AUDIT_PATH.unlink()
+tool_state["audit"] = AuditWriter.from_env(AUDIT_PATH)
+print(f"   📝 Audit log: {AUDIT_PATH.name} (flush {tool_state['audit'].policy})")
+manifest = RunManifest(MANIFEST_PATH, resume=RESUME)
+if RESUME:
+    print(f"   ♻️  Resuming: {len(manifest.entries)} finished chunk(s) in {MANIFEST_PATH.name} will be replayed.")
 
 pois_in = pd.read_csv(POIS_PATH)
 if not all(c in pois_in.columns for c in ("poi_id", "x", "y")):
@@ -235,42 +240,58 @@ tool_state["df"] = pois_tbl
 print(f"   ✅ {len(pois_tbl)} POIs × {len(pois_tbl.columns)} cols.\n")
 
 chunks_in = pois_in[["poi_id", "x", "y", "name_messy"]].copy()
-chunks = split_df_into_row_chunks(chunks_in, ROWS_PER_BATCH)
+poi_tools = poi_tool_definitions()
+# Fixed part of every prompt (system prompt, blurb, tool schemas); rows fill the rest of FIXER_CHUNK_TOKENS.
+fixed_tokens = estimate_prompt_tokens(
+    poi_chunk_messages(1, 1, "", SYSTEM_POIS, POI_DATA_BLURB), poi_tools, FIXER_CHARS_PER_TOKEN
+)
+if fixed_tokens >= FIXER_CHUNK_TOKENS:
+    raise SystemExit(
+        f"FIXER_CHUNK_TOKENS={FIXER_CHUNK_TOKENS} leaves no room for rows: the fixed prompt alone is about "
+        f"{fixed_tokens} tokens. Raise FIXER_CHUNK_TOKENS (e.g. {2 * fixed_tokens})."
+    )
+# Never cut the key or the name the model normalizes.
+chunks = split_df_into_token_chunks(
+    chunks_in,
+    FIXER_CHUNK_TOKENS,
+    fixed_tokens,
+    ROWS_PER_BATCH,
+    FIXER_CHARS_PER_TOKEN,
+    keep_cols=("poi_id", "name_messy"),
+)
 n_chunks = len(chunks)
 chunk_csv_texts = [c.to_csv(index=False) for c in chunks]
-print(f"✂️  Split into {n_chunks} chunk(s) of up to {ROWS_PER_BATCH} rows.\n")
-
-poi_tools = poi_tool_definitions()
+print(f"✂️  Split into {n_chunks} chunk(s) within {FIXER_CHUNK_TOKENS} tokens, ≤ {ROWS_PER_BATCH} rows each:")
+for note in shortened_rows(chunks, "poi_id"):
+    print(f"   ⚠️  poi_id {note} shortened to fit FIXER_CHUNK_TOKENS; the model sees the cut text.")
+print(f"   {chunk_plan_summary(chunks, chunk_csv_texts, fixed_tokens, FIXER_CHARS_PER_TOKEN)}\n")
 
 # 3. PARALLEL CHUNK API ###################################
 
 print("-----------------------------------------------------------------")
-print("🔄 Step 2 — Ollama /api/chat per chunk (ThreadPoolExecutor)")
+print(f"🔄 Step 2 — Ollama /api/chat per chunk (async, up to {FIXER_CHUNK_WORKERS} in flight)")
 print("-----------------------------------------------------------------\n\n")
 
-
-def _run_poi(i: int) -> dict[str, Any]:
-    return call_poi_chunk_ollama(
-        chunk_index=i,
-        n_chunks=n_chunks,
-        chunk_csv_text=chunk_csv_texts[i - 1],
-        ollama_host=OLLAMA_HOST,
-        ollama_key=OLLAMA_API_KEY,
-        ollama_model=OLLAMA_MODEL,
-        system_prompt=SYSTEM_POIS,
-        data_blurb=POI_DATA_BLURB,
-        tools=poi_tools,
-        max_output_tokens=MAX_OUT,
+dispatcher = ChunkDispatcher(
+    OLLAMA_HOST,
+    OLLAMA_API_KEY,
+    OLLAMA_MODEL,
+    tools=poi_tools,
+    max_output_tokens=MAX_OUT,
+    concurrency=FIXER_CHUNK_WORKERS,
+    manifest=manifest,
+    chars_per_token=FIXER_CHARS_PER_TOKEN,
+)
+chunk_futures = [
+    dispatcher.submit(
+        i,
+        poi_chunk_messages(i, n_chunks, chunk_csv_texts[i - 1], SYSTEM_POIS, POI_DATA_BLURB),
+        key=chunk_key(OLLAMA_MODEL, SYSTEM_POIS, POI_DATA_BLURB, poi_tools, chunk_csv_texts[i - 1]),
     )
-
-
-with ThreadPoolExecutor(max_workers=FIXER_CHUNK_WORKERS) as ex:
-    tmp: dict[int, dict[str, Any]] = {}
-    futs = {ex.submit(_run_poi, i): i for i in range(1, n_chunks + 1)}
-    for fut in as_completed(futs):
-        cr = fut.result()
-        tmp[cr["chunk_index"]] = cr
-    chunk_results = [tmp[i] for i in range(1, n_chunks + 1)]
+    for i in range(1, n_chunks + 1)
+]
+# Read in chunk order: each chunk's tool calls run as soon as it lands, while later chunks are in flight.
+chunk_results = (fut.result() for fut in chunk_futures)
 
 # 4. APPLY TOOLS ###################################
 
@@ -299,7 +320,7 @@ for cr in chunk_results:
             if len(jj):
                 df.at[jj[0], "error_flag"] = True
         continue
-    print(f"   📦 Chunk {ci}: {len(tcalls)} tool call(s)")
+    print(f"   📦 Chunk {ci}: {len(tcalls)} tool call(s){token_note(cr)}")
     for tc in tcalls:
         if not isinstance(tc, dict):
             continue
@@ -310,6 +331,7 @@ for cr in chunk_results:
         args = parse_function_arguments(fn.get("arguments"))
         dispatch_poi_tool(name, args, api_round_counter)
         n_tools += 1
+    tool_state["audit"].end_chunk()
 
 nc = df["normalized_category"].astype(str).str.strip()
 df["plot_label"] = nc.where(nc.ne(""), "unknown")
@@ -359,6 +381,9 @@ print(f"   💾 {path_oa}")
 
 # 6. SUMMARY ###################################
 
+dispatcher.close()
+tool_state["audit"].close()
+manifest.close()
 n_audit = 0
 if AUDIT_PATH.is_file():
     with open(AUDIT_PATH, encoding="utf-8") as f:
@@ -368,6 +393,7 @@ n_err = int(df["error_flag"].fillna(False).sum())
 print("\n=================================================================")
 print("📊 Summary (fixer_pois.py)")
 print("=================================================================")
-print(f"📦 Chunks: {n_chunks} | tool calls: {n_tools} | audit lines: {n_audit}")
+print(f"📦 Chunks: {n_chunks} ({manifest.n_resumed} resumed) | tool calls: {n_tools} | audit lines: {n_audit}")
+print(f"🌐 HTTP: {dispatcher.summary()}")
 print(f"⚠️  Rows error_flag TRUE: {n_err} / {len(df)}")
 print("=================================================================")
@@ -4,10 +4,8 @@
 
 from __future__ import annotations
 
-import json
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timezone
+import time
 from pathlib import Path
 from typing import Any
 
@@ -16,7 +14,22 @@ import matplotlib.pyplot as plt
 import pandas as pd
 from dotenv import load_dotenv
 
-from functions import ollama_chat_once, parse_function_arguments, split_df_into_row_chunks
+from functions import (
+    CHARS_PER_TOKEN,
+    AuditWriter,
+    ChunkDispatcher,
+    RunManifest,
+    chunk_key,
+    chunk_plan_summary,
+    estimate_prompt_tokens,
+    parse_function_arguments,
+    resume_requested,
+    shortened_rows,
+    split_df_into_token_chunks,
+    token_note,
+    utc_stamp,
+)
+from spatial_functions import ParcelGeometryCache, PoiIndex, compute_context_metrics
 
 print()
 print("=================================================================")
@@ -37,6 +50,8 @@ PARCELS_PATH = Path(
 POIS_PATH = Path(os.environ.get("FIXER_CONTEXT_POIS", str(FIXER_ROOT / "output" / "pois_enriched.csv")))
 OUT_CSV = FIXER_ROOT / "output" / "parcels_context_enriched.csv"
 AUDIT_PATH = FIXER_ROOT / "output" / "context_routing_audit.jsonl"
+MANIFEST_PATH = FIXER_ROOT / "output" / "context_routing_manifest.jsonl"
+RESUME = resume_requested()
 OUT_DIR = FIXER_ROOT / "output"
 print(f"   📄 Parcels: {PARCELS_PATH}")
 print(f"   📄 POIs:    {POIS_PATH}")
@@ -65,10 +80,24 @@ def read_env_digits(name: str, default: int) -> int:
     return default
 
 
+def read_env_float(name: str, default: float) -> float:
+    try:
+        v = float(os.environ.get(name, "").strip())
+    except ValueError:
+        return default
+    return v if v > 0 else default
+
+
 ROWS_PER_BATCH = read_env_digits("ROWS_PER_BATCH", 10)
 FIXER_CHUNK_WORKERS = read_env_digits("FIXER_CHUNK_WORKERS", 1)
+FIXER_CHUNK_TOKENS = read_env_digits("FIXER_CHUNK_TOKENS", 4096)
+FIXER_CHARS_PER_TOKEN = read_env_float("FIXER_CHARS_PER_TOKEN", CHARS_PER_TOKEN)
+FIXER_CONTEXT_BULK = os.environ.get("FIXER_CONTEXT_BULK", "1").strip() != "0"
 print(f"📊 ROWS_PER_BATCH = {ROWS_PER_BATCH} (env ROWS_PER_BATCH)")
-print(f"📊 FIXER_CHUNK_WORKERS = {FIXER_CHUNK_WORKERS} (env FIXER_CHUNK_WORKERS)\n")
+print(f"📊 FIXER_CHUNK_WORKERS = {FIXER_CHUNK_WORKERS} (env FIXER_CHUNK_WORKERS)")
+print(f"📊 FIXER_CHUNK_TOKENS = {FIXER_CHUNK_TOKENS} prompt tokens per chunk (env FIXER_CHUNK_TOKENS)")
+print(f"📊 FIXER_CHARS_PER_TOKEN = {FIXER_CHARS_PER_TOKEN} (env FIXER_CHARS_PER_TOKEN)")
+print(f"📊 FIXER_CONTEXT_BULK = {int(FIXER_CONTEXT_BULK)} (env FIXER_CONTEXT_BULK)\n")
 
 et = os.environ.get("FIXER_MAX_OUTPUT_TOKENS", "").strip()
 MAX_OUT: int | None = int(et) if et.isdigit() else None
@@ -141,6 +170,11 @@ print("-----------------------------------------------------------------\n")
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 if AUDIT_PATH.is_file():
     AUDIT_PATH.unlink()
+audit_writer = AuditWriter.from_env(AUDIT_PATH)
+print(f"   📝 Audit log: {AUDIT_PATH.name} (flush {audit_writer.policy})")
+manifest = RunManifest(MANIFEST_PATH, resume=RESUME)
+if RESUME:
+    print(f"   ♻️  Resuming: {len(manifest.entries)} finished chunk(s) in {MANIFEST_PATH.name} will be replayed.")
 
 parcels_tbl = pd.read_csv(PARCELS_PATH)
 pois_tbl = pd.read_csv(POIS_PATH)
@@ -183,6 +217,7 @@ parcels_sf = gpd.GeoDataFrame(
     crs=WGS84_CRS,
 )
 parcels_sf_m = parcels_sf.to_crs(METER_CRS)
+parcel_cache = ParcelGeometryCache(parcels_sf_m)
 
 pois_sf = gpd.GeoDataFrame(
     pois_tbl,
@@ -190,23 +225,38 @@ pois_sf = gpd.GeoDataFrame(
     crs=WGS84_CRS,
 )
 pois_sf_m = pois_sf.to_crs(METER_CRS)
+poi_index = PoiIndex(pois_sf_m.geometry, pois_sf_m["normalized_category"], pois_sf_m["poi_id"])
 
 print(f"   ✅ Parcels: {len(parcels_tbl)} | POIs: {len(pois_tbl)}")
-print(f"   🗺️  Ops CRS: EPSG:{METER_CRS} (buffers / distances in meters)\n")
+print(f"   🗺️  Ops CRS: EPSG:{METER_CRS} (buffers / distances in meters)")
+print(f"   🌲 POI index: one STRtree per category ({len(poi_index)} categories)")
+
+ctx_metrics: pd.DataFrame | None = None
+if FIXER_CONTEXT_BULK:
+    t0 = time.perf_counter()
+    ctx_metrics = compute_context_metrics(parcels_sf_m, pois_sf_m, POI_CATEGORIES, buffers=(400, 800))
+    print(
+        f"   ⚡ Bulk metrics: {ctx_metrics.shape[1]} columns × {len(ctx_metrics)} parcels "
+        f"in {time.perf_counter() - t0:.2f}s (tool calls read from this table)"
+    )
+print()
 
 tool_state: dict[str, Any] = {
     "df": parcels_tbl,
     "parcels_sf_m": parcels_sf_m,
+    "parcels": parcel_cache,
     "pois_sf_m": pois_sf_m,
+    "poi_index": poi_index,
+    "ctx_metrics": ctx_metrics,
     "pois_tbl": pois_tbl,
     "audit_path": str(AUDIT_PATH),
+    "audit": audit_writer,
     "api_round": 0,
 }
 
 
 def append_ctx_audit(obj: dict[str, Any]) -> None:
-    with open(tool_state["audit_path"], "a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    tool_state["audit"].write(obj)
 
 
 def nearest_col_names(poi_category: str) -> tuple[str, str] | None:
@@ -222,6 +272,22 @@ def count_col_name(poi_category: str, buffer_m: int) -> str:
     return f"ctx_n_{poi_category}_{buffer_m}"
 
 
+def lookup_nearest(pos: int, catg: str) -> tuple[Any, float] | None:
+    """(poi_id, distance_m) for the parcel at row `pos`: a cell from the bulk table, else an index query."""
+    metrics = tool_state["ctx_metrics"]
+    if metrics is None:
+        return tool_state["poi_index"].nearest(catg, tool_state["parcels"].centroids[pos])
+    d = metrics[f"ctx_nearest_{catg}_m"].iat[pos]
+    return None if pd.isna(d) else (metrics[f"ctx_nearest_{catg}_poi_id"].iat[pos], float(d))
+
+
+def lookup_count(pos: int, catg: str, buf: int) -> int:
+    metrics = tool_state["ctx_metrics"]
+    if metrics is None:
+        return tool_state["poi_index"].count_within(catg, tool_state["parcels"].buffer(pos, float(buf)))
+    return int(metrics[count_col_name(catg, buf)].iat[pos])
+
+
 def run_nearest_poi(args: dict[str, Any], api_round: int) -> str:
     args = args or {}
     pid = str(args.get("parcel_id") or "").strip()
@@ -242,26 +308,19 @@ def run_nearest_poi(args: dict[str, Any], api_round: int) -> str:
         max_m = 5000.0
 
     df = tool_state["df"]
-    j = df.index[df["parcel_id"].astype(str) == pid]
-    if len(j) == 0:
+    ji = tool_state["parcels"].label(pid)
+    if ji is None:
         return f"Error: unknown parcel_id={pid}"
-    ji = j[0]
-
-    psf = tool_state["parcels_sf_m"]
-    p_geom = psf.loc[psf["parcel_id"].astype(str) == pid]
-    if len(p_geom) != 1:
+    pos = tool_state["parcels"].geometry_position(pid)
+    if pos is None:
         return "Error: parcel geometry not found."
-    parcel_row_geom = p_geom.geometry.iloc[0]
-    ctr = parcel_row_geom.centroid
-
-    pt = tool_state["pois_sf_m"]
-    pt = pt[pt["normalized_category"].astype(str) == catg]
-    if len(pt) < 1:
+    hit = lookup_nearest(pos, catg)
+    if hit is None:
         df.at[ji, cols[0]] = float("nan")
         df.at[ji, cols[1]] = pd.NA
         append_ctx_audit(
             {
-                "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "ts": utc_stamp(),
                 "api_round": int(api_round),
                 "tool": "nearest_poi",
                 "parcel_id": pid,
@@ -271,15 +330,13 @@ def run_nearest_poi(args: dict[str, Any], api_round: int) -> str:
         )
         return f"OK: no {catg} POIs; stored NA."
 
-    dists = pt.geometry.distance(ctr)
-    imin_idx = dists.idxmin()
-    best_d = float(dists.min())
+    best_poi, best_d = hit
     if best_d > max_m:
         df.at[ji, cols[0]] = float("nan")
         df.at[ji, cols[1]] = pd.NA
         append_ctx_audit(
             {
-                "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "ts": utc_stamp(),
                 "api_round": int(api_round),
                 "tool": "nearest_poi",
                 "parcel_id": pid,
@@ -290,12 +347,12 @@ def run_nearest_poi(args: dict[str, Any], api_round: int) -> str:
         )
         return "OK: nearest beyond max_search_m; stored NA."
 
-    best_id = int(pt.loc[imin_idx, "poi_id"])
+    best_id = int(best_poi)
     df.at[ji, cols[0]] = best_d
     df.at[ji, cols[1]] = best_id
     append_ctx_audit(
         {
-            "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "ts": utc_stamp(),
             "api_round": int(api_round),
             "tool": "nearest_poi",
             "parcel_id": pid,
@@ -326,25 +383,17 @@ def run_count_pois_within(args: dict[str, Any], api_round: int) -> str:
         return f"Error: no output column for {catg} {buf}m."
 
     df = tool_state["df"]
-    j = df.index[df["parcel_id"].astype(str) == pid]
-    if len(j) == 0:
+    ji = tool_state["parcels"].label(pid)
+    if ji is None:
         return f"Error: unknown parcel_id={pid}"
-    ji = j[0]
-
-    psf = tool_state["parcels_sf_m"]
-    p_geom = psf.loc[psf["parcel_id"].astype(str) == pid]
-    if len(p_geom) != 1:
+    pos = tool_state["parcels"].geometry_position(pid)
+    if pos is None:
         return "Error: parcel geometry not found."
-    parcel_row_geom = p_geom.geometry.iloc[0]
-    buf_geom = parcel_row_geom.buffer(float(buf))
-
-    pt = tool_state["pois_sf_m"]
-    pt = pt[pt["normalized_category"].astype(str) == catg]
-    if len(pt) < 1:
+    if catg not in tool_state["poi_index"]:
         df.at[ji, coln] = 0
         append_ctx_audit(
             {
-                "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "ts": utc_stamp(),
                 "api_round": int(api_round),
                 "tool": "count_pois_within",
                 "parcel_id": pid,
@@ -355,11 +404,11 @@ def run_count_pois_within(args: dict[str, Any], api_round: int) -> str:
         )
         return "OK: count=0 (no POIs of category)."
 
-    n_hit = int(pt.geometry.intersects(buf_geom).sum())
+    n_hit = lookup_count(pos, catg, buf)
     df.at[ji, coln] = n_hit
     append_ctx_audit(
         {
-            "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "ts": utc_stamp(),
             "api_round": int(api_round),
             "tool": "count_pois_within",
             "parcel_id": pid,
@@ -380,14 +429,13 @@ def run_record_context_note(args: dict[str, Any], api_round: int) -> str:
     if len(note) > 180:
         note = note[:180]
     df = tool_state["df"]
-    j = df.index[df["parcel_id"].astype(str) == pid]
-    if len(j) == 0:
+    ji = tool_state["parcels"].label(pid)
+    if ji is None:
         return f"Error: unknown parcel_id={pid}"
-    ji = j[0]
     df.at[ji, "ctx_context_note"] = note
     append_ctx_audit(
         {
-            "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "ts": utc_stamp(),
             "api_round": int(api_round),
             "tool": "record_context_note",
             "parcel_id": pid,
@@ -472,47 +520,23 @@ def dispatch_context_tool(name: str, args: dict[str, Any], api_round: int) -> st
     return f"Unknown tool: {name}"
 
 
-def call_context_chunk_ollama(
+def context_chunk_messages(
     chunk_index: int,
     n_chunks: int,
     chunk_csv_text: str,
-    ollama_host: str,
-    ollama_key: str,
-    ollama_model: str,
     system_prompt: str,
     data_blurb: str,
-    tools: list[dict[str, Any]],
-    max_output_tokens: int | None,
-) -> dict[str, Any]:
+) -> list[dict[str, Any]]:
     user_msg = (
         "Apply **contextual routing** for every parcel in this chunk.\n\n"
         f"{data_blurb}\n\n---\nChunk {chunk_index} of {n_chunks}:\n\n"
         f"{chunk_csv_text}\n\n---\nCall tools for each parcel as the rules dictate. "
         "Then optionally **record_context_note** per parcel. Tool calls only (minimal prose)."
     )
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_msg},
     ]
-    try:
-        out = ollama_chat_once(
-            ollama_host,
-            ollama_key,
-            ollama_model,
-            messages,
-            tools=tools,
-            format=None,
-            max_output_tokens=max_output_tokens,
-        )
-    except Exception as e:
-        return {"chunk_index": chunk_index, "tool_calls": [], "error": str(e), "content": ""}
-    msg = out.get("message") or {}
-    return {
-        "chunk_index": chunk_index,
-        "tool_calls": msg.get("tool_calls") or [],
-        "error": None,
-        "content": out.get("content") or "",
-    }
 
 
 # 3. CHUNK PARCELS FOR LLM ###################################
@@ -522,42 +546,58 @@ for c in ("zone_code", "primary_land_use", "allows_commercial", "allows_resident
     if c in parcels_tbl.columns:
         cols_chunk.append(c)
 chunks_in = parcels_tbl[cols_chunk].copy()
-chunks = split_df_into_row_chunks(chunks_in, ROWS_PER_BATCH)
+ctx_tools = context_tool_definitions()
+# Fixed part of every prompt (system prompt, blurb, tool schemas); rows fill the rest of FIXER_CHUNK_TOKENS.
+fixed_tokens = estimate_prompt_tokens(
+    context_chunk_messages(1, 1, "", SYSTEM_CONTEXT, ROUTING_BLURB), ctx_tools, FIXER_CHARS_PER_TOKEN
+)
+if fixed_tokens >= FIXER_CHUNK_TOKENS:
+    raise SystemExit(
+        f"FIXER_CHUNK_TOKENS={FIXER_CHUNK_TOKENS} leaves no room for rows: the fixed prompt alone is about "
+        f"{fixed_tokens} tokens. Raise FIXER_CHUNK_TOKENS (e.g. {2 * fixed_tokens})."
+    )
+# Never cut the key or the columns the model routes on.
+chunks = split_df_into_token_chunks(
+    chunks_in,
+    FIXER_CHUNK_TOKENS,
+    fixed_tokens,
+    ROWS_PER_BATCH,
+    FIXER_CHARS_PER_TOKEN,
+    keep_cols=("parcel_id", "zone_code", "primary_land_use"),
+)
 n_chunks = len(chunks)
 chunk_csv_texts = [c.to_csv(index=False) for c in chunks]
-print(f"✂️  Split into {n_chunks} chunk(s) of up to {ROWS_PER_BATCH} rows.\n")
-
-ctx_tools = context_tool_definitions()
+print(f"✂️  Split into {n_chunks} chunk(s) within {FIXER_CHUNK_TOKENS} tokens, ≤ {ROWS_PER_BATCH} rows each:")
+for note in shortened_rows(chunks, "parcel_id"):
+    print(f"   ⚠️  parcel_id {note} shortened to fit FIXER_CHUNK_TOKENS; the model sees the cut text.")
+print(f"   {chunk_plan_summary(chunks, chunk_csv_texts, fixed_tokens, FIXER_CHARS_PER_TOKEN)}\n")
 
 # 4. PARALLEL CHUNK API CALLS ###################################
 
 print("-----------------------------------------------------------------")
-print("🔄 Step 2 — Ollama /api/chat per chunk (ThreadPoolExecutor)")
+print(f"🔄 Step 2 — Ollama /api/chat per chunk (async, up to {FIXER_CHUNK_WORKERS} in flight)")
 print("-----------------------------------------------------------------\n\n")
 
-
-def _run_ctx(i: int) -> dict[str, Any]:
-    return call_context_chunk_ollama(
-        chunk_index=i,
-        n_chunks=n_chunks,
-        chunk_csv_text=chunk_csv_texts[i - 1],
-        ollama_host=OLLAMA_HOST,
-        ollama_key=OLLAMA_API_KEY,
-        ollama_model=OLLAMA_MODEL,
-        system_prompt=SYSTEM_CONTEXT,
-        data_blurb=ROUTING_BLURB,
-        tools=ctx_tools,
-        max_output_tokens=MAX_OUT,
+dispatcher = ChunkDispatcher(
+    OLLAMA_HOST,
+    OLLAMA_API_KEY,
+    OLLAMA_MODEL,
+    tools=ctx_tools,
+    max_output_tokens=MAX_OUT,
+    concurrency=FIXER_CHUNK_WORKERS,
+    manifest=manifest,
+    chars_per_token=FIXER_CHARS_PER_TOKEN,
+)
+chunk_futures = [
+    dispatcher.submit(
+        i,
+        context_chunk_messages(i, n_chunks, chunk_csv_texts[i - 1], SYSTEM_CONTEXT, ROUTING_BLURB),
+        key=chunk_key(OLLAMA_MODEL, SYSTEM_CONTEXT, ROUTING_BLURB, ctx_tools, chunk_csv_texts[i - 1]),
     )
-
-
-with ThreadPoolExecutor(max_workers=FIXER_CHUNK_WORKERS) as ex:
-    tmp: dict[int, dict[str, Any]] = {}
-    futs = {ex.submit(_run_ctx, i): i for i in range(1, n_chunks + 1)}
-    for fut in as_completed(futs):
-        cr = fut.result()
-        tmp[cr["chunk_index"]] = cr
-    chunk_results = [tmp[i] for i in range(1, n_chunks + 1)]
+    for i in range(1, n_chunks + 1)
+]
+# Read in chunk order: each chunk's tool calls run as soon as it lands, while later chunks are in flight.
+chunk_results = (fut.result() for fut in chunk_futures)
 
 # 5. APPLY TOOL CALLS ON MAIN PROCESS (CHUNK ORDER) ###################################
 
@@ -574,19 +614,19 @@ for cr in chunk_results:
     if cr.get("error"):
         print(f"   ❌ Chunk {ci}: {cr['error']}")
         for pid in chunks[ci - 1]["parcel_id"].astype(str):
-            jj = df.index[df["parcel_id"].astype(str) == pid]
-            if len(jj):
-                df.at[jj[0], "error_flag"] = True
+            jj = parcel_cache.label(pid)
+            if jj is not None:
+                df.at[jj, "error_flag"] = True
         continue
     tcalls = cr.get("tool_calls") or []
     if not tcalls:
         print(f"   ⚠️  Chunk {ci}: no tool calls")
         for pid in chunks[ci - 1]["parcel_id"].astype(str):
-            jj = df.index[df["parcel_id"].astype(str) == pid]
-            if len(jj):
-                df.at[jj[0], "error_flag"] = True
+            jj = parcel_cache.label(pid)
+            if jj is not None:
+                df.at[jj, "error_flag"] = True
         continue
-    print(f"   📦 Chunk {ci}: {len(tcalls)} tool call(s)")
+    print(f"   📦 Chunk {ci}: {len(tcalls)} tool call(s){token_note(cr)}")
     for tc in tcalls:
         if not isinstance(tc, dict):
             continue
@@ -597,6 +637,7 @@ for cr in chunk_results:
         args = parse_function_arguments(fn.get("arguments"))
         dispatch_context_tool(name, args, api_round_counter)
         n_tools += 1
+    tool_state["audit"].end_chunk()
 
 parcels_out = tool_state["df"]
 parcels_out.to_csv(OUT_CSV, index=False, na_rep="")
@@ -639,6 +680,9 @@ print(f"   💾 {path_ctx}\n")
 
 # 7. CONSOLE SUMMARY ###################################
 
+dispatcher.close()
+tool_state["audit"].close()
+manifest.close()
 n_audit = 0
 if AUDIT_PATH.is_file():
     with open(AUDIT_PATH, encoding="utf-8") as f:
@@ -648,6 +692,7 @@ n_err = int(parcels_out["error_flag"].fillna(False).sum())
 print("\n=================================================================")
 print("📊 Summary (fixer_spatial_context.py)")
 print("=================================================================")
-print(f"📦 Chunks: {n_chunks} | tool calls: {n_tools} | audit lines: {n_audit}")
+print(f"📦 Chunks: {n_chunks} ({manifest.n_resumed} resumed) | tool calls: {n_tools} | audit lines: {n_audit}")
+print(f"🌐 HTTP: {dispatcher.summary()}")
 print(f"⚠️  Rows error_flag TRUE: {n_err} / {len(parcels_out)}")
 print("=================================================================")
@@ -5,12 +5,22 @@
 
 from __future__ import annotations
 
+import asyncio
+import atexit
+import hashlib
 import json
+import math
 import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any
 
 import httpx
+import numpy as np
 import pandas as pd
 
 
@@ -48,6 +58,538 @@ def split_df_into_row_chunks(df: pd.DataFrame, n_rows: int) -> list[pd.DataFrame
     return out
 
 
+# Prompt-size heuristic: characters per token. Calibrate with the predicted vs actual prompt_eval_count
+# that ChunkDispatcher.summary() reports (CSV digits and punctuation run denser than prose).
+CHARS_PER_TOKEN = 3.5
+
+
+def estimate_tokens(text: str, chars_per_token: float = CHARS_PER_TOKEN) -> int:
+    return math.ceil(len(text) / chars_per_token) if text else 0
+
+
+def estimate_prompt_tokens(
+    messages: list[dict[str, Any]],
+    tools: list[dict[str, Any]] | None = None,
+    chars_per_token: float = CHARS_PER_TOKEN,
+) -> int:
+    """Predicted prompt_eval_count: message contents + a few framing tokens each + the tool schemas."""
+    n = sum(estimate_tokens(str(m.get("content") or ""), chars_per_token) + 4 for m in messages)
+    if tools:
+        n += estimate_tokens(json.dumps(tools, ensure_ascii=False), chars_per_token)
+    return n
+
+
+def csv_row_chars(df: pd.DataFrame) -> np.ndarray:
+    """Length of each row's line in df.to_csv(index=False) (minimal quoting), computed per column."""
+    n = np.full(len(df), max(1, len(df.columns)), dtype=np.int64)  # commas + newline
+    for col in df.columns:
+        s = df[col]
+        t = s.astype(str).where(s.notna(), "")
+        n += t.str.len().to_numpy(dtype=np.int64)
+        n += 2 * t.str.contains(r'[",\n\r]', regex=True).to_numpy(dtype=np.int64)
+        n += t.str.count('"').to_numpy(dtype=np.int64)
+    return n
+
+
+def _shorten_row(chunk: pd.DataFrame, avail_chars: float, keep_cols: tuple[str, ...] = ()) -> pd.DataFrame:
+    """
+    Cap the cells of a one-row chunk outside keep_cols so the row fits avail_chars; marks each cut with
+    its length and lists the cut columns in chunk.attrs["shortened"].
+    """
+    texts = {col: "" if pd.isna(v) else str(v) for col, v in chunk.iloc[0].items()}
+    cut_cols = [col for col in chunk.columns if col not in keep_cols]
+    kept = sum(len(texts[col]) for col in chunk.columns if col in keep_cols)
+    cap = max(32, int((avail_chars - kept) // max(1, len(cut_cols))))
+    shortened = []
+    for col in cut_cols:
+        t = texts[col]
+        if len(t) > cap:
+            chunk[col] = chunk[col].astype(object)
+            chunk.iloc[0, chunk.columns.get_loc(col)] = f"{t[:cap]}…[+{len(t) - cap} chars]"
+            shortened.append(col)
+    if shortened:
+        chunk.attrs["shortened"] = shortened
+    return chunk
+
+
+def split_df_into_token_chunks(
+    df: pd.DataFrame,
+    budget_tokens: int,
+    fixed_tokens: int = 0,
+    max_rows: int | None = None,
+    chars_per_token: float = CHARS_PER_TOKEN,
+    keep_cols: tuple[str, ...] = (),
+) -> list[pd.DataFrame]:
+    """
+    Pack consecutive rows into chunks whose predicted prompt — fixed_tokens (system prompt, blurb, tool
+    schemas) + CSV header + rows — stays within budget_tokens, with at most max_rows rows per chunk.
+    A row too large on its own becomes a one-row chunk with its long cells outside keep_cols cut in that
+    copy (marked "…[+N chars]"; see `shortened_rows`). The source table is untouched, but the model only
+    sees the cut text: keep ids and the columns it must interpret in keep_cols (such a row may then run
+    over budget).
+    """
+    nr = len(df)
+    if nr == 0:
+        return []
+    cap = nr if not max_rows or int(max_rows) < 1 else int(max_rows)
+    header_chars = len(",".join(map(str, df.columns))) + 1
+    avail = max(0.0, (budget_tokens - fixed_tokens) * chars_per_token - header_chars)
+    cum = np.cumsum(csv_row_chars(df))
+    out: list[pd.DataFrame] = []
+    s = 0
+    while s < nr:
+        base = int(cum[s - 1]) if s else 0
+        e = int(np.searchsorted(cum, base + avail, side="right"))
+        e = min(max(e, s + 1), s + cap, nr)
+        chunk = df.iloc[s:e].copy()
+        if e == s + 1 and cum[s] - base > avail:
+            chunk = _shorten_row(chunk, avail, tuple(keep_cols))
+        out.append(chunk)
+        s = e
+    return out
+
+
+def chunk_plan_summary(
+    chunks: list[pd.DataFrame],
+    chunk_csv_texts: list[str],
+    fixed_tokens: int,
+    chars_per_token: float = CHARS_PER_TOKEN,
+) -> str:
+    """One log line: rows per chunk and predicted prompt tokens per chunk (min–max)."""
+    if not chunks:
+        return "no chunks"
+    rows = [len(c) for c in chunks]
+    toks = [fixed_tokens + estimate_tokens(t, chars_per_token) for t in chunk_csv_texts]
+    return (
+        f"rows/chunk {min(rows)}–{max(rows)} (mean {sum(rows) / len(rows):.1f}), "
+        f"predicted prompt tokens {min(toks)}–{max(toks)} (fixed part {fixed_tokens})"
+    )
+
+
+def shortened_rows(chunks: list[pd.DataFrame], id_col: str) -> list[str]:
+    """'<id> (<cut columns>)' for each row split_df_into_token_chunks shortened to fit the budget."""
+    return [f"{c[id_col].iloc[0]} ({', '.join(c.attrs['shortened'])})" for c in chunks if c.attrs.get("shortened")]
+
+
+def token_note(cr: dict[str, Any]) -> str:
+    """' [prompt tokens: N predicted / M actual]' for a dispatcher result, '' for replayed chunks."""
+    if cr.get("predicted_tokens") is None:
+        return ""
+    actual = cr.get("prompt_tokens")
+    return f" [prompt tokens: {cr['predicted_tokens']} predicted / {actual if actual is not None else '?'} actual]"
+
+
+def build_row_index(df: pd.DataFrame, key: str = "row_id") -> dict[int, int]:
+    """
+    Map integer-like key values to their row position (first occurrence wins, like a mask scan + idx[0]).
+    Build once after loading; valid as long as rows are not inserted, dropped, or reordered and `key` is not edited.
+    """
+    rids = pd.to_numeric(df[key], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    ok = np.isfinite(rids) & (rids == np.floor(rids))
+    pos = np.flatnonzero(ok)
+    keys = rids[ok].astype(np.int64)
+    _, first = np.unique(keys, return_index=True)
+    return dict(zip(keys[first].tolist(), pos[first].tolist()))
+
+
+def _cell_text(v: Any) -> str:
+    return "" if pd.isna(v) else str(v)
+
+
+def apply_set_cell_batch(
+    df: pd.DataFrame,
+    calls: list[dict[str, Any]],
+    row_index: dict[int, int],
+    protected: tuple[str, ...] = ("row_id",),
+) -> tuple[list[str], list[tuple[int, dict[str, Any]]]]:
+    """
+    Apply a list of set_cell argument dicts to df in place, in call order semantics.
+
+    Calls are validated one by one (same messages as a single set_cell), row_ids are resolved through
+    `row_index`, then expected_old_value checks and writes run vectorized: one comparison and one
+    assignment per column. A cell touched twice in the batch is handled in a later pass, so the second
+    call sees the first call's value. Returns (one result string per call, applied edits in call order
+    as (call index, {"row_id", "column", "old_value", "new_value"})).
+    """
+    results: list[str] = [""] * len(calls)
+    # (call index, position, column, new value, expected old value or None) per valid call, split into passes
+    passes: list[list[tuple[int, int, str, str, str | None]]] = []
+    seen: dict[tuple[int, str], int] = {}
+    rids: dict[int, int] = {}
+    for k, args in enumerate(calls):
+        args = args or {}
+        rid = args.get("row_id")
+        col = str(args.get("column_name") or "")
+        nv = str(args.get("new_value") or "")
+        ev = args.get("expected_old_value")
+        if rid is None:
+            results[k] = "Error: row_id required."
+            continue
+        try:
+            rid = int(rid)
+        except (TypeError, ValueError):
+            results[k] = "Error: row_id must be integer-like."
+            continue
+        if not col:
+            results[k] = "Error: column_name required."
+            continue
+        if col in protected:
+            results[k] = f"Error: {col} column cannot be edited."
+            continue
+        if col not in df.columns:
+            results[k] = f"Error: unknown column {col}"
+            continue
+        pos = row_index.get(rid)
+        if pos is None:
+            results[k] = f"Error: no row with row_id={rid}"
+            continue
+        rids[k] = rid
+        n = seen.get((pos, col), 0)
+        seen[(pos, col)] = n + 1
+        if n == len(passes):
+            passes.append([])
+        passes[n].append((k, pos, col, nv, None if ev is None else _cell_text(ev)))
+
+    applied: dict[int, dict[str, Any]] = {}
+    for edits in passes:
+        by_col: dict[str, list[tuple[int, int, str, str | None]]] = {}
+        for k, pos, col, nv, evs in edits:
+            by_col.setdefault(col, []).append((k, pos, nv, evs))
+        for col, items in by_col.items():
+            ks = [k for k, _, _, _ in items]
+            positions = np.fromiter((p for _, p, _, _ in items), dtype=np.int64, count=len(items))
+            new = [nv for _, _, nv, _ in items]
+            ci = df.columns.get_loc(col)
+            old = [_cell_text(v) for v in df.iloc[positions, ci].tolist()]
+            old_arr = np.asarray(old, dtype=object)
+            exp_arr = np.asarray([evs for _, _, _, evs in items], dtype=object)
+            has_exp = np.fromiter((e is not None for e in exp_arr), dtype=bool, count=len(items))
+            ok = ~has_exp | (old_arr == exp_arr)
+            if ok.any():
+                df.iloc[positions[ok], ci] = np.asarray(new, dtype=object)[ok]
+            for j, k in enumerate(ks):
+                rid = rids[k]
+                if ok[j]:
+                    results[k] = f"OK: row_id={rid} {col} updated."
+                    applied[k] = {"row_id": rid, "column": col, "old_value": old[j], "new_value": new[j]}
+                else:
+                    results[k] = (
+                        f"Skipped: expected_old_value mismatch for row_id={rid} col={col} "
+                        f'(current="{old[j]}" expected="{exp_arr[j]}")'
+                    )
+    return results, sorted(applied.items())
+
+
+# Inventory pre-cleaning rules (fixer_csv.py) — the mechanical parts of DATA_QUALITY_BLURB, vectorized.
+# Cells a rule cannot settle are left as-is and their rows are marked for the LLM.
+
+QTY_MISSING_TOKENS = frozenset({"n/a", "na", "nan", "null", "none", "unknown", "missing", "-", "?"})
+QTY_NUMBER_WORDS = {
+    "one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6", "seven": "7",
+    "eight": "8", "nine": "9", "ten": "10", "eleven": "11", "twelve": "12",
+}
+_QTY_UNITS_RE = r"^(\d+)\s*(?:units?|pcs?|pieces?|ea|each|ct|count)\.?$"
+_QTY_SPACED_RE = r"^\d+(?:\s+\d+)+$"
+_DATE_LIKE_RE = r"^(?:\d{4}[-/.]\d{1,2}[-/.]\d{1,2}|\d{1,2}[-/.]\d{1,2}[-/.]\d{2,4})$"
+_FOOD_RE = r"food|grocer|cafeter|caf[eé]|kitchen|meal|dining|restaurant|deli|bakery"
+_ELECTRONICS_RE = r"elec|electronics?"
+
+
+def _text(s: pd.Series) -> pd.Series:
+    return s.fillna("").astype(str).str.strip()
+
+
+def preclean_qty(s: pd.Series) -> tuple[pd.Series, pd.Series, pd.Series]:
+    """qty_on_hand → (new value, rule name or "", needs LLM). Positive digits or empty; 0 / sentinels → empty."""
+    t = _text(s)
+    low = t.str.lower()
+    digits = pd.Series(np.nan, index=t.index, dtype=object)
+    rule = pd.Series("", index=t.index, dtype=object)
+
+    def take(mask: pd.Series, values: pd.Series | str, name: str) -> None:
+        m = mask & digits.isna()
+        digits[m] = values[m] if isinstance(values, pd.Series) else values
+        rule[m] = name
+
+    take(t.eq(""), "", "")
+    take(low.isin(QTY_MISSING_TOKENS), "", "missing_token")
+    take(t.str.fullmatch(r"\d+"), t, "")
+    take(t.str.fullmatch(r"-\d+"), "", "negative_or_sentinel")
+    take(low.str.fullmatch(_QTY_UNITS_RE), low.str.extract(_QTY_UNITS_RE, expand=False), "strip_units")
+    take(t.str.fullmatch(_QTY_SPACED_RE), t.str.replace(r"\s+", "", regex=True), "join_spaced_digits")
+    take(low.isin(QTY_NUMBER_WORDS.keys()), low.map(QTY_NUMBER_WORDS), "number_word")
+    take(t.str.fullmatch(_DATE_LIKE_RE), "", "date_in_qty")
+
+    resolved = digits.notna()
+    out = digits.where(resolved, t).astype(str)
+    num = out.str.lstrip("0")
+    zero = resolved & out.str.fullmatch(r"0+")
+    out = out.mask(zero, "").mask(resolved & ~zero & out.ne(""), num)
+    rule = rule.mask(zero & rule.eq(""), "zero_placeholder")
+    return out, rule, ~resolved
+
+
+def preclean_restock(s: pd.Series) -> tuple[pd.Series, pd.Series, pd.Series]:
+    """last_restock → keep plausible YYYY-MM-DD, empty anything else (never needs the LLM)."""
+    t = _text(s)
+    iso = t.str.fullmatch(r"\d{4}-\d{2}-\d{2}")
+    valid = iso & pd.to_datetime(t.where(iso), format="%Y-%m-%d", errors="coerce").notna()
+    out = t.where(valid | t.eq(""), "")
+    rule = pd.Series("", index=t.index, dtype=object).mask(~valid & t.ne(""), "invalid_date")
+    return out, rule, pd.Series(False, index=t.index)
+
+
+def preclean_category(s: pd.Series) -> tuple[pd.Series, pd.Series, pd.Series]:
+    """category → Electronics / Food for known aliases (trimmed); Retail, blanks and unknown labels need the LLM."""
+    t = _text(s)
+    low = t.str.lower().str.replace(r"[\s\-]+", "_", regex=True)
+    elec = low.str.fullmatch(_ELECTRONICS_RE)
+    food = ~elec & low.str.contains(_FOOD_RE, regex=True)
+    out = t.mask(elec, "Electronics").mask(food, "Food")
+    rule = pd.Series("", index=t.index, dtype=object).mask((elec | food) & out.ne(t), "category_alias")
+    rule = rule.mask(rule.eq("") & t.ne(s.fillna("").astype(str)), "trim")
+    return out, rule, ~(elec | food)
+
+
+INVENTORY_RULES = {
+    "qty_on_hand": preclean_qty,
+    "last_restock": preclean_restock,
+    "category": preclean_category,
+}
+
+
+def preclean_inventory(df: pd.DataFrame, rules: dict[str, Any] | None = None) -> tuple[list[dict[str, Any]], pd.Series]:
+    """
+    Apply INVENTORY_RULES to df in place (columns that exist). Returns (changed cells in row order as
+    {"row_id", "column", "old_value", "new_value", "rule"}, boolean mask of rows the LLM still has to see).
+    """
+    rules = INVENTORY_RULES if rules is None else rules
+    needs_llm = pd.Series(False, index=df.index)
+    parts: list[pd.DataFrame] = []
+    for ci, (col, fn) in enumerate(rules.items()):
+        if col not in df.columns:
+            continue
+        old = df[col].fillna("").astype(str)
+        new, rule, ambiguous = fn(df[col])
+        needs_llm |= ambiguous
+        changed = new.ne(old).to_numpy()
+        if not changed.any():
+            continue
+        df[col] = new.where(changed, df[col])
+        parts.append(
+            pd.DataFrame(
+                {
+                    "pos": np.flatnonzero(changed),
+                    "ci": ci,
+                    "column": col,
+                    "old_value": old.to_numpy()[changed],
+                    "new_value": new.to_numpy()[changed],
+                    "rule": rule.to_numpy()[changed],
+                }
+            )
+        )
+    if not parts:
+        return [], needs_llm
+    ch = pd.concat(parts, ignore_index=True).sort_values(["pos", "ci"], kind="stable")
+    pos = ch["pos"].to_numpy()
+    if "row_id" in df.columns:
+        raw = df["row_id"].to_numpy(dtype=object)[pos]
+        num = pd.to_numeric(pd.Series(raw), errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        rid_list = [int(n) if n == n and float(n).is_integer() else r for n, r in zip(num.tolist(), raw.tolist())]
+    else:
+        rid_list = pos.tolist()
+    edits = [
+        {"row_id": rid, "column": col, "old_value": ov, "new_value": nv, "rule": rule or "normalize"}
+        for rid, col, ov, nv, rule in zip(
+            rid_list,
+            ch["column"].tolist(),
+            ch["old_value"].tolist(),
+            ch["new_value"].tolist(),
+            ch["rule"].tolist(),
+        )
+    ]
+    return edits, needs_llm
+
+
+_stamp_cache: tuple[int, str] = (-1, "")
+
+
+def utc_stamp() -> str:
+    """Audit timestamp `YYYY-MM-DDTHH:MM:SSZ`, formatted once per wall-clock second."""
+    global _stamp_cache
+    sec = int(time.time())
+    cached_sec, text = _stamp_cache
+    if sec != cached_sec:
+        text = datetime.fromtimestamp(sec, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        _stamp_cache = (sec, text)
+    return text
+
+
+class AuditWriter:
+    """
+    Shared JSONL audit writer for the fixer drivers: keeps the file open, buffers records, and writes
+    them in batches under a durability policy (FIXER_AUDIT_FLUSH, see `from_env`):
+
+    - **chunk** (default): flush after each chunk's tool calls (`end_chunk()`)
+    - **N** (digits): flush every N records (and at chunk ends)
+    - **close**: flush only on `close()`
+
+    `close()` always flushes and fsyncs; FIXER_AUDIT_FSYNC=1 also fsyncs every flush. Thread-safe, so
+    tool calls executed in parallel can share one writer. Registered with atexit so a crash after the
+    apply loop still writes what was buffered.
+    """
+
+    def __init__(self, path: str | Path, flush_every: int | None = None, per_chunk: bool = True, fsync: bool = False):
+        self.path = Path(path)
+        self.flush_every = flush_every
+        self.per_chunk = per_chunk
+        self.fsync = fsync
+        self.n_records = 0
+        self.n_flushes = 0
+        self._buf: list[str] = []
+        self._lock = threading.Lock()
+        self._f = open(self.path, "a", encoding="utf-8")
+        atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls, path: str | Path) -> "AuditWriter":
+        policy = os.environ.get("FIXER_AUDIT_FLUSH", "chunk").strip().lower() or "chunk"
+        fsync = os.environ.get("FIXER_AUDIT_FSYNC", "").strip().lower() in ("1", "true", "yes")
+        if policy.isdigit() and int(policy) >= 1:
+            return cls(path, flush_every=int(policy), fsync=fsync)
+        if policy == "close":
+            return cls(path, per_chunk=False, fsync=fsync)
+        return cls(path, fsync=fsync)
+
+    @property
+    def policy(self) -> str:
+        base = f"every {self.flush_every} records" if self.flush_every else ("per chunk" if self.per_chunk else "on close")
+        return base + (" + fsync" if self.fsync else "")
+
+    def write(self, obj: dict[str, Any]) -> None:
+        line = json.dumps(obj, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._buf.append(line)
+            self.n_records += 1
+            if self.flush_every and len(self._buf) >= self.flush_every:
+                self._flush_locked(self.fsync)
+
+    def end_chunk(self) -> None:
+        if self.per_chunk or self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked(self.fsync)
+
+    def _flush_locked(self, fsync: bool) -> None:
+        if self._f.closed:
+            return
+        if self._buf:
+            self._f.write("".join(self._buf))
+            self._buf.clear()
+            self.n_flushes += 1
+        self._f.flush()
+        if fsync:
+            os.fsync(self._f.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            if self._f.closed:
+                return
+            self._flush_locked(True)
+            self._f.close()
+        atexit.unregister(self.close)
+
+
+def resume_requested(argv: list[str] | None = None) -> bool:
+    """`--resume` on the command line or FIXER_RESUME=1."""
+    args = sys.argv[1:] if argv is None else argv
+    return "--resume" in args or os.environ.get("FIXER_RESUME", "").strip() == "1"
+
+
+def chunk_key(*parts: Any) -> str:
+    """Content hash of everything that determines a chunk's LLM answer (model, prompts, tools, chunk CSV)."""
+    h = hashlib.sha256()
+    for part in parts:
+        text = part if isinstance(part, str) else json.dumps(part, sort_keys=True, ensure_ascii=False)
+        h.update(text.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class RunManifest:
+    """
+    Append-only JSONL record of finished chunks: content hash (`chunk_key`), chunk index, and the tool
+    calls the model returned. A fresh run truncates it; a resumed run (`--resume`) loads it first, so
+    chunks whose hash matches are answered from the file instead of the API. Their recorded tool calls
+    are applied again in chunk order, which rebuilds the working table and the audit log. Each record is
+    flushed and fsynced as it is written, so a crash loses at most the chunks still in flight.
+    """
+
+    def __init__(self, path: str | Path, resume: bool = False):
+        self.path = Path(path)
+        self.resume = resume
+        self.entries: dict[str, dict[str, Any]] = {}
+        self.n_resumed = 0
+        self.n_recorded = 0
+        self._lock = threading.Lock()
+        if resume and self.path.is_file():
+            raw = self.path.read_bytes()
+            complete = raw[: raw.rfind(b"\n") + 1]
+            if len(complete) < len(raw):
+                with open(self.path, "r+b") as f:
+                    f.truncate(len(complete))  # drop a torn last line so appends start on a fresh line
+            for line in complete.decode("utf-8", errors="replace").splitlines():
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(rec, dict) and rec.get("key"):
+                    self.entries[rec["key"]] = rec
+        self._f = open(self.path, "a" if resume else "w", encoding="utf-8")
+        atexit.register(self.close)
+
+    def get(self, key: str, chunk_index: int) -> dict[str, Any] | None:
+        """The recorded chunk result for `key` (counted in n_resumed), or None."""
+        rec = self.entries.get(key)
+        if rec is None:
+            return None
+        with self._lock:
+            self.n_resumed += 1
+        return {
+            "chunk_index": chunk_index,
+            "tool_calls": rec.get("tool_calls") or [],
+            "error": None,
+            "content": rec.get("content") or "",
+            "resumed": True,
+        }
+
+    def record(self, key: str, cr: dict[str, Any]) -> None:
+        rec = {
+            "key": key,
+            "chunk_index": cr.get("chunk_index"),
+            "ts": utc_stamp(),
+            "tool_calls": cr.get("tool_calls") or [],
+            "content": cr.get("content") or "",
+        }
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._f.closed:
+                return
+            self._f.write(line)
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self.entries[key] = rec
+            self.n_recorded += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()
+        atexit.unregister(self.close)
+
+
 def ollama_chat_once(
     base_url: str,
     api_key: str | None,
@@ -58,6 +600,23 @@ def ollama_chat_once(
     max_output_tokens: int | None = None,
 ) -> dict[str, Any]:
     """Single chat completion. Pass tools for tool-calling; pass format='json' for JSON mode."""
+    url, body, headers = _chat_request(base_url, api_key, model, messages, tools, format, max_output_tokens)
+    with httpx.Client(timeout=120.0) as client:
+        resp = client.post(url, json=body, headers=headers)
+        resp.raise_for_status()
+        data = resp.json()
+    return _chat_result(data)
+
+
+def _chat_request(
+    base_url: str,
+    api_key: str | None,
+    model: str,
+    messages: list[dict[str, Any]],
+    tools: list[dict[str, Any]] | None,
+    format: str | None,
+    max_output_tokens: int | None,
+) -> tuple[str, dict[str, Any], dict[str, str]]:
     url = base_url.rstrip("/") + "/api/chat"
     body: dict[str, Any] = {
         "model": model,
@@ -75,12 +634,10 @@ def ollama_chat_once(
     ak = (api_key or "").strip()
     if ak:
         headers["Authorization"] = f"Bearer {ak}"
+    return url, body, headers
 
-    with httpx.Client(timeout=120.0) as client:
-        resp = client.post(url, json=body, headers=headers)
-        resp.raise_for_status()
-        data = resp.json()
 
+def _chat_result(data: dict[str, Any]) -> dict[str, Any]:
     msg = data.get("message") or {}
     content = msg.get("content")
     if content is None:
@@ -91,6 +648,125 @@ def ollama_chat_once(
     return {"content": content, "message": msg, "raw": data}
 
 
+class ChunkDispatcher:
+    """
+    Chunk /api/chat requests from one asyncio loop on a background thread, over a single pooled
+    httpx.AsyncClient with at most `concurrency` requests in flight. submit() returns a
+    concurrent.futures.Future per chunk; drivers read them in chunk order, so each chunk's tool calls
+    run as soon as it lands while later chunks are still on the wire. With a RunManifest, chunks it
+    already holds resolve at once and new successful chunks are recorded. Results have the shape the
+    call_*_chunk_ollama helpers returned: chunk_index, tool_calls, error, content.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str | None,
+        model: str,
+        tools: list[dict[str, Any]] | None = None,
+        max_output_tokens: int | None = None,
+        concurrency: int = 1,
+        manifest: RunManifest | None = None,
+        timeout: float = 120.0,
+        chars_per_token: float = CHARS_PER_TOKEN,
+    ):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.tools = tools
+        self.max_output_tokens = max_output_tokens
+        self.concurrency = max(1, int(concurrency))
+        self.manifest = manifest
+        self.timeout = timeout
+        self.chars_per_token = chars_per_token
+        self.n_requests = 0
+        self.predicted_tokens = 0
+        self.actual_tokens = 0
+        self.n_connections = 0
+        self.wall_s = 0.0
+        self._t0: float | None = None  # set by the first submit() that sends a request
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="chunk-dispatcher", daemon=True)
+        self._thread.start()
+        self._client, self._sem = asyncio.run_coroutine_threadsafe(self._open(), self._loop).result()
+        atexit.register(self.close)
+
+    async def _open(self) -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        return httpx.AsyncClient(timeout=self.timeout, limits=limits), asyncio.Semaphore(self.concurrency)
+
+    async def _trace(self, event: str, info: dict[str, Any]) -> None:
+        if event.endswith("connect_tcp.complete"):
+            self.n_connections += 1
+
+    def submit(self, chunk_index: int, messages: list[dict[str, Any]], key: str | None = None) -> Future:
+        if key is not None and self.manifest is not None:
+            cr = self.manifest.get(key, chunk_index)
+            if cr is not None:
+                fut: Future = Future()
+                fut.set_result(cr)
+                return fut
+        predicted = estimate_prompt_tokens(messages, self.tools, self.chars_per_token)
+        if self._t0 is None:
+            self._t0 = time.perf_counter()
+        return asyncio.run_coroutine_threadsafe(self._post(chunk_index, messages, key, predicted), self._loop)
+
+    async def _post(
+        self, chunk_index: int, messages: list[dict[str, Any]], key: str | None, predicted: int
+    ) -> dict[str, Any]:
+        url, body, headers = _chat_request(
+            self.base_url, self.api_key, self.model, messages, self.tools, None, self.max_output_tokens
+        )
+        async with self._sem:
+            self.n_requests += 1
+            try:
+                resp = await self._client.post(url, json=body, headers=headers, extensions={"trace": self._trace})
+                resp.raise_for_status()
+                out = _chat_result(resp.json())
+            except Exception as e:
+                return {"chunk_index": chunk_index, "tool_calls": [], "error": str(e), "content": ""}
+        actual = out["raw"].get("prompt_eval_count")
+        if isinstance(actual, int):
+            self.predicted_tokens += predicted
+            self.actual_tokens += actual
+        cr = {
+            "chunk_index": chunk_index,
+            "tool_calls": out["message"].get("tool_calls") or [],
+            "error": None,
+            "content": out.get("content") or "",
+            "predicted_tokens": predicted,
+            "prompt_tokens": actual if isinstance(actual, int) else None,
+        }
+        if key is not None and self.manifest is not None:
+            await asyncio.to_thread(self.manifest.record, key, cr)
+        return cr
+
+    def summary(self) -> str:
+        wall = self.wall_s or (time.perf_counter() - self._t0 if self._t0 is not None else 0.0)
+        reused = max(0, self.n_requests - self.n_connections)
+        line = (
+            f"{self.n_requests} request(s) over {self.n_connections} connection(s) ({reused} reused), "
+            f"up to {self.concurrency} in flight, wall {wall:.1f}s"
+        )
+        if self.actual_tokens:
+            ratio = self.actual_tokens / self.predicted_tokens if self.predicted_tokens else 0.0
+            line += (
+                f"; prompt tokens {self.predicted_tokens} predicted vs {self.actual_tokens} actual "
+                f"(actual/predicted {ratio:.2f})"
+            )
+        return line
+
+    def close(self) -> None:
+        if self._loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self.wall_s = time.perf_counter() - self._t0 if self._t0 is not None else 0.0
+        atexit.unregister(self.close)
+
+
 def parse_function_arguments(raw: Any) -> dict[str, Any]:
     """Parse tool function.arguments (string JSON or dict) into a dict."""
     if raw is None:
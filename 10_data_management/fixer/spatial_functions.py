@@ -0,0 +1,152 @@
+# spatial_functions.py
+# Spatial helpers for the context tools: per-category POI STRtrees, cached parcel geometry, bulk context metrics.
+# Imported by fixer_spatial_context.py and bench_spatial_index.py only, so the other drivers skip the GIS stack.
+# Tim Fraser
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import STRtree
+
+
+class PoiIndex:
+    """
+    One STRtree per POI category, built once from point geometries in a metric CRS. nearest() and
+    count_within() are index queries instead of a distance / intersects pass over every POI of the
+    category. Ties resolve to the first POI in input order, as Series.idxmin did.
+    """
+
+    def __init__(self, geoms: Any, categories: Any, poi_ids: Any):
+        geoms = np.asarray(geoms, dtype=object)
+        cats = pd.Series(categories).astype(str).to_numpy()
+        ids = np.asarray(poi_ids)
+        self._trees: dict[str, tuple[STRtree, np.ndarray]] = {}
+        for cat in pd.unique(cats):
+            pos = np.flatnonzero(cats == cat)
+            self._trees[str(cat)] = (STRtree(geoms[pos]), ids[pos])
+
+    def __contains__(self, category: str) -> bool:
+        return category in self._trees
+
+    def __len__(self) -> int:
+        return len(self._trees)
+
+    def nearest(self, category: str, geom: Any) -> tuple[Any, float] | None:
+        """(poi_id, distance) of the nearest POI of `category`, or None when the category has no points."""
+        entry = self._trees.get(category)
+        if entry is None:
+            return None
+        tree, ids = entry
+        hit, dist = tree.query_nearest(geom, return_distance=True, all_matches=True)
+        if len(hit) == 0:
+            return None
+        k = int(np.argmin(hit))
+        return ids[hit[k]], float(dist[k])
+
+    def count_within(self, category: str, geom: Any) -> int:
+        """Number of POIs of `category` intersecting `geom` (e.g. a parcel buffer)."""
+        entry = self._trees.get(category)
+        if entry is None:
+            return 0
+        return int(len(entry[0].query(geom, predicate="intersects")))
+
+
+class ParcelGeometryCache:
+    """
+    Parcel lookups shared by the spatial tools, built once at load: parcel_id (as str) → first row
+    position, centroids computed up front, and buffers memoized per (position, radius) in a bounded LRU.
+    `geometry_position` is None for ids that occur more than once, like the old exactly-one-match check.
+    """
+
+    def __init__(self, parcels: gpd.GeoDataFrame, id_col: str = "parcel_id", max_buffers: int = 4096):
+        self.labels = parcels.index
+        self._first: dict[str, int] = {}
+        self._dup: set[str] = set()
+        for i, pid in enumerate(parcels[id_col].astype(str).tolist()):
+            if pid in self._first:
+                self._dup.add(pid)
+            else:
+                self._first[pid] = i
+        self.geoms = np.asarray(parcels.geometry.values, dtype=object)
+        self.centroids = shapely.centroid(self.geoms)
+        self.buffer = lru_cache(maxsize=max_buffers)(self._buffer)
+
+    def __len__(self) -> int:
+        return len(self.geoms)
+
+    def label(self, pid: str) -> Any | None:
+        """Index label of the first row with this parcel_id (the row tools write to), or None."""
+        pos = self._first.get(pid)
+        return None if pos is None else self.labels[pos]
+
+    def geometry_position(self, pid: str) -> int | None:
+        """Row position of the parcel's geometry, or None when the id is unknown or not unique."""
+        return None if pid in self._dup else self._first.get(pid)
+
+    def _buffer(self, pos: int, radius: float) -> Any:
+        return self.geoms[pos].buffer(radius)
+
+
+def compute_context_metrics(
+    parcels_m: gpd.GeoDataFrame,
+    pois_m: gpd.GeoDataFrame,
+    categories: list[str],
+    buffers: tuple[int, ...] = (400, 800),
+    category_col: str = "normalized_category",
+    id_col: str = "poi_id",
+    block_rows: int = 5000,
+) -> pd.DataFrame:
+    """
+    Every context metric for every parcel in one vectorized pass (both frames in the same metric CRS):
+    `ctx_nearest_{cat}_m` / `ctx_nearest_{cat}_poi_id` from one sjoin_nearest of parcel centroids per
+    category, and `ctx_n_{cat}_{buf}` from one STRtree intersects query per block of parcel buffers,
+    counted with bincount. Same numbers as the per-call tools: geom.buffer() segments, centroid
+    distances, ties to the first POI in input order. Indexed like `parcels_m`; missing = NaN / <NA>.
+    """
+    n = len(parcels_m)
+    geoms = np.asarray(parcels_m.geometry.values, dtype=object)
+    cats = pois_m[category_col].astype(str).to_numpy()
+    out: dict[str, Any] = {}
+
+    centroids = gpd.GeoDataFrame(geometry=shapely.centroid(geoms), crs=parcels_m.crs)
+    pts = gpd.GeoDataFrame(
+        {"_cat": cats, "_id": pois_m[id_col].to_numpy(), "_pos": np.arange(len(pois_m))},
+        geometry=np.asarray(pois_m.geometry.values, dtype=object),
+        crs=pois_m.crs,
+    )
+    for cat in categories:
+        dist = np.full(n, np.nan)
+        ids = pd.array([pd.NA] * n, dtype="Int64")
+        sub = pts[pts["_cat"] == cat]
+        if len(sub):
+            j = gpd.sjoin_nearest(centroids, sub, how="inner", distance_col="_d")
+            j = j.sort_values("_pos", kind="stable")
+            j = j[~j.index.duplicated(keep="first")]
+            pos = j.index.to_numpy()
+            dist[pos] = j["_d"].to_numpy(dtype=float)
+            ids[pos] = j["_id"].to_numpy()
+        out[f"ctx_nearest_{cat}_m"] = dist
+        out[f"ctx_nearest_{cat}_poi_id"] = ids
+
+    code_of = {c: k for k, c in enumerate(categories)}
+    codes = np.array([code_of.get(c, -1) for c in cats], dtype=np.int64)
+    tree = STRtree(np.asarray(pois_m.geometry.values, dtype=object))
+    n_cat = len(categories)
+    for buf in buffers:
+        counts = np.zeros(n * n_cat, dtype=np.int64)
+        for start in range(0, n, max(1, block_rows)):
+            zones = shapely.buffer(geoms[start : start + block_rows], float(buf), quad_segs=16)  # = geom.buffer()
+            zi, pi = tree.query(zones, predicate="intersects")
+            keep = codes[pi] >= 0
+            counts += np.bincount((zi[keep] + start) * n_cat + codes[pi[keep]], minlength=n * n_cat)
+        counts = counts.reshape(n, n_cat)
+        for cat, k in code_of.items():
+            out[f"ctx_n_{cat}_{buf}"] = counts[:, k]
+
+    return pd.DataFrame(out, index=parcels_m.index)
@@ -3,7 +3,12 @@
 
 from __future__ import annotations
 
+import json
+import os
 import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
 import pandas as pd
@@ -11,7 +16,46 @@ import pandas as pd
 fixer_root = Path(__file__).resolve().parent.parent
 sys.path.insert(0, str(fixer_root))
 
-from functions import parse_function_arguments, split_df_into_row_chunks
+from functions import (
+    AuditWriter,
+    ChunkDispatcher,
+    RunManifest,
+    apply_set_cell_batch,
+    build_row_index,
+    chunk_key,
+    csv_row_chars,
+    estimate_prompt_tokens,
+    parse_function_arguments,
+    preclean_inventory,
+    resume_requested,
+    shortened_rows,
+    split_df_into_row_chunks,
+    split_df_into_token_chunks,
+)
+from spatial_functions import ParcelGeometryCache, PoiIndex, compute_context_metrics
+
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    """Local stand-in for Ollama /api/chat: one set_cell tool call per request; HTTP 500 when the prompt is 'fail'."""
+
+    served = 0
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).served += 1
+        if body["messages"][-1]["content"] == "fail":
+            self.send_response(500)
+            self.end_headers()
+            return
+        out = json.dumps({"message": {"content": "", "tool_calls": [{"function": {"name": "set_cell"}}]}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args) -> None:
+        pass
 
 
 def apply_set_cell(df: pd.DataFrame, args: dict) -> pd.DataFrame:
@@ -48,6 +92,29 @@ def main() -> None:
     assert len(ch30) == 3 and len(ch30[0]) == 10 and len(ch30[1]) == 10 and len(ch30[2]) == 10
     print("   OK")
 
+    print("test_fixer_csv_helpers: split_df_into_token_chunks + estimate_prompt_tokens ...")
+    d = pd.DataFrame({"row_id": [str(i) for i in range(1, 21)], "note": ["a, \"b\"", "x" * 30] * 10})
+    assert csv_row_chars(d).tolist() == [len(ln) + 1 for ln in d.to_csv(index=False).splitlines()[1:]]
+    msgs = [{"role": "system", "content": "s" * 35}, {"role": "user", "content": ""}]
+    assert estimate_prompt_tokens(msgs, chars_per_token=3.5) == 10 + 4 + 4
+    assert estimate_prompt_tokens(msgs, [{"type": "function"}], 3.5) > 18
+    tc = split_df_into_token_chunks(d, 60, fixed_tokens=20, chars_per_token=3.5)  # 133 chars for header + rows
+    assert sum(len(c) for c in tc) == 20 and pd.concat(tc).equals(d)
+    assert all(20 + len(c.to_csv(index=False)) / 3.5 <= 60 for c in tc) and len(tc) == 5
+    assert [len(c) for c in split_df_into_token_chunks(d, 10_000, max_rows=8)] == [8, 8, 4]
+    wide = d.copy()
+    wide.loc[3, "note"] = "y" * 5000
+    tw = split_df_into_token_chunks(wide, 200, fixed_tokens=50, max_rows=10, chars_per_token=3.5)
+    big = [c for c in tw if "4" in c["row_id"].tolist()]
+    assert len(big) == 1 and len(big[0]) == 1 and "…[+" in big[0]["note"].iloc[0]
+    assert len(big[0].to_csv(index=False)) < 5000 and len(wide.loc[3, "note"]) == 5000
+    assert sum(len(c) for c in tw) == 20 and shortened_rows(tw, "row_id") == ["4 (note)"]
+    wide["excerpt"] = "z" * 600
+    tk = split_df_into_token_chunks(wide, 200, 50, 10, 3.5, keep_cols=("row_id", "excerpt"))
+    cut = [c for c in tk if c.attrs.get("shortened")]
+    assert len(cut) == 1 and cut[0]["excerpt"].iloc[0] == "z" * 600 and "…[+" in cut[0]["note"].iloc[0]
+    print("   OK")
+
     print("test_fixer_csv_helpers: apply_set_cell ...")
     df = pd.DataFrame({"row_id": ["1", "2", "3"], "qty": ["0", "5", "1 1"]})
     df = apply_set_cell(df, {"row_id": 1, "column_name": "qty", "new_value": "", "expected_old_value": "0"})
@@ -58,6 +125,204 @@ def main() -> None:
     assert str(df2.loc[df2["row_id"] == "2", "qty"].iloc[0]) == "5"
     print("   OK")
 
+    print("test_fixer_csv_helpers: build_row_index + apply_set_cell_batch ...")
+    df = pd.DataFrame(
+        {"row_id": ["1", "2", "3", "x", "2", "4.0"], "qty": ["0", "5", "1 1", "7", "8", "2 0"], "cat": ["elec"] * 6}
+    )
+    idx = build_row_index(df)
+    assert idx == {1: 0, 2: 1, 3: 2, 4: 5}
+    res, applied = apply_set_cell_batch(
+        df,
+        [
+            {"row_id": 1, "column_name": "qty", "new_value": "", "expected_old_value": "0"},
+            {"row_id": "3", "column_name": "qty", "new_value": "11", "expected_old_value": "1 1"},
+            {"row_id": 2, "column_name": "qty", "new_value": "9", "expected_old_value": "wrong"},
+            {"row_id": 4, "column_name": "cat", "new_value": "Electronics"},
+            {"row_id": 4, "column_name": "cat", "new_value": "Food", "expected_old_value": "Electronics"},
+            {"row_id": 1, "column_name": "row_id", "new_value": "9"},
+            {"row_id": 99, "column_name": "qty", "new_value": "1"},
+            {"row_id": "abc", "column_name": "qty", "new_value": "1"},
+            {"row_id": 1, "column_name": "nope", "new_value": "1"},
+        ],
+        idx,
+    )
+    assert res[0] == "OK: row_id=1 qty updated." and res[1] == "OK: row_id=3 qty updated."
+    assert res[2].startswith("Skipped: expected_old_value mismatch for row_id=2")
+    assert res[4] == "OK: row_id=4 cat updated."  # second edit of the same cell sees the first
+    assert res[5] == "Error: row_id column cannot be edited."
+    assert res[6] == "Error: no row with row_id=99"
+    assert res[7] == "Error: row_id must be integer-like."
+    assert res[8] == "Error: unknown column nope"
+    assert list(df["qty"]) == ["", "5", "11", "7", "8", "2 0"]
+    assert df.at[5, "cat"] == "Food" and df.at[4, "qty"] == "8"
+    assert [k for k, _ in applied] == [0, 1, 3, 4]
+    assert applied[3][1] == {"row_id": 4, "column": "cat", "old_value": "Electronics", "new_value": "Food"}
+    print("   OK")
+
+    print("test_fixer_csv_helpers: preclean_inventory ...")
+    df = pd.DataFrame(
+        {
+            "row_id": ["1", "2", "3", "4", "5", "6", "7"],
+            "qty_on_hand": ["12 pcs", "2 0", "0", "-99999", "two", "2025-01-15", "lots"],
+            "last_restock": ["2024-01-15", "2024-13-01", "01/15/2024", "", "not-a-date", "2024-02-29", "2023-02-29"],
+            "category": ["ELEC", "cafeteria", "Electronics ", "food_service", "Retail", "grocery", ""],
+        }
+    )
+    edits, needs_llm = preclean_inventory(df)
+    assert list(df["qty_on_hand"]) == ["12", "20", "", "", "2", "", "lots"]
+    assert list(df["last_restock"]) == ["2024-01-15", "", "", "", "", "2024-02-29", ""]
+    assert list(df["category"]) == ["Electronics", "Food", "Electronics", "Food", "Retail", "Food", ""]
+    assert list(needs_llm) == [False, False, False, False, True, False, True]
+    assert edits[0] == {"row_id": 1, "column": "qty_on_hand", "old_value": "12 pcs", "new_value": "12", "rule": "strip_units"}
+    assert {e["rule"] for e in edits if e["row_id"] == 3} == {"zero_placeholder", "invalid_date", "trim"}
+    assert [e["row_id"] for e in edits] == sorted(e["row_id"] for e in edits)
+    print("   OK")
+
+    print("test_fixer_csv_helpers: AuditWriter ...")
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td) / "audit.jsonl"
+        w = AuditWriter(path, flush_every=50)
+        threads = [
+            threading.Thread(target=lambda t=t: [w.write({"t": t, "i": i}) for i in range(100)]) for t in range(4)
+        ]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        assert len(path.read_text(encoding="utf-8").splitlines()) == 400 and w.n_flushes == 8
+        w.write({"t": "tail"})
+        w.close()
+        w.close()
+        rows = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+        assert len(rows) == 401 and rows[-1] == {"t": "tail"}
+        assert sorted(r["i"] for r in rows if r["t"] == 2) == list(range(100))
+
+        os.environ["FIXER_AUDIT_FLUSH"] = "close"
+        w = AuditWriter.from_env(Path(td) / "close.jsonl")
+        w.write({"a": 1})
+        w.end_chunk()
+        assert (Path(td) / "close.jsonl").read_text(encoding="utf-8") == "" and w.policy == "on close"
+        w.close()
+        assert (Path(td) / "close.jsonl").read_text(encoding="utf-8") == '{"a": 1}\n'
+        os.environ["FIXER_AUDIT_FLUSH"] = "chunk"
+        w = AuditWriter.from_env(Path(td) / "chunk.jsonl")
+        w.write({"a": 1})
+        w.end_chunk()
+        assert (Path(td) / "chunk.jsonl").read_text(encoding="utf-8") == '{"a": 1}\n'
+        w.close()
+        del os.environ["FIXER_AUDIT_FLUSH"]
+    print("   OK")
+
+    print("test_fixer_csv_helpers: RunManifest resume through ChunkDispatcher (local fake /api/chat) ...")
+    assert chunk_key("m", [{"b": 1, "a": 2}], "csv") == chunk_key("m", [{"a": 2, "b": 1}], "csv")
+    assert chunk_key("m", "a", "bc") != chunk_key("m", "ab", "c")
+    assert resume_requested(["--resume"]) and not resume_requested([])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td) / "manifest.jsonl"
+
+        def run(m: RunManifest, prompts: dict[str, str]) -> list[dict]:
+            d = ChunkDispatcher(url, None, "m", manifest=m, timeout=5.0)
+            futs = [d.submit(i, [{"role": "user", "content": p}], key=k) for i, (k, p) in enumerate(prompts.items(), 1)]
+            res = [f.result() for f in futs]
+            d.close()
+            m.close()
+            return res
+
+        res = run(RunManifest(path), {"k1": "1", "k2": "fail"})
+        assert res[0]["error"] is None and res[1]["error"]  # failed chunks are not recorded
+        with open(path, "a", encoding="utf-8") as f:
+            f.write('{"key": "k3", "tool_ca')  # torn write from a crash
+        m = RunManifest(path, resume=True)
+        assert set(m.entries) == {"k1"}
+        res = run(m, {"k1": "1", "k2": "2"})
+        assert FakeChatHandler.served == 3 and res[0]["resumed"] and not res[1].get("resumed")
+        assert res[0]["tool_calls"][0]["function"]["name"] == "set_cell"
+        keys = [json.loads(line)["key"] for line in path.read_text(encoding="utf-8").splitlines()]
+        assert keys == ["k1", "k2"] and m.n_resumed == 1 and m.n_recorded == 1
+        m = RunManifest(path)
+        m.close()
+        assert path.read_text(encoding="utf-8") == ""
+    server.shutdown()
+    server.server_close()
+    print("   OK")
+
+    print("test_fixer_csv_helpers: ChunkDispatcher (refused port + manifest hit, no server) ...")
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        dead = f"http://127.0.0.1:{sock.getsockname()[1]}"
+    with tempfile.TemporaryDirectory() as td:
+        m = RunManifest(Path(td) / "manifest.jsonl")
+        m.record("done", {"chunk_index": 2, "tool_calls": [{"function": {"name": "set_cell"}}], "content": ""})
+        d = ChunkDispatcher(dead, None, "m", concurrency=2, manifest=m, timeout=5.0)
+        futs = [d.submit(i, [{"role": "user", "content": str(i)}], key="done" if i == 2 else f"k{i}") for i in (1, 2, 3)]
+        res = [f.result() for f in futs]
+        d.close()
+        d.close()
+        m.close()
+        assert [r["chunk_index"] for r in res] == [1, 2, 3]
+        assert res[0]["error"] and res[2]["error"] and res[1]["error"] is None and res[1]["resumed"]
+        assert d.n_requests == 2 and d.n_connections == 0 and m.n_recorded == 1 and "2 request(s)" in d.summary()
+    print("   OK")
+
+    print("test_fixer_csv_helpers: PoiIndex + compute_context_metrics ...")
+    from shapely import Point
+
+    idx = PoiIndex(
+        [Point(0, 10), Point(10, 0), Point(0, -10), Point(500, 0), Point(3, 0)],
+        ["transport", "transport", "retail", "transport", "retail"],
+        [7, 8, 9, 10, 11],
+    )
+    assert len(idx) == 2 and "transport" in idx and "parking" not in idx
+    assert idx.nearest("transport", Point(0, 0)) == (7, 10.0)  # tie with poi 8: first in input order
+    assert idx.nearest("retail", Point(0, 0)) == (11, 3.0)
+    assert idx.nearest("parking", Point(0, 0)) is None
+    assert idx.count_within("transport", Point(0, 0).buffer(400)) == 2
+    assert idx.count_within("transport", Point(0, 0).buffer(600)) == 3
+    assert idx.count_within("parking", Point(0, 0).buffer(600)) == 0
+
+    import geopandas as gpd
+
+    pois = gpd.GeoDataFrame(
+        {"poi_id": [7, 8, 9, 10, 11], "normalized_category": ["transport", "transport", "retail", "transport", "retail"]},
+        geometry=[Point(0, 10), Point(10, 0), Point(0, -10), Point(500, 0), Point(3, 0)],
+        crs=32617,
+    )
+    parcels = gpd.GeoDataFrame(geometry=[Point(0, 0).buffer(1), Point(2000, 0).buffer(1)], crs=32617)
+    m = compute_context_metrics(parcels, pois, ["transport", "retail", "parking"], buffers=(400, 800))
+    for i, g in enumerate(parcels.geometry):
+        for cat in ("transport", "retail", "parking"):
+            hit = idx.nearest(cat, g.centroid)
+            if hit is None:
+                assert pd.isna(m.at[i, f"ctx_nearest_{cat}_m"]) and pd.isna(m.at[i, f"ctx_nearest_{cat}_poi_id"])
+            else:
+                assert m.at[i, f"ctx_nearest_{cat}_poi_id"] == hit[0]
+                assert abs(m.at[i, f"ctx_nearest_{cat}_m"] - hit[1]) < 1e-9
+            for buf in (400, 800):
+                assert m.at[i, f"ctx_n_{cat}_{buf}"] == idx.count_within(cat, g.buffer(buf))
+    assert m.at[0, "ctx_nearest_transport_poi_id"] == 7 and m.at[1, "ctx_n_transport_800"] == 0
+    print("   OK")
+
+    print("test_fixer_csv_helpers: ParcelGeometryCache ...")
+    cells = gpd.GeoDataFrame(
+        {"parcel_id": [101, 102, 102, 103]},
+        geometry=[Point(i * 100, 0).buffer(10) for i in range(4)],
+        index=[10, 11, 12, 13],
+        crs=32617,
+    )
+    pc = ParcelGeometryCache(cells)
+    assert len(pc) == 4 and pc.label("101") == 10 and pc.label("102") == 11 and pc.label("999") is None
+    assert pc.geometry_position("103") == 3 and pc.geometry_position("102") is None
+    assert pc.centroids[3].equals(cells.geometry.iloc[3].centroid)
+    b1 = pc.buffer(3, 400.0)
+    assert pc.buffer(3, 400.0) is b1 and b1.equals(cells.geometry.iloc[3].buffer(400.0))
+    assert pc.buffer.cache_info().hits == 1
+    print("   OK")
+
     print("test_fixer_csv_helpers: parse_function_arguments ...")
     assert parse_function_arguments(None) == {}
     assert parse_function_arguments("{}") == {}